@@ -0,0 +1 @@
+"""压测脚本（连真实 MySQL 运行，不随机器人部署）：python -m bench.<name>"""
@@ -0,0 +1,312 @@
+"""
+红包并发领取压测
+
+    python -m bench.claims                          # 默认 10/100/1000 份，领取人数为份数的 2 倍
+    python -m bench.claims --sizes 100 --claimers 500 --path dispatcher
+    python -m bench.claims --path atomic            # 旧的 SELECT ... FOR UPDATE 路径，做对比
+    python -m bench.claims --taps 3                 # 每人连点 3 次，验证重复领取拒绝
+
+--path:
+  callback   ：完整走 rp_callback（假 Bot / 假 Update），含重复领取拦截与面板刷新
+  dispatcher ：直接调 services.claims.claim
+  atomic     ：直接调 models.claim_share_atomic（不经调度器）
+
+份数 ≥ LAZY_SHARES_MIN_COUNT 的红包走份额延迟落库（可用环境变量调整对比）。
+连接 .env 里的 MYSQL_*（需先 python -m src.migrate up），只允许本机数据库，
+--force 可跳过该检查。压测用户 id 从 --user-base 开始，结束后按 id 范围删除
+（users 外键级联删除钱包 / 红包 / 份额 / 账变）。
+输出吞吐、p50/p95/p99 延迟、锁等待/死锁次数，并校验：
+  份额之和 = 红包总额、已领计数/金额与份额一致、无人重复领取、
+  每个压测用户钱包余额 = 其账变金额之和。任一校验失败时退出码为 1。
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+# 压测不需要真实的 Bot / 链上配置；只补缺省值，已配置的保持不变
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("WEBHOOK_MODE", "polling")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("FERNET_KEY", base64.urlsafe_b64encode(b"\0" * 32).decode())
+os.environ.setdefault("USDT_CONTRACT", "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t")
+os.environ.setdefault("AGGREGATE_ADDRESS", "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t")
+os.environ.setdefault("AGGREGATE_PRIVKEY_ENC", "bench")
+
+from src.config import MYSQL_HOST, MYSQL_DB                        # noqa: E402
+from src.db import init_pool, close_pool, fetchone, fetchall, execute, transaction  # noqa: E402
+from src.migrate import pending_migrations                          # noqa: E402
+from src.models import (                                            # noqa: E402
+    create_red_packet, prepare_red_packet_shares, set_red_packet_status, add_ledger,
+    claim_share_atomic, AlreadyClaimed, lazy_share_amounts,
+)
+from src.services import claims                                     # noqa: E402
+from src.services.panels import refresher as panel_refresher        # noqa: E402
+from src.utils import reqcache                                      # noqa: E402
+from src.handlers.red_packet import rp_callback                     # noqa: E402
+
+_LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+_USER_SPAN = 1_000_000          # 每轮压测占用的用户 id 区间
+_LOCK_WAIT_ERRNO = 1205
+_DEADLOCK_ERRNO = 1213
+
+
+# ===== 假 Telegram 对象 =====
+
+class FakeBot:
+    """只记录调用次数的 Bot：edit_message_text / send_message 等一律成功"""
+    username = "bench_bot"
+
+    def __init__(self):
+        self.calls = {}
+
+    def __getattr__(self, name):
+        async def _call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return None
+        return _call
+
+class FakeUser(SimpleNamespace):
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name or ''}".strip()
+
+class FakeCallbackQuery:
+    def __init__(self, data: str, user: FakeUser, inline_message_id: str):
+        self.data = data
+        self.from_user = user
+        self.inline_message_id = inline_message_id
+        self.message = None
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        if text:
+            self.answers.append(text)
+
+
+# ===== 工具 =====
+
+def _pct(xs, p):
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))]
+
+def _errno(e: BaseException):
+    return e.args[0] if getattr(e, "args", None) and isinstance(e.args[0], int) else None
+
+async def _make_user(uid: int, balance: Decimal = Decimal("0")):
+    await execute(
+        "INSERT INTO users(id, username, first_name, display_name, created_at) VALUES(%s,%s,%s,%s,NOW())",
+        (uid, f"bench{uid}", "bench", f"bench{uid}")
+    )
+    # tron_address 预先填好，ensure_user_and_wallet 不会去生成链上地址
+    await execute(
+        "INSERT INTO user_wallets(user_id, usdt_trc20_balance, tron_address, created_at) VALUES(%s,%s,%s,NOW())",
+        (uid, float(balance), f"TBENCH{uid}")
+    )
+    if balance:
+        await add_ledger(uid, "adjust", float(balance), 0.0, float(balance), "bench", 0, "压测初始余额", f"bench_init_{uid}")
+
+async def _cleanup(user_base: int):
+    await execute("DELETE FROM users WHERE id>=%s AND id<%s", (user_base, user_base + _USER_SPAN))
+
+async def _create_paid_packet(owner_id: int, total: Decimal, count: int) -> int:
+    """与 rppwd_callback 支付分支一致：扣余额 → 准备份额（份数够大则延迟落库）→ 置 paid → 记账；再置为 sent"""
+    rp_id = await create_red_packet(owner_id, "random", "USDT-trc20", float(total), count, None, None, None)
+    async with transaction() as conn:
+        w = await fetchone("SELECT usdt_trc20_balance FROM user_wallets WHERE user_id=%s FOR UPDATE",
+                           (owner_id,), conn=conn)
+        before = Decimal(str(w["usdt_trc20_balance"]))
+        after = before - total
+        await execute("UPDATE user_wallets SET usdt_trc20_balance=%s WHERE user_id=%s",
+                      (float(after), owner_id), conn=conn)
+        rp = await fetchone("SELECT * FROM red_packets WHERE id=%s", (rp_id,), conn=conn)
+        await prepare_red_packet_shares(rp, conn=conn)
+        await set_red_packet_status(rp_id, "paid", conn=conn)
+        await add_ledger(owner_id, "redpacket_send", -float(total), float(before), float(after),
+                         "red_packets", rp_id, "压测发红包", f"red_send_{rp['rp_no']}", conn=conn)
+    await set_red_packet_status(rp_id, "sent")
+    return rp_id
+
+
+# ===== 单个领取者 =====
+
+async def _claim_once(path: str, rp_id: int, user: FakeUser, bot: FakeBot) -> str:
+    """返回结果分类：ok / empty / closed / dup / lock_wait / deadlock / error"""
+    try:
+        if path == "callback":
+            reqcache.begin()   # 与 main.py group=-1 的 TypeHandler 一致
+            try:
+                q = FakeCallbackQuery(f"rp_claim:{rp_id}", user, f"bench-{rp_id}")
+                update = SimpleNamespace(callback_query=q, effective_user=user,
+                                         effective_message=None, effective_chat=None)
+                context = SimpleNamespace(bot=bot, user_data={}, chat_data={}, bot_data={})
+                await rp_callback(update, context)
+            finally:
+                reqcache.end()
+            last = q.answers[-1] if q.answers else ""
+            if last.startswith("领取成功"):
+                return "ok"
+            if "已被抢完" in last:
+                return "empty"
+            if "不可领取" in last:
+                return "closed"    # 红包已抢完并置为 finished
+            if "已经领过" in last:
+                return "dup"
+            return "error"
+        if path == "dispatcher":
+            ret = await claims.claim(rp_id, user.id)
+        else:
+            ret = await claim_share_atomic(rp_id, user.id)
+        return "ok" if ret else "empty"
+    except AlreadyClaimed:
+        return "dup"
+    except Exception as e:
+        no = _errno(e)
+        if no == _LOCK_WAIT_ERRNO:
+            return "lock_wait"
+        if no == _DEADLOCK_ERRNO:
+            return "deadlock"
+        print(f"  ! 领取异常 user={user.id}: {e!r}", file=sys.stderr)
+        return "error"
+
+
+# ===== 单轮压测 =====
+
+async def run_size(size: int, claimers: int, taps: int, path: str, user_base: int) -> bool:
+    owner_id = user_base
+    total = Decimal(size) * Decimal("1.00")
+    await _make_user(owner_id, total)
+    users = [FakeUser(id=user_base + i, username=f"bench{user_base + i}", first_name="bench", last_name="")
+             for i in range(1, claimers + 1)]
+    for u in users:
+        await _make_user(u.id)
+    rp_id = await _create_paid_packet(owner_id, total, size)
+    lazy = (await fetchone("SELECT split_seed FROM red_packets WHERE id=%s", (rp_id,)))["split_seed"] is not None
+
+    bot = FakeBot()
+    lat_ms = []
+    outcomes = {}
+
+    async def _one(u):
+        t0 = time.perf_counter()
+        res = await _claim_once(path, rp_id, u, bot)
+        lat_ms.append((time.perf_counter() - t0) * 1000)
+        outcomes[res] = outcomes.get(res, 0) + 1
+
+    jobs = [u for u in users for _ in range(taps)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_one(u) for u in jobs))
+    wall = time.perf_counter() - t0
+    await panel_refresher.drain()
+
+    ok = await _check_invariants(rp_id, size, total, outcomes, claimers, user_base)
+    print(
+        f"[{path}] shares={size}{' lazy' if lazy else ''} claimers={claimers} taps={taps} | "
+        f"{len(jobs)} req in {wall:.2f}s = {len(jobs) / wall:.0f} req/s, {outcomes.get('ok', 0) / wall:.0f} claims/s | "
+        f"p50 {_pct(lat_ms, .50):.1f}ms p95 {_pct(lat_ms, .95):.1f}ms p99 {_pct(lat_ms, .99):.1f}ms | "
+        f"outcomes {dict(sorted(outcomes.items()))} | panel edits {bot.calls.get('edit_message_text', 0)} | "
+        f"invariants {'OK' if ok else 'FAIL'}"
+    )
+    return ok
+
+async def _check_invariants(rp_id: int, size: int, total: Decimal, outcomes: dict, claimers: int, user_base: int) -> bool:
+    ok = True
+    n_ok = outcomes.get("ok", 0)
+
+    def fail(msg):
+        nonlocal ok
+        ok = False
+        print(f"  ✗ {msg}")
+
+    rp = await fetchone("SELECT * FROM red_packets WHERE id=%s", (rp_id,))
+    agg = await fetchone(
+        "SELECT COUNT(*) AS n, COALESCE(SUM(amount),0) AS s_all, "
+        "COALESCE(SUM(CASE WHEN claimed_by IS NOT NULL THEN amount END),0) AS s_claimed, "
+        "SUM(claimed_by IS NOT NULL) AS n_claimed "
+        "FROM red_packet_shares WHERE red_packet_id=%s",
+        (rp_id,)
+    )
+    n_claimed = int(agg["n_claimed"] or 0)
+    if rp["split_seed"] is not None:
+        # 延迟落库：只有已领份额有行；整份拆分按种子重算
+        amounts = lazy_share_amounts(rp)
+        if len(amounts) != size or sum(amounts) != total:
+            fail(f"种子重算的拆分 {len(amounts)} 份 / {sum(amounts)} ≠ {size} 份 / {total}")
+        if int(agg["n"]) != n_claimed:
+            fail(f"延迟落库红包存在未领取的份额行：{int(agg['n']) - n_claimed}")
+    else:
+        if int(agg["n"]) != size:
+            fail(f"份额数 {agg['n']} ≠ {size}")
+        if Decimal(str(agg["s_all"])) != total:
+            fail(f"份额之和 {agg['s_all']} ≠ 总额 {total}")
+    if n_claimed != n_ok:
+        fail(f"已领份额 {n_claimed} ≠ 成功领取次数 {n_ok}")
+    if n_claimed != min(size, claimers) and not any(k in outcomes for k in ("lock_wait", "deadlock", "error")):
+        fail(f"已领份额 {n_claimed} ≠ min(份数, 人数) {min(size, claimers)}")
+    if int(rp["claimed_count"]) != n_claimed or Decimal(str(rp["claimed_amount"])) != Decimal(str(agg["s_claimed"])):
+        fail(f"红包计数 {rp['claimed_count']}/{rp['claimed_amount']} 与份额 {n_claimed}/{agg['s_claimed']} 不一致")
+
+    dups = await fetchall(
+        "SELECT claimed_by, COUNT(*) AS c FROM red_packet_shares "
+        "WHERE red_packet_id=%s AND claimed_by IS NOT NULL GROUP BY claimed_by HAVING COUNT(*)>1",
+        (rp_id,)
+    )
+    if dups:
+        fail(f"{len(dups)} 个用户重复领取")
+
+    mismatch = await fetchall(
+        "SELECT w.user_id, w.usdt_trc20_balance AS bal, COALESCE(SUM(l.amount),0) AS led "
+        "FROM user_wallets w LEFT JOIN ledger l ON l.user_id=w.user_id "
+        "WHERE w.user_id>=%s AND w.user_id<=%s "
+        "GROUP BY w.user_id, w.usdt_trc20_balance HAVING bal <> led",
+        (user_base, user_base + claimers)
+    )
+    if mismatch:
+        fail(f"{len(mismatch)} 个钱包余额与账变之和不一致，例如 {mismatch[0]}")
+    return ok
+
+
+async def main_async(args) -> int:
+    await init_pool()
+    try:
+        pending = await pending_migrations()
+        if pending:
+            print(f"有未执行的迁移：{[f'{v:04d}_{n}' for v, n, _ in pending]}，请先运行 python -m src.migrate up")
+            return 2
+        all_ok = True
+        for i, size in enumerate(args.sizes):
+            base = args.user_base + i * _USER_SPAN
+            claimers_n = args.claimers or size * 2
+            await _cleanup(base)
+            try:
+                all_ok &= await run_size(size, claimers_n, args.taps, args.path, base)
+            finally:
+                if not args.keep:
+                    await _cleanup(base)
+        return 0 if all_ok else 1
+    finally:
+        await close_pool()
+
+def main():
+    ap = argparse.ArgumentParser(description="红包并发领取压测")
+    ap.add_argument("--sizes", default="10,100,1000", type=lambda s: [int(x) for x in s.split(",") if x])
+    ap.add_argument("--claimers", type=int, default=0, help="并发领取人数，默认份数的 2 倍")
+    ap.add_argument("--taps", type=int, default=1, help="每人点击次数（>1 用于验证重复领取拦截）")
+    ap.add_argument("--path", choices=("callback", "dispatcher", "atomic"), default="callback")
+    ap.add_argument("--user-base", type=int, default=int(os.getenv("BENCH_USER_BASE", "9000000000")))
+    ap.add_argument("--keep", action="store_true", help="保留压测数据便于排查")
+    ap.add_argument("--force", action="store_true", help="允许连接非本机 MySQL")
+    args = ap.parse_args()
+    if MYSQL_HOST not in _LOCAL_HOSTS and not args.force:
+        print(f"MYSQL_HOST={MYSQL_HOST} 不是本机数据库（{MYSQL_DB}），压测会写入并删除数据；确认请加 --force")
+        sys.exit(2)
+    sys.exit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
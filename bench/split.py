@@ -0,0 +1,114 @@
+"""
+红包拆分算法校验 + 微基准（纯 CPU，不需要数据库）
+
+    python -m bench.split                                # 默认 10/100/1000/10000/100000 份
+    python -m bench.split --counts 1000,100000 --rounds 5
+    python -m bench.split --cases 2000                   # 加大随机性质校验的用例数
+
+性质校验（随机金额 / 份数 / 种子，覆盖 0.01*count 附近的边界）：
+  每份均为两位小数、总和严格等于总额、单份 ≥ 0.01、单份 ≤ 2 * 均值（向下取整到分）、
+  份数正确、同一种子结果相同；total < 0.01*count 时与平均拆分一致。
+微基准：旧 Decimal 实现（v1）与整数分引擎（二倍均值 v2 / 线段切割 v3）的单次拆分耗时。
+任一校验失败时退出码为 1。
+"""
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+
+from src.services import redalgo
+from src.services.redalgo import (
+    split_random, split_average, Q,
+    SPLIT_V1_DECIMAL, SPLIT_V2_DOUBLE_MEAN, SPLIT_V3_SEGMENT,
+)
+
+_ENGINES = (("double_mean", SPLIT_V2_DOUBLE_MEAN), ("segment", SPLIT_V3_SEGMENT))
+
+
+def _check(total: Decimal, count: int, seed: int, version: int) -> list:
+    errs = []
+    shares = split_random(total, count, rng=random.Random(seed), version=version)
+    again = split_random(total, count, rng=random.Random(seed), version=version)
+    tag = f"v{version} total={total} count={count} seed={seed}"
+    if shares != again:
+        errs.append(f"{tag}：同一种子结果不一致")
+    if len(shares) != count:
+        errs.append(f"{tag}：份数 {len(shares)}")
+    if sum(shares) != total:
+        errs.append(f"{tag}：总和 {sum(shares)}")
+    if any(s != s.quantize(Q) for s in shares):
+        errs.append(f"{tag}：存在非两位小数的份额")
+    if total < Q * count:
+        if shares != split_average(total, count):
+            errs.append(f"{tag}：金额不足时未退化为平均拆分")
+        return errs
+    cap = Decimal(2 * int(total.scaleb(2)) // count).scaleb(-2)
+    if min(shares) < Q:
+        errs.append(f"{tag}：最小份额 {min(shares)}")
+    if max(shares) > cap:
+        errs.append(f"{tag}：最大份额 {max(shares)} > {cap}")
+    return errs
+
+
+def run_properties(cases: int, seed: int) -> int:
+    rnd = random.Random(seed)
+    failed = 0
+    for _ in range(cases):
+        count = rnd.choice((1, 2, 3, rnd.randint(4, 50), rnd.randint(50, 2000)))
+        # 金额：一半贴近 0.01*count 的边界，一半任意
+        if rnd.random() < 0.5:
+            cents = max(1, count + rnd.randint(-3, 3 * count))
+        else:
+            cents = rnd.randint(1, 10_000_000)
+        total = Decimal(cents).scaleb(-2)
+        s = rnd.getrandbits(62)
+        for _, version in _ENGINES:
+            for e in _check(total, count, s, version):
+                failed += 1
+                if failed <= 20:
+                    print(f"  ✗ {e}")
+    print(f"性质校验：{cases} 组 × {len(_ENGINES)} 种引擎，失败 {failed}")
+    return failed
+
+
+def _time_one(version: int, count: int, rounds: int) -> float:
+    total = Decimal(count) * Decimal("3.33")
+    best = float("inf")
+    for r in range(rounds):
+        rng = random.Random(r)
+        t0 = time.perf_counter()
+        split_random(total, count, rng=rng, version=version)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def run_bench(counts, rounds: int, legacy_max: int):
+    print(f"微基准（{rounds} 轮取最快，单位 ms；numpy：{'有' if redalgo._np is not None else '无'}）")
+    print(f"{'份数':>8} {'v1 Decimal':>12} {'v2 二倍均值':>12} {'v3 线段切割':>12} {'v1/v2':>8}")
+    for n in counts:
+        v1 = _time_one(SPLIT_V1_DECIMAL, n, rounds) if n <= legacy_max else None
+        v2 = _time_one(SPLIT_V2_DOUBLE_MEAN, n, rounds)
+        v3 = _time_one(SPLIT_V3_SEGMENT, n, rounds)
+        v1s = f"{v1:12.2f}" if v1 is not None else f"{'-':>12}"
+        ratio = f"{v1 / v2:7.1f}x" if v1 is not None and v2 > 0 else f"{'-':>8}"
+        print(f"{n:>8} {v1s} {v2:12.2f} {v3:12.2f} {ratio}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="红包拆分算法校验 + 微基准")
+    ap.add_argument("--counts", default="10,100,1000,10000,100000", help="基准份数，逗号分隔")
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--cases", type=int, default=500, help="随机性质校验的用例数")
+    ap.add_argument("--seed", type=int, default=20240601)
+    ap.add_argument("--legacy-max", type=int, default=100000, help="旧实现只测到该份数（太慢时调小）")
+    args = ap.parse_args()
+    counts = [int(x) for x in args.counts.split(",") if x.strip()]
+
+    failed = run_properties(args.cases, args.seed)
+    run_bench(counts, args.rounds, args.legacy_max)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+-- 基线结构（与 db.sql 导出一致）；已有库上执行时 CREATE TABLE IF NOT EXISTS 为空操作
+
+CREATE TABLE IF NOT EXISTS `users` (
+  `id` bigint(20) NOT NULL,
+  `username` varchar(64) DEFAULT NULL,
+  `first_name` varchar(64) DEFAULT NULL,
+  `last_name` varchar(64) DEFAULT NULL,
+  `display_name` varchar(128) DEFAULT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `tx_password_hash` varchar(128) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `user_wallets` (
+  `user_id` bigint(20) NOT NULL,
+  `usdt_trc20_balance` decimal(18,6) NOT NULL DEFAULT '0.000000',
+  `tron_address` varchar(64) DEFAULT NULL,
+  `tron_privkey_enc` text,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `usdt_trc20_frozen` decimal(18,6) NOT NULL DEFAULT '0.000000',
+  PRIMARY KEY (`user_id`),
+  UNIQUE KEY `tron_address` (`tron_address`),
+  CONSTRAINT `fk_wallet_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `user_addresses` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `user_id` bigint(20) NOT NULL,
+  `chain` varchar(16) NOT NULL DEFAULT 'TRX',
+  `address` varchar(64) NOT NULL,
+  `alias` varchar(32) NOT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `status` enum('active','deleted') NOT NULL DEFAULT 'active',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_user_addr` (`user_id`,`address`),
+  CONSTRAINT `fk_addr_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `sys_flags` (
+  `k` varchar(64) NOT NULL,
+  `v` varchar(255) NOT NULL,
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`k`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `ledger` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `user_id` bigint(20) NOT NULL,
+  `change_type` enum('recharge','withdraw','redpacket_send','redpacket_claim','redpacket_refund','adjust') NOT NULL,
+  `ref_table` varchar(32) DEFAULT NULL,
+  `amount` decimal(18,6) NOT NULL,
+  `balance_before` decimal(18,6) NOT NULL,
+  `balance_after` decimal(18,6) NOT NULL,
+  `ref_type` varchar(32) DEFAULT NULL,
+  `ref_id` bigint(20) DEFAULT NULL,
+  `remark` varchar(255) DEFAULT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `fk_ledger_user` (`user_id`),
+  KEY `idx_ledger_ref` (`change_type`,`ref_table`,`ref_id`),
+  CONSTRAINT `fk_ledger_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `recharge_orders` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `order_no` varchar(32) NOT NULL,
+  `user_id` bigint(20) NOT NULL,
+  `address` varchar(64) NOT NULL,
+  `status` enum('waiting','collecting','verifying','success','expired','failed') NOT NULL DEFAULT 'waiting',
+  `txid` varchar(100) DEFAULT NULL,
+  `expected_amount` decimal(18,6) DEFAULT NULL,
+  `txid_collect` varchar(128) DEFAULT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `expire_at` timestamp NULL DEFAULT NULL,
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `ux_recharge_orders_order_no` (`order_no`),
+  KEY `fk_recharge_user` (`user_id`),
+  KEY `idx_recharge_waiting` (`status`,`expire_at`),
+  CONSTRAINT `fk_recharge_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `red_packets` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `owner_id` bigint(20) NOT NULL,
+  `type` enum('random','average','exclusive') NOT NULL,
+  `currency` varchar(32) NOT NULL DEFAULT 'USDT-trc20',
+  `total_amount` decimal(18,6) NOT NULL,
+  `count` int(11) NOT NULL DEFAULT '1',
+  `cover_text` varchar(150) DEFAULT NULL,
+  `cover_image_file_id` varchar(128) DEFAULT NULL,
+  `exclusive_user_id` bigint(20) DEFAULT NULL,
+  `status` enum('created','paid','sent','finished','expired','cancelled') NOT NULL DEFAULT 'created',
+  `chat_id` bigint(20) DEFAULT NULL,
+  `message_id` bigint(20) DEFAULT NULL,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `expires_at` timestamp NULL DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `fk_redpacket_user` (`owner_id`),
+  CONSTRAINT `fk_redpacket_user` FOREIGN KEY (`owner_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `red_packet_shares` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `red_packet_id` bigint(20) NOT NULL,
+  `seq` int(11) NOT NULL,
+  `amount` decimal(18,6) NOT NULL,
+  `claimed_by` bigint(20) DEFAULT NULL,
+  `claimed_at` timestamp NULL DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_packet_seq` (`red_packet_id`,`seq`),
+  CONSTRAINT `fk_share_packet` FOREIGN KEY (`red_packet_id`) REFERENCES `red_packets` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `red_packet_claims` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `red_packet_id` bigint(20) NOT NULL,
+  `claimer_id` bigint(20) NOT NULL,
+  `amount` decimal(18,6) NOT NULL,
+  `claimed_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `fk_claim_packet` (`red_packet_id`),
+  CONSTRAINT `fk_claim_packet` FOREIGN KEY (`red_packet_id`) REFERENCES `red_packets` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS `energy_rent_logs` (
+  `id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `address` varchar(50) NOT NULL,
+  `order_id` bigint(20) DEFAULT NULL,
+  `order_no` varchar(32) DEFAULT NULL,
+  `provider` varchar(32) NOT NULL DEFAULT 'trongas',
+  `rent_order_id` varchar(64) DEFAULT NULL,
+  `rent_txid` varchar(100) DEFAULT NULL,
+  `rented_at` datetime NOT NULL,
+  `expire_at` datetime NOT NULL,
+  `status` enum('active','used','expired','failed') NOT NULL DEFAULT 'active',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_energy_addr` (`address`,`status`,`expire_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,10 @@
+-- 代码已在使用、但 db.sql 导出中缺失的列
+-- 已手工加过这些列的库会报 1060/1061，迁移器按“已存在”跳过
+
+-- 红包编号：red_YYYYMMDDHHMM + 4 位字母（make_rp_no），inline 查询按它定位红包
+ALTER TABLE `red_packets` ADD COLUMN `rp_no` varchar(32) DEFAULT NULL AFTER `id`;
+ALTER TABLE `red_packets` ADD UNIQUE KEY `uq_red_packets_rp_no` (`rp_no`);
+
+-- 账变订单号：(user_id, order_no) 唯一，保证同一业务单只入账一次（add_ledger 依赖该约束去重）
+ALTER TABLE `ledger` ADD COLUMN `order_no` varchar(64) DEFAULT NULL AFTER `remark`;
+ALTER TABLE `ledger` ADD UNIQUE KEY `uq_ledger_user_order` (`user_id`,`order_no`);
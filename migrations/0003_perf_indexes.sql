@@ -0,0 +1,16 @@
+-- 性能索引：把领取 / 过期回收扫描 / 历史列表从全表 filesort 变为索引范围扫描
+
+-- 领取、统计已领份额：WHERE red_packet_id=? AND claimed_by IS [NOT] NULL
+ALTER TABLE `red_packet_shares` ADD KEY `idx_shares_packet_claimer` (`red_packet_id`,`claimed_by`);
+
+-- “我最近领取的红包”：WHERE claimed_by=? ORDER BY claimed_at DESC
+ALTER TABLE `red_packet_shares` ADD KEY `idx_shares_claimer_time` (`claimed_by`,`claimed_at`);
+
+-- 过期自动回收：WHERE status IN ('paid','sent') AND expires_at<=NOW()
+ALTER TABLE `red_packets` ADD KEY `idx_rp_status_expires` (`status`,`expires_at`);
+
+-- 我的红包列表：WHERE owner_id=? ORDER BY id DESC LIMIT n
+ALTER TABLE `red_packets` ADD KEY `idx_rp_owner_id` (`owner_id`,`id`);
+
+-- 资金明细：WHERE user_id=? ORDER BY id DESC LIMIT n
+ALTER TABLE `ledger` ADD KEY `idx_ledger_user_id` (`user_id`,`id`);
@@ -0,0 +1,24 @@
+-- 红包领取计数 / 已领金额 / MVP 反范式化到 red_packets，由 claim_share_atomic 在领取事务内维护
+ALTER TABLE `red_packets` ADD COLUMN `claimed_count` int(11) NOT NULL DEFAULT '0' AFTER `count`;
+ALTER TABLE `red_packets` ADD COLUMN `claimed_amount` decimal(18,6) NOT NULL DEFAULT '0.000000' AFTER `claimed_count`;
+ALTER TABLE `red_packets` ADD COLUMN `mvp_user_id` bigint(20) DEFAULT NULL AFTER `claimed_amount`;
+ALTER TABLE `red_packets` ADD COLUMN `mvp_amount` decimal(18,6) DEFAULT NULL AFTER `mvp_user_id`;
+
+-- 回填存量数据（可重复执行）
+UPDATE `red_packets` rp
+JOIN (
+  SELECT red_packet_id, COUNT(*) AS c, SUM(amount) AS s, MAX(amount) AS m
+  FROM `red_packet_shares`
+  WHERE claimed_by IS NOT NULL
+  GROUP BY red_packet_id
+) x ON x.red_packet_id = rp.id
+SET rp.claimed_count = x.c, rp.claimed_amount = x.s, rp.mvp_amount = x.m;
+
+-- MVP 取金额最大、同额先领者（与原 get_red_packet_mvp 的排序一致）
+UPDATE `red_packets` rp
+SET rp.mvp_user_id = (
+  SELECT s.claimed_by FROM `red_packet_shares` s
+  WHERE s.red_packet_id = rp.id AND s.claimed_by IS NOT NULL
+  ORDER BY s.amount DESC, s.claimed_at ASC LIMIT 1
+)
+WHERE rp.claimed_count > 0;
@@ -0,0 +1,8 @@
+-- 每个用户在同一红包只能领一份；claimed_by 为 NULL（未领）的份额不受唯一约束影响
+-- 若存量数据已有重复领取，先用下面的查询排查后再执行：
+--   SELECT red_packet_id, claimed_by, COUNT(*) FROM red_packet_shares
+--   WHERE claimed_by IS NOT NULL GROUP BY red_packet_id, claimed_by HAVING COUNT(*) > 1;
+ALTER TABLE `red_packet_shares` ADD UNIQUE KEY `uq_packet_claimer` (`red_packet_id`,`claimed_by`);
+
+-- 与唯一索引列相同，0003 加的普通索引不再需要
+ALTER TABLE `red_packet_shares` DROP INDEX `idx_shares_packet_claimer`;
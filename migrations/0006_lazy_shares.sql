@@ -0,0 +1,3 @@
+-- 份额延迟落库：split_seed 非 NULL 的红包支付时不写 red_packet_shares，
+-- 领取时按 (type, total_amount, count, split_seed) 确定性重算第 seq 份金额，只插入已领取的份额
+ALTER TABLE `red_packets` ADD COLUMN `split_seed` bigint(20) DEFAULT NULL AFTER `mvp_amount`;
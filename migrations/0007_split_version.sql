@@ -0,0 +1,3 @@
+-- 拆分算法版本：延迟落库的红包按 (split_seed, split_version) 重算份额。
+-- NULL 表示 0007 之前支付的红包（旧 Decimal 算法），2 = 整数分二倍均值，3 = 整数分线段切割
+ALTER TABLE `red_packets` ADD COLUMN `split_version` tinyint(4) DEFAULT NULL AFTER `split_seed`;
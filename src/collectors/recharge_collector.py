@@ -1,16 +1,19 @@
 import asyncio, re, time, os, requests
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Optional, Tuple
-from ..db import init_pool, close_pool, execute, execute_rowcount
+from typing import List, Optional, Tuple
+from ..db import init_pool, close_pool, execute, execute_rowcount, fetchone
 from ..models import (
     list_recharge_waiting, list_recharge_collecting, list_recharge_verifying,
+    list_recharge_waiting_by_addresses, list_recharge_waiting_since, get_flag,
     set_recharge_status, get_wallet, update_wallet_balance, add_ledger,
     ledger_exists_for_ref, has_active_energy_rent, add_energy_rent_log, last_energy_rent_seconds_ago,
-    get_total_user_balance, get_ledger_by_ref, set_flag
+    get_total_user_balance, get_ledger_by_ref, set_flag, refund_expired_red_packets
 )
-from ..config import MIN_DEPOSIT_USDT, AGGREGATE_ADDRESS, BOT_TOKEN
+from ..config import MIN_DEPOSIT_USDT, AGGREGATE_ADDRESS, BOT_TOKEN, RP_REFUND_CHUNK, DEPOSIT_SCANNER
 from ..logger import collect_logger, redpacket_logger
 from ..services.energy import rent_energy
+from ..services import trongrid, deposit_scanner
 from ..services.encryption import decrypt_text
 from ..services.tron import (
     get_usdt_balance,
@@ -18,43 +21,77 @@ from ..services.tron import (
     get_account_resource,
     get_trx_balance,
     send_trx,
+    fetch_account_states,
 )
 
 
 async def _auto_refund_expired_red_packets(counters: dict):
-    from decimal import Decimal
-    from ..models import (
-        list_expired_red_packets, sum_claimed_amount, get_wallet,
-        update_wallet_balance, add_ledger, set_red_packet_status
-    )
-    recs = await list_expired_red_packets(limit=200)
+    """
+    分批集合式回收：每批 RP_REFUND_CHUNK 个过期红包一个事务（批量关闭、每个创建人一条入账、
+    多行记账），直到某批不足一整批，停机后的积压在一轮内清空。
+    """
+    chunk = max(RP_REFUND_CHUNK, 1)
     n = 0
     total_refund = Decimal("0")
-    for r in recs:
-        rp_id = r["id"]; owner = r["owner_id"]
-        total = Decimal(str(r["total_amount"]))
-        claimed = Decimal(str(await sum_claimed_amount(rp_id)))
-        remain = total - claimed
-        if remain > 0:
-            wallet = await get_wallet(owner)
-            before = Decimal(str((wallet or {}).get("usdt_trc20_balance", 0)))
-            after = before + remain
-            await update_wallet_balance(owner, float(after))
-            # 唯一订单号：red_refund_<rp_no>
-            rp_no = r.get("rp_no") or f"rp{rp_id}"
-            order_no = f"red_refund_{rp_no}"
-            await add_ledger(owner, "redpacket_refund", float(remain), float(before), float(after),
-                             "red_packets", rp_id, "红包超过24小时未领取自动退款", order_no)
-            total_refund += remain
-        await set_red_packet_status(rp_id, "finished")
-        n += 1
-        redpacket_logger.info(
-            "🧧[自动回收] 红包ID=%s 创建人=%s  类型=%s  总额=%.6f  已领=%.6f  退款=%.6f → 设为 finished",
-            rp_id, owner, r.get("type"), float(total), float(claimed), float(max(remain, Decimal('0')))
-        )
+    while True:
+        rps, res = await refund_expired_red_packets(limit=chunk)
+        for r in rps:
+            remain = Decimal(str(r["total_amount"])) - Decimal(str(r.get("claimed_amount") or 0))
+            redpacket_logger.info(
+                "🧧[自动回收] 红包ID=%s 创建人=%s  类型=%s  总额=%.6f  已领=%.6f  退款=%.6f → 设为 finished",
+                r["id"], r["owner_id"], r.get("type"), float(r["total_amount"]),
+                float(r.get("claimed_amount") or 0), float(max(remain, Decimal("0")))
+            )
+        n += len(rps)
+        total_refund += sum((x["amount"] for x in res.values()), Decimal("0"))
+        if len(rps) < chunk:
+            break
     counters["rp_auto_refunded"] = n
     counters["rp_auto_refunded_sum"] = float(total_refund)
 
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+# 新订单回看的余量（秒）：覆盖上一轮记录时间与订单插入之间的时序抖动
+_NEW_ORDER_SLACK = 60
+_NEW_ORDER_PAGE = 100
+
+async def _list_waiting_scanned(counters: dict) -> Tuple[List[dict], Optional[deposit_scanner.ScanResult], datetime]:
+    """
+    扫描器模式下本轮要查余额的等待订单：
+      - 扫描到 USDT 入账的地址对应的订单；
+      - 上一轮之后新建的订单（下单前已到账的钱不会再出现在后续区块里）；
+      - 首次启用、或扫描失败时退回全量（与轮询模式相同）。
+    """
+    now = (await fetchone("SELECT NOW() AS t"))["t"]
+    prev = await get_flag(deposit_scanner.FLAG_SCAN_AT)
+    try:
+        res = await deposit_scanner.scan()
+    except Exception as e:
+        collect_logger.exception(f"充值扫描异常，本轮退回全量轮询：{e}")
+        return await list_recharge_waiting(), None, now
+    counters["deposit_hits"] = len(res.deposits)
+    if res.first_run or not prev:
+        return await list_recharge_waiting(), res, now
+
+    orders = await list_recharge_waiting_by_addresses(res.addresses)
+    matched = {o["address"] for o in orders}
+    for d in res.deposits:
+        if d["to"] not in matched:
+            collect_logger.info(
+                f"ℹ️ 地址 {d['to']}（用户 {d['user_id']}）收到 {d['amount']:.6f} USDT，"
+                f"tx={d['txid']}，但没有等待中的充值订单"
+            )
+    seen = {o["id"] for o in orders}
+    since = datetime.strptime(prev, _TS_FMT) - timedelta(seconds=_NEW_ORDER_SLACK)
+    # 新订单必须全部查到：deposit_scan_at 随后推进到本轮时间，漏掉的订单不会再被查询
+    after_id = 0
+    while True:
+        page = await list_recharge_waiting_since(since, after_id=after_id, limit=_NEW_ORDER_PAGE)
+        orders += [o for o in page if o["id"] not in seen]
+        if len(page) < _NEW_ORDER_PAGE:
+            break
+        after_id = page[-1]["id"]
+    return orders, res, now
+
 # ✅ 与表结构一致：waiting 过期后置为 expired（不是 timeout）
 EXPIRE_SQL = "UPDATE recharge_orders SET status='expired' WHERE status='waiting' AND expire_at <= NOW()"
 
@@ -74,7 +111,7 @@ def _notify_user(uid: int, text: str):
 async def _wait_energy_ready(addr: str, need: int, timeout: int = 30):
     end = time.time() + timeout
     while time.time() < end:
-        res = get_account_resource(addr)
+        res = await get_account_resource(addr)
         if res['energy'] >= need:
             return True
         await asyncio.sleep(2)
@@ -97,8 +134,8 @@ async def _precheck_and_prepare(uid: int, addr: str, oid: int, order_no: str) ->
     rent_retry_sec = int(os.getenv("ENERGY_RENT_RETRY_SECONDS", "120"))
 
     usdt_bal = await get_usdt_balance(addr)
-    res0 = get_account_resource(addr)
-    trx_bal0 = get_trx_balance(addr)
+    res0 = await get_account_resource(addr)
+    trx_bal0 = await get_trx_balance(addr)
     _log_resource_snapshot(addr, usdt_bal, res0, need_energy, need_bw, trx_bal0, prefix="🔎 资源快照（预检前）")
 
     if usdt_bal < min_deposit:
@@ -129,8 +166,8 @@ async def _precheck_and_prepare(uid: int, addr: str, oid: int, order_no: str) ->
                 return False, usdt_bal
 
         ok = await _wait_energy_ready(addr, need_energy, timeout=int(os.getenv("TRONGAS_ACTIVATION_DELAY", "30")))
-        res1 = get_account_resource(addr)
-        trx_bal1 = get_trx_balance(addr)
+        res1 = await get_account_resource(addr)
+        trx_bal1 = await get_trx_balance(addr)
         _log_resource_snapshot(addr, usdt_bal, res1, need_energy, need_bw, trx_bal1, prefix="🔎 资源快照（租能量后）")
         if res1['energy'] < need_energy:
             collect_logger.info(f"⏸ 能量仍不足：{res1['energy']} < {need_energy}，本轮不归集")
@@ -139,7 +176,7 @@ async def _precheck_and_prepare(uid: int, addr: str, oid: int, order_no: str) ->
     return True, usdt_bal
 
 async def _ensure_resources(addr: str, oid: int, order_no: str) -> None:
-    res = get_account_resource(addr)
+    res = await get_account_resource(addr)
     need_energy = int(os.getenv("USDT_ENERGY_REQUIRE", "30000"))
     need_bw = int(os.getenv("MIN_BANDWIDTH", "500"))
 
@@ -221,14 +258,21 @@ async def step_verifying(uid: int, addr: str, oid: int, order_no: str) -> bool:
         return True
     return False
 
-async def process_waiting(order, counters):
+async def process_waiting(order, counters, snapshot: Optional[dict] = None):
     oid = order["id"]; uid = order["user_id"]; addr = order["address"]
     order_no = order.get("order_no") or str(oid)
-    bal = await get_usdt_balance(addr)
+    # 优先用本轮批量快照；快照里没有或查询失败时单独再查一次
+    st = (snapshot or {}).get(addr) or {}
+    bal = st["usdt"] if "usdt" in st else await get_usdt_balance(addr)
     if float(bal) < float(MIN_DEPOSIT_USDT):
         counters["waiting_skip"] += 1; return
     await set_recharge_status(oid, "collecting", None)
-    ret = await _collect_and_book(uid, addr, oid, order_no)
+    try:
+        ret = await _collect_and_book(uid, addr, oid, order_no)
+    except Exception as e:
+        # 已转为 collecting，由 collecting 阶段重试；这里不再向上抛（不影响扫描检查点）
+        collect_logger.exception(f"waiting {oid} 归集异常（已转 collecting，稍后重试）：{e}")
+        return
     if ret is not None:
         counters["collecting_to_verifying"] += 1
         counters["ledger_add"] += 1
@@ -253,17 +297,34 @@ async def main_once():
     counters = {"timeout_marked": 0, "waiting_total": 0, "waiting_skip": 0,
                 "collecting_total": 0, "collecting_to_verifying": 0,
                 "verifying_total": 0, "verifying_to_success": 0, "ledger_add": 0,
-                "rp_auto_refunded": 0, "rp_auto_refunded_sum": 0.0}
+                "rp_auto_refunded": 0, "rp_auto_refunded_sum": 0.0, "deposit_hits": 0}
 
     await init_pool()
     try:
         n = await execute_rowcount(EXPIRE_SQL) or 0
         counters["timeout_marked"] = n
 
-        waitings = await list_recharge_waiting(); counters["waiting_total"] = len(waitings)
+        scan = None
+        if DEPOSIT_SCANNER:
+            # 事件驱动：只查扫描到入账的订单和新订单，成本随实际充值数增长
+            waitings, scan, scan_at = await _list_waiting_scanned(counters)
+        else:
+            waitings = await list_recharge_waiting()
+        counters["waiting_total"] = len(waitings)
+        # 一次并发拉取这些等待地址的 USDT 余额（有界并发 + 按 Key 限速），其余逐单处理
+        snapshot = await fetch_account_states([o["address"] for o in waitings], trx=False, resource=False)
+        # 只统计余额检查/转 collecting 之前的失败；转 collecting 之后的归集失败由 collecting 阶段重试
+        waiting_failed = 0
         for o in waitings:
-            try: await process_waiting(o, counters)
-            except Exception as e: collect_logger.exception(f"waiting {o.get('id')} 异常：{e}")
+            try: await process_waiting(o, counters, snapshot)
+            except Exception as e:
+                waiting_failed += 1
+                collect_logger.exception(f"waiting {o.get('id')} 异常：{e}")
+        if DEPOSIT_SCANNER and not waiting_failed:
+            # 所有命中订单都完成余额检查后才推进检查点；有订单没查成或中途崩溃则下一轮重扫同一区间、重查同一批新订单
+            if scan is not None:
+                await deposit_scanner.commit(scan)
+            await set_flag(deposit_scanner.FLAG_SCAN_AT, scan_at.strftime(_TS_FMT))
 
         coll = await list_recharge_collecting(); counters["collecting_total"] = len(coll)
         for o in coll:
@@ -294,12 +355,13 @@ async def main_once():
 
         dur = time.time() - t0
         collect_logger.info(
-            "📊 本轮统计：expired标记=%s 等待=%s 收集中=%s 待验证=%s "
+            "📊 本轮统计：expired标记=%s 等待=%s (扫描命中=%s) 收集中=%s 待验证=%s "
             "自动回收红包=%s (合计退款=%.6f) 用时%.2fs",
-            counters['timeout_marked'], counters['waiting_total'], counters['collecting_total'],
+            counters['timeout_marked'], counters['waiting_total'], counters['deposit_hits'], counters['collecting_total'],
             counters['verifying_total'], counters['rp_auto_refunded'], counters['rp_auto_refunded_sum'], dur
         )
     finally:
+        await trongrid.aclose()
         await close_pool()
 
 if __name__ == "__main__":
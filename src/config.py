@@ -10,14 +10,35 @@ MYSQL_USER = os.getenv("MYSQL_USER","rebpag_user")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD","")
 MYSQL_DB = os.getenv("MYSQL_DB","rebpag_data")
 
+# —— MySQL 连接池 ——
+MYSQL_POOL_MIN = int(os.getenv("MYSQL_POOL_MIN","1"))               # 预热连接数
+MYSQL_POOL_MAX = int(os.getenv("MYSQL_POOL_MAX","10"))
+MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE","3600"))    # 秒；-1 表示不回收
+MYSQL_CONNECT_TIMEOUT = float(os.getenv("MYSQL_CONNECT_TIMEOUT","10"))
+MYSQL_ACQUIRE_TIMEOUT = float(os.getenv("MYSQL_ACQUIRE_TIMEOUT","10"))   # 等待空闲连接的上限（秒）
+MYSQL_ACQUIRE_SLOW_MS = float(os.getenv("MYSQL_ACQUIRE_SLOW_MS","200"))  # 超过则记一条告警日志
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS","200"))          # 慢 SQL 阈值（毫秒），超过则带调用位置记日志
+
+# —— MySQL 只读从库（可选；MYSQL_RO_HOST 为空则所有读走主库）——
+MYSQL_RO_HOST = os.getenv("MYSQL_RO_HOST","").strip()
+MYSQL_RO_PORT = int(os.getenv("MYSQL_RO_PORT", str(MYSQL_PORT)))
+MYSQL_RO_USER = os.getenv("MYSQL_RO_USER", MYSQL_USER)
+MYSQL_RO_PASSWORD = os.getenv("MYSQL_RO_PASSWORD", MYSQL_PASSWORD)
+MYSQL_RO_POOL_MAX = int(os.getenv("MYSQL_RO_POOL_MAX", str(MYSQL_POOL_MAX)))
+
 FERNET_KEY = os.getenv("FERNET_KEY","")
 
 # TRON / TronGrid / USDT
 USDT_CONTRACT = os.getenv("USDT_CONTRACT","")
 AGGREGATE_ADDRESS = os.getenv("AGGREGATE_ADDRESS","")
 TRON_FULLNODE_URL = os.getenv("TRON_FULLNODE_URL","https://api.trongrid.io")
-TRONGRID_API_KEY = os.getenv("TRONGRID_API_KEY","")     # 逗号分隔可配置多个，用于轮询
-TRONGRID_QPS = float(os.getenv("TRONGRID_QPS","10"))
+TRONGRID_API_KEY = os.getenv("TRONGRID_API_KEY","")     # 逗号分隔可配置多个，按各自令牌桶余量选用
+TRONGRID_QPS = float(os.getenv("TRONGRID_QPS","10"))     # 每个 Key 的 QPS（多个 Key 叠加）
+TRONGRID_BURST = float(os.getenv("TRONGRID_BURST","0") or 0) or None   # 每个 Key 的突发容量；不配置则等于 QPS
+TRON_FETCH_CONCURRENCY = int(os.getenv("TRON_FETCH_CONCURRENCY","16"))  # 批量查询地址状态时同时进行的地址数
+DEPOSIT_SCANNER = os.getenv("DEPOSIT_SCANNER","0") == "1"                       # 1=按区块扫描 USDT Transfer 事件发现充值，只查有入账的订单
+DEPOSIT_SCAN_CONFIRMATIONS = int(os.getenv("DEPOSIT_SCAN_CONFIRMATIONS","19"))   # 只扫距链头至少这么多块的区块（19 块≈固化）
+DEPOSIT_SCAN_MAX_BLOCKS = int(os.getenv("DEPOSIT_SCAN_MAX_BLOCKS","1200"))       # 单轮最多扫描的区块数，积压时分多轮追上
 USDT_DECIMALS = int(os.getenv("USDT_DECIMALS","6"))
 
 # trongas 能量租用
@@ -28,6 +49,12 @@ MIN_DEPOSIT_USDT = float(os.getenv("MIN_DEPOSIT_USDT","10"))
 MIN_WITHDRAW_USDT = float(os.getenv("MIN_WITHDRAW_USDT","5"))
 WITHDRAW_FEE_FIXED = float(os.getenv("WITHDRAW_FEE_FIXED","1"))
 SUPPORT_CONTACT = os.getenv("SUPPORT_CONTACT","@support")
+PANEL_EDIT_INTERVAL = float(os.getenv("PANEL_EDIT_INTERVAL","2"))   # 同一红包面板两次编辑的最小间隔（秒）
+LAZY_SHARES_MIN_COUNT = int(os.getenv("LAZY_SHARES_MIN_COUNT","200"))  # 份数达到该值的红包份额延迟落库；0 表示关闭
+RED_PACKET_SPLIT_MODE = os.getenv("RED_PACKET_SPLIT_MODE","double_mean")  # 随机红包拆分：double_mean（二倍均值）/ segment（线段切割）
+PACKET_STATE_TTL = float(os.getenv("PACKET_STATE_TTL","3"))   # 使用中红包状态的进程内缓存时长（秒）；已结束的红包常驻（LRU）
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME","5"))   # inline 红包预览的 cache_time（秒）
+RP_REFUND_CHUNK = int(os.getenv("RP_REFUND_CHUNK","200"))   # 过期红包自动回收：每个事务处理的红包数
 
 # —— GoPlus 风险查询（可选）——
 GOPLUS_BASE_URL = os.getenv("GOPLUS_BASE_URL", "https://api.gopluslabs.io")
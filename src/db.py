@@ -1,58 +1,341 @@
+import asyncio
+import os
+import re
+import sys
+import time
 import aiomysql
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
-from .config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+from .config import (
+    MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB,
+    MYSQL_POOL_MIN, MYSQL_POOL_MAX, MYSQL_POOL_RECYCLE, MYSQL_CONNECT_TIMEOUT,
+    MYSQL_ACQUIRE_TIMEOUT, MYSQL_ACQUIRE_SLOW_MS, DB_SLOW_QUERY_MS,
+    MYSQL_RO_HOST, MYSQL_RO_PORT, MYSQL_RO_USER, MYSQL_RO_PASSWORD, MYSQL_RO_POOL_MAX,
+)
 from .logger import app_logger
 
 _pool: Optional[aiomysql.Pool] = None
+_ro_pool: Optional[aiomysql.Pool] = None   # 只读从库，未配置时为 None
+
+# 取连接等待时间直方图的桶上界（毫秒），最后一个桶为 >5000ms
+_ACQ_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+class PoolStats:
+    """连接池取连接统计：次数、等待耗时直方图、超时次数"""
+    def __init__(self, name: str):
+        self.name = name
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.hist = [0] * (len(_ACQ_BUCKETS_MS) + 1)
+
+    def observe(self, ms: float):
+        self.acquired += 1
+        self.wait_total_ms += ms
+        self.wait_max_ms = max(self.wait_max_ms, ms)
+        for i, ub in enumerate(_ACQ_BUCKETS_MS):
+            if ms <= ub:
+                self.hist[i] += 1
+                return
+        self.hist[-1] += 1
+
+    def snapshot(self, pool: Optional[aiomysql.Pool]) -> Dict[str, Any]:
+        size = pool.size if pool is not None else 0
+        free = pool.freesize if pool is not None else 0
+        labels = [f"<={ub}ms" for ub in _ACQ_BUCKETS_MS] + [f">{_ACQ_BUCKETS_MS[-1]}ms"]
+        return {
+            "pool": self.name,
+            "minsize": pool.minsize if pool is not None else 0,
+            "maxsize": pool.maxsize if pool is not None else 0,
+            "size": size,
+            "in_use": size - free,
+            "free": free,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total_ms / self.acquired, 2) if self.acquired else 0.0,
+            "wait_max_ms": round(self.wait_max_ms, 2),
+            "wait_hist": dict(zip(labels, self.hist)),
+        }
+
+_stats = PoolStats("primary")
+_ro_stats = PoolStats("replica")
 
 async def init_pool():
-    global _pool
+    global _pool, _ro_pool
     if _pool is None:
         _pool = await aiomysql.create_pool(
             host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER,
             password=MYSQL_PASSWORD, db=MYSQL_DB, autocommit=True,
-            minsize=1, maxsize=10, charset="utf8mb4"
+            minsize=MYSQL_POOL_MIN, maxsize=MYSQL_POOL_MAX,
+            pool_recycle=MYSQL_POOL_RECYCLE, connect_timeout=MYSQL_CONNECT_TIMEOUT,
+            charset="utf8mb4"
         )
-        app_logger.info("✅ MySQL 连接池已初始化")
+        app_logger.info("✅ MySQL 连接池已初始化：min=%s max=%s recycle=%ss connect_timeout=%ss",
+                        MYSQL_POOL_MIN, MYSQL_POOL_MAX, MYSQL_POOL_RECYCLE, MYSQL_CONNECT_TIMEOUT)
+    if _ro_pool is None and MYSQL_RO_HOST:
+        _ro_pool = await aiomysql.create_pool(
+            host=MYSQL_RO_HOST, port=MYSQL_RO_PORT, user=MYSQL_RO_USER,
+            password=MYSQL_RO_PASSWORD, db=MYSQL_DB, autocommit=True,
+            minsize=min(MYSQL_POOL_MIN, MYSQL_RO_POOL_MAX), maxsize=MYSQL_RO_POOL_MAX,
+            pool_recycle=MYSQL_POOL_RECYCLE, connect_timeout=MYSQL_CONNECT_TIMEOUT,
+            charset="utf8mb4"
+        )
+        app_logger.info("✅ MySQL 只读连接池已初始化：%s:%s max=%s", MYSQL_RO_HOST, MYSQL_RO_PORT, MYSQL_RO_POOL_MAX)
 
 async def close_pool():
-    global _pool
+    global _pool, _ro_pool
+    if _ro_pool is not None:
+        app_logger.info("📊 MySQL 只读连接池统计：%s", _ro_stats.snapshot(_ro_pool))
+        _ro_pool.close()
+        await _ro_pool.wait_closed()
+        _ro_pool = None
     if _pool is not None:
+        app_logger.info("📊 MySQL 连接池统计：%s", _stats.snapshot(_pool))
+        for q in query_stats(10):
+            app_logger.info("📊 SQL 统计：%s", q)
         _pool.close()
         await _pool.wait_closed()
         _pool = None
         app_logger.info("🛑 MySQL 连接池已关闭")
 
+def pool_stats() -> List[Dict[str, Any]]:
+    """连接池实时状态：使用中/空闲连接数、取连接等待直方图、超时次数"""
+    out = [_stats.snapshot(_pool)]
+    if _ro_pool is not None:
+        out.append(_ro_stats.snapshot(_ro_pool))
+    return out
+
+# ===== SQL 计时 / 指纹统计 =====
+
+_RE_STR = re.compile(r"'(?:[^'\\]|\\.)*'")
+_RE_NUM = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+_RE_WS = re.compile(r"\s+")
+_QUERY_SAMPLES = 512          # 每个指纹保留最近 N 次耗时用于分位数
+_QUERY_FINGERPRINTS_MAX = 500 # 指纹数量上限，超出归入 <other>
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """SQL 归一化：字面量/数字/占位符替换为 ?，多行 VALUES 与 IN 列表折叠为一组"""
+    s = _RE_STR.sub("?", sql)
+    s = s.replace("%s", "?")
+    s = _RE_NUM.sub("?", s)
+    s = _RE_PLACEHOLDER_LIST.sub("(...)", s)
+    return _RE_WS.sub(" ", s).strip()
+
+class QueryStat:
+    def __init__(self, fp: str):
+        self.fp = fp
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=_QUERY_SAMPLES)
+
+    def observe(self, ms: float, rows: int):
+        self.count += 1
+        self.total_ms += ms
+        self.rows += rows
+        self.samples.append(ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        xs = sorted(self.samples)
+        def pct(p):
+            return round(xs[min(len(xs) - 1, int(len(xs) * p))], 2) if xs else 0.0
+        return {
+            "sql": self.fp,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 2),
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "rows": self.rows,
+        }
+
+_qstats: Dict[str, QueryStat] = {}
+
+def _call_site() -> str:
+    """第一个不在 db.py 内的调用帧：file:line func"""
+    here = os.path.abspath(__file__)
+    f = sys._getframe(1)
+    while f is not None:
+        fn = f.f_code.co_filename
+        if os.path.abspath(fn) != here and "contextlib" not in fn:
+            return f"{os.path.basename(fn)}:{f.f_lineno} {f.f_code.co_name}"
+        f = f.f_back
+    return "-"
+
+def _record(sql: str, ms: float, rows: int):
+    fp = fingerprint(sql)
+    st = _qstats.get(fp)
+    if st is None:
+        if len(_qstats) >= _QUERY_FINGERPRINTS_MAX:
+            fp = "<other>"
+            st = _qstats.get(fp)
+        if st is None:
+            st = _qstats[fp] = QueryStat(fp)
+    st.observe(ms, rows)
+    if ms >= DB_SLOW_QUERY_MS:
+        app_logger.warning("🐢 慢 SQL %.1fms rows=%s @ %s：%s", ms, rows, _call_site(), fp[:500])
+
+def query_stats(top: int = 10) -> List[Dict[str, Any]]:
+    """按累计耗时倒序返回前 top 个 SQL 指纹的统计"""
+    snaps = [st.snapshot() for st in _qstats.values()]
+    snaps.sort(key=lambda x: x["total_ms"], reverse=True)
+    return snaps[:top]
+
+def reset_query_stats():
+    _qstats.clear()
+
+def _release_if_acquired(pool: aiomysql.Pool):
+    def cb(task: "asyncio.Future"):
+        if task.cancelled() or task.exception() is not None:
+            return
+        asyncio.ensure_future(pool.release(task.result()))
+    return cb
+
+async def _acquire_conn(pool: aiomysql.Pool, timeout: float):
+    """
+    带超时取连接。acquire() 单独跑在任务里、经 shield 等待：超时或调用方被取消时取消该任务，
+    若它恰好已经拿到连接（取消来不及生效），由完成回调归还，连接不会从池里漏掉。
+    """
+    task = asyncio.ensure_future(pool.acquire())
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except BaseException:
+        task.cancel()
+        task.add_done_callback(_release_if_acquired(pool))
+        raise
+
+@asynccontextmanager
+async def _acquire(pool: aiomysql.Pool, stats: PoolStats):
+    t0 = time.monotonic()
+    try:
+        conn = await _acquire_conn(pool, MYSQL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        app_logger.error("❌ MySQL[%s] 取连接超时（%.1fs）：使用中 %s / 上限 %s",
+                         stats.name, MYSQL_ACQUIRE_TIMEOUT, pool.size - pool.freesize, pool.maxsize)
+        raise
+    ms = (time.monotonic() - t0) * 1000
+    stats.observe(ms)
+    if ms >= MYSQL_ACQUIRE_SLOW_MS:
+        app_logger.warning("⏳ MySQL[%s] 取连接等待 %.1fms：使用中 %s / 上限 %s",
+                           stats.name, ms, pool.size - pool.freesize, pool.maxsize)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
 async def get_conn():
     assert _pool is not None, "MySQL 连接池未初始化"
-    return _pool.acquire()
+    return _acquire(_pool, _stats)
+
+@asynccontextmanager
+async def _borrow(conn=None, ro: bool = False):
+    """
+    传入 conn（事务内）则直接复用，否则从连接池借一个，用完归还。
+    ro=True 且配置了从库时走只读池；事务内（conn 非空）始终留在主库。
+    """
+    if conn is not None:
+        yield conn
+        return
+    if ro and _ro_pool is not None:
+        async with _acquire(_ro_pool, _ro_stats) as c:
+            yield c
+        return
+    async with (await get_conn()) as c:
+        yield c
 
-async def fetchone(sql: str, args: Tuple = ()) -> Optional[Dict[str, Any]]:
+@asynccontextmanager
+async def transaction():
+    """
+    单连接事务：块内所有语句共用同一个连接，正常退出 COMMIT，异常 ROLLBACK。
+    用法：
+        async with transaction() as conn:
+            await execute("UPDATE ...", (...), conn=conn)
+            await add_ledger(..., conn=conn)
+    """
     async with (await get_conn()) as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        await conn.begin()
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+
+async def fetchone(sql: str, args: Tuple = (), conn=None, ro: bool = False) -> Optional[Dict[str, Any]]:
+    async with _borrow(conn, ro) as c:
+        async with c.cursor(aiomysql.DictCursor) as cur:
+            t0 = time.monotonic()
             await cur.execute(sql, args)
-            return await cur.fetchone()
+            row = await cur.fetchone()
+            _record(sql, (time.monotonic() - t0) * 1000, 1 if row else 0)
+            return row
 
-async def fetchall(sql: str, args: Tuple = ()) -> List[Dict[str, Any]]:
-    async with (await get_conn()) as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+async def fetchall(sql: str, args: Tuple = (), conn=None, ro: bool = False) -> List[Dict[str, Any]]:
+    async with _borrow(conn, ro) as c:
+        async with c.cursor(aiomysql.DictCursor) as cur:
+            t0 = time.monotonic()
             await cur.execute(sql, args)
-            return await cur.fetchall()
+            rows = await cur.fetchall()
+            _record(sql, (time.monotonic() - t0) * 1000, len(rows))
+            return rows
+
+async def fetchone_ro(sql: str, args: Tuple = (), conn=None) -> Optional[Dict[str, Any]]:
+    """可容忍复制延迟的读：优先从库；未配置从库或在事务内时走主库"""
+    return await fetchone(sql, args, conn=conn, ro=True)
+
+async def fetchall_ro(sql: str, args: Tuple = (), conn=None) -> List[Dict[str, Any]]:
+    """可容忍复制延迟的读：优先从库；未配置从库或在事务内时走主库"""
+    return await fetchall(sql, args, conn=conn, ro=True)
 
-async def execute(sql: str, args: Tuple = ()) -> int:
+async def iter_rows(sql: str, args: Tuple = (), ro: bool = False, batch: int = 500):
+    """
+    服务端游标（SSDictCursor）逐批读取大结果集，不把整个结果载入内存。
+    迭代期间独占一个连接，调用方应尽快消费（如边读边写文件），不要在循环里做慢 IO。
+    循环体可能抛异常时在 finally 里 aclose()，否则挂起的生成器要等 GC 才归还连接：
+        rows = iter_rows("SELECT ...", (...,), ro=True)
+        try:
+            async for row in rows:
+                ...
+        finally:
+            await rows.aclose()
+    """
+    async with _borrow(None, ro) as c:
+        async with c.cursor(aiomysql.SSDictCursor) as cur:
+            t0 = time.monotonic()
+            n = 0
+            await cur.execute(sql, args)
+            while True:
+                rows = await cur.fetchmany(batch)
+                if not rows:
+                    break
+                n += len(rows)
+                for row in rows:
+                    yield row
+            _record(sql, (time.monotonic() - t0) * 1000, n)
+
+async def execute(sql: str, args: Tuple = (), conn=None) -> int:
     """
     兼容 INSERT：返回 lastrowid（若可用）；UPDATE/DELETE 场景不保证准确数量。
     """
-    async with (await get_conn()) as conn:
-        async with conn.cursor() as cur:
+    async with _borrow(conn) as c:
+        async with c.cursor() as cur:
+            t0 = time.monotonic()
             await cur.execute(sql, args)
+            _record(sql, (time.monotonic() - t0) * 1000, cur.rowcount or 0)
             return cur.lastrowid or 0
 
-async def execute_rowcount(sql: str, args: Tuple = ()) -> int:
+async def execute_rowcount(sql: str, args: Tuple = (), conn=None) -> int:
     """
     返回受影响行数，适合 UPDATE / DELETE 精确统计。
     """
-    async with (await get_conn()) as conn:
-        async with conn.cursor() as cur:
+    async with _borrow(conn) as c:
+        async with c.cursor() as cur:
+            t0 = time.monotonic()
             await cur.execute(sql, args)
+            _record(sql, (time.monotonic() - t0) * 1000, cur.rowcount or 0)
             return cur.rowcount or 0
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
@@ -48,11 +49,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_main_menu(update.effective_chat.id, context)
         return
 
-    trx = get_trx_balance(addr)
-    usdt = await get_usdt_balance(addr)
-    res  = get_account_resource(addr)
-    meta = await get_account_meta(addr)
-    label_info = probe_account_type(addr)
+    # 互不依赖的链上查询并发执行
+    trx, usdt, res, meta, label_info = await asyncio.gather(
+        get_trx_balance(addr),
+        get_usdt_balance(addr),
+        get_account_resource(addr),
+        get_account_meta(addr),
+        probe_account_type(addr),
+    )
 
     if label_info.get("is_exchange"):
         type_text = f"交易所账户：{label_info.get('name') or '-'}"
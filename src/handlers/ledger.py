@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
-from telegram import Update
+import csv
+import os
+import tempfile
+from datetime import datetime
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from ..models import list_ledger_recent, get_wallet
+from ..models import list_ledger_page, iter_ledger, get_wallet
 from ..consts import LEDGER_TYPE_CN
+from ..logger import app_logger
+from ..utils.logfmt import log_user
 from .common import fmt_amount
 from ..utils.monofmt import pad as mpad  # ← 新增
 
+PAGE_SIZE = 10
+
 def _fmt_row(t, typ, delta, after, on):
     # 时间(19)｜类型(8)｜变更额(12右)｜余额后(12右)｜订单号(12)
     return (
@@ -21,19 +30,27 @@ def _fmt_delta(x) -> str:
     except Exception:
         return " 0.00"
 
-async def show_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = update.effective_user
-    wallet = await get_wallet(u.id)
-    bal = fmt_amount((wallet or {}).get("usdt_trc20_balance", 0.0))
-    rows = await list_ledger_recent(u.id, 10)
+async def _load_page(user_id: int, before_id=None, after_id=None):
+    """
+    多取一行判断翻页方向上是否还有数据。
+    返回 (rows, has_newer, has_older)，rows 按 id 倒序且最多 PAGE_SIZE 条。
+    """
+    rows = await list_ledger_page(user_id, PAGE_SIZE + 1, before_id=before_id, after_id=after_id)
+    if after_id is not None:
+        # 往新翻：多出来的是最新那一行（列表头部）
+        has_newer = len(rows) > PAGE_SIZE
+        return (rows[-PAGE_SIZE:], has_newer, True)
+    has_older = len(rows) > PAGE_SIZE
+    return (rows[:PAGE_SIZE], before_id is not None, has_older)
 
+def _render_page(bal: str, rows, page: int, has_newer: bool, has_older: bool):
     header = f"💼 当前余额：{bal} USDT-TRC20"
+    title = "最近 10 笔账变：" if page == 1 else f"账变记录（第 {page} 页）："
     if not rows:
-        text = header + "\n```最近 10 笔账变：\n暂无记录```"
-        await update.message.reply_text(text, parse_mode="Markdown")
-        return
+        text = header + f"\n```{title}\n暂无记录```"
+        return (text, None)
 
-    lines = ["最近 10 笔账变：", _fmt_row("时间", "类型", "变更额", "余额后", "订单号")]
+    lines = [title, _fmt_row("时间", "类型", "变更额", "余额后", "订单号")]
     for r in rows:
         t = str(r["created_at"])[:19]
         ct = LEDGER_TYPE_CN.get(r["change_type"], r["change_type"])
@@ -43,6 +60,92 @@ async def show_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
         tail = on[-4:] if len(on) >= 4 else on
         show_on = ("…" + tail) if tail else ""
         lines.append(_fmt_row(t, ct, amt, after, show_on))
-
     text = header + "\n\n" + "```" + "\n".join(lines) + "```"
-    await update.message.reply_text(text, parse_mode="Markdown")
+
+    # 翻页按钮携带当前页首/尾 id 作为游标
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"ledger_newer:{rows[0]['id']}:{page - 1}"))
+    if has_older:
+        nav.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"ledger_older:{rows[-1]['id']}:{page + 1}"))
+    kb_rows = [nav] if nav else []
+    kb_rows.append([InlineKeyboardButton("📤 导出 CSV", callback_data="ledger_export")])
+    return (text, InlineKeyboardMarkup(kb_rows))
+
+async def show_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    u = update.effective_user
+    wallet = await get_wallet(u.id)
+    bal = fmt_amount((wallet or {}).get("usdt_trc20_balance", 0.0))
+    rows, has_newer, has_older = await _load_page(u.id)
+    text, kb = _render_page(bal, rows, 1, has_newer, has_older)
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=kb)
+
+async def ledger_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    data = q.data or ""
+    u = q.from_user
+
+    if data == "ledger_export":
+        await q.answer("正在导出，请稍候…")
+        await _send_ledger_csv(context, q.message.chat_id, u)
+        return
+
+    await q.answer()
+    try:
+        kind, cursor_id, page = data.split(":")
+        cursor_id, page = int(cursor_id), max(1, int(page))
+    except ValueError:
+        return
+    if kind == "ledger_older":
+        rows, has_newer, has_older = await _load_page(u.id, before_id=cursor_id)
+    else:
+        rows, has_newer, has_older = await _load_page(u.id, after_id=cursor_id)
+        if not has_newer:
+            page = 1
+
+    wallet = await get_wallet(u.id)
+    bal = fmt_amount((wallet or {}).get("usdt_trc20_balance", 0.0))
+    text, kb = _render_page(bal, rows, page, has_newer, has_older)
+    try:
+        await q.edit_message_text(text, parse_mode="Markdown", reply_markup=kb)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
+
+async def export_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _send_ledger_csv(context, update.effective_chat.id, update.effective_user)
+
+async def _send_ledger_csv(context: ContextTypes.DEFAULT_TYPE, chat_id: int, u):
+    """服务端游标逐行写入临时 CSV 文件后作为文档发送，内存占用与账变条数无关"""
+    fd, path = tempfile.mkstemp(prefix=f"ledger_{u.id}_", suffix=".csv")
+    n = 0
+    try:
+        # utf-8-sig：Excel 直接打开不乱码
+        with os.fdopen(fd, "w", newline="", encoding="utf-8-sig") as f:
+            w = csv.writer(f)
+            w.writerow(["ID", "时间", "类型", "变更额", "变更前余额", "变更后余额", "订单号", "备注"])
+            rows = iter_ledger(u.id)
+            try:
+                async for r in rows:
+                    w.writerow([
+                        r["id"], str(r["created_at"])[:19],
+                        LEDGER_TYPE_CN.get(r["change_type"], r["change_type"]),
+                        r["amount"], r["balance_before"], r["balance_after"],
+                        r.get("order_no") or "", r.get("remark") or "",
+                    ])
+                    n += 1
+            finally:
+                # 写文件出错时立即关闭游标、归还连接，不等 GC 回收挂起的生成器
+                await rows.aclose()
+        if n == 0:
+            await context.bot.send_message(chat_id, "暂无账变记录。")
+            return
+        fname = f"ledger_{u.id}_{datetime.now().strftime('%Y%m%d%H%M')}.csv"
+        with open(path, "rb") as f:
+            await context.bot.send_document(chat_id, document=f, filename=fname, caption=f"资金明细共 {n} 条")
+        app_logger.info("📤 导出资金明细：用户=%s，条数=%s", log_user(u), n)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
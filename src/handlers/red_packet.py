@@ -8,7 +8,6 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest
 from ..keyboards import redpacket_create_menu, redpacket_draft_menu
-from ..services.redalgo import split_random, split_average
 from ..logger import redpacket_logger
 from ..handlers.common import ensure_user_and_wallet, gc_track, gc_delete
 from .common import safe_reply as _safe_reply
@@ -19,17 +18,23 @@ from datetime import datetime, timedelta
 from typing import Optional
 from ..services.format import fmt_amount as fmt
 from ..models import (
-    list_red_packets, create_red_packet, get_red_packet, save_red_packet_share,
-    list_red_packet_shares, count_claimed,
-    set_red_packet_status, get_wallet, update_wallet_balance, add_ledger, execute,
+    list_red_packets, create_red_packet, get_red_packet, prepare_red_packet_shares,
+    set_red_packet_status, get_wallet, update_wallet_balance, add_ledger, update_red_packet_fields,
     get_tx_password_hash, has_tx_password, list_ledger_recent, get_flag,
-    sum_claimed_amount, list_user_active_red_packets, claim_share_atomic,
-    list_red_packet_claims, get_red_packet_by_no, get_red_packet_mvp  # 新增
+    refund_active_red_packets, claim_share_atomic,
+    list_red_packet_claims, get_red_packet_snapshot, AlreadyClaimed
 )
+from ..db import transaction
+from ..config import INLINE_CACHE_TIME
+from ..services import claims, packetstate
+from ..services.panels import refresher as panel_refresher
 from . import wallet as h_wallet
 from . import password as h_password
 import random
 
+# 已结束/已过期红包的 inline 空结果缓存时长（秒）
+_INLINE_CACHE_FINAL = 300
+
 
 def _human_dur(start) -> str:
     try:
@@ -149,13 +154,13 @@ async def _guard_redpkt(update, context) -> bool:
 async def show_red_packets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await ensure_user_and_wallet(update, context)
     u = update.effective_user
-    from ..models import list_red_packets, sum_claimed_amount, count_claimed
+    from ..models import list_red_packets_summary
     from ..models import get_wallet
     from ..utils.monofmt import pad as mpad
 
     wallet = await get_wallet(u.id)
     bal = fmt((wallet or {}).get("usdt_trc20_balance", 0.0))
-    recs = await list_red_packets(u.id, 10)
+    recs = await list_red_packets_summary(u.id, 10)
 
     header = f"💼 当前余额：{bal} USDT-TRC20"
     col_idx = 3
@@ -176,8 +181,8 @@ async def show_red_packets(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     pass
             total_amt = float(r["total_amount"])
             total_cnt = int(r["count"])
-            got_amt = float(await sum_claimed_amount(r["id"]))
-            got_cnt = int(await count_claimed(r["id"]))
+            got_amt = float(r.get("claimed_amount") or 0)
+            got_cnt = int(r.get("claimed_count") or 0)
 
             st = r.get("status")
             if st in ("paid", "sent"):
@@ -213,19 +218,20 @@ async def show_red_packets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     redpacket_logger.info("🧧 打开红包页（无序号按钮）：用户=%s，最近记录数=%s", log_user(u), len(recs))
 
 
-async def _render_claim_panel(r: dict, bot_username: str) -> tuple[str, InlineKeyboardMarkup]:
-    from ..models import list_red_packet_claims, count_claimed, sum_claimed_amount, get_user
-
+def _render_claim_panel(snap: dict, bot_username: str) -> tuple[str, InlineKeyboardMarkup]:
+    """纯渲染：输入 get_red_packet_snapshot 的结果，不访问数据库"""
+    r = snap["packet"]
     owner_id = r["owner_id"]
-    owner = await get_user(owner_id)
+    owner = snap["owner"]
     owner_link = f"[{_safe_name_row(owner, owner_id)}](tg://user?id={owner_id})"
     type_cn = {"random": "随机", "average": "平均", "exclusive": "专属"}.get(r["type"], "随机")
     type_link = f"[](tg://user?id={owner_id})"
 
     total_amt = float(r["total_amount"])
     total_cnt = int(r["count"])
-    claimed_amt = await sum_claimed_amount(r["id"])
-    claimed_cnt = await count_claimed(r["id"])
+    # 已领数量/金额由领取事务维护在红包行上
+    claimed_amt = float(r.get("claimed_amount") or 0)
+    claimed_cnt = int(r.get("claimed_count") or 0)
     remain_cnt = max(0, total_cnt - claimed_cnt)
 
     expire_text = "-"
@@ -243,12 +249,12 @@ async def _render_claim_panel(r: dict, bot_username: str) -> tuple[str, InlineKe
     lines.append("")
 
     # 动态区
-    claims = await list_red_packet_claims(r["id"])
+    claims = snap["claims"]
     if not claims:
         lines.append("`未领取`")
     else:
         rows = ["ID  用户  金额  时间"]
-        for it in claims[:10]:
+        for it in claims:
             disp = (it.get("display_name") or ((it.get("first_name") or "") + (it.get("last_name") or ""))).strip()
             who = disp or (it.get("username") or f"id{it.get('claimed_by')}")
             tm = str(it["claimed_at"])[11:16] if it.get("claimed_at") else "-"
@@ -263,7 +269,7 @@ async def _render_claim_panel(r: dict, bot_username: str) -> tuple[str, InlineKe
         lines.append(f"\n剩余：0个，已抢完，用时：{used}")
 
     # MVP
-    mvp = await get_red_packet_mvp(r["id"])
+    mvp = snap["mvp"]
     if mvp:
         name = _safe_name_row(mvp, int(mvp.get("claimed_by") or 0))
         mvp_link = f"[{name}](tg://user?id={int(mvp.get('claimed_by') or 0)})"
@@ -273,10 +279,7 @@ async def _render_claim_panel(r: dict, bot_username: str) -> tuple[str, InlineKe
     lines.append(f"\n提现 👉 @{bot_username}")
 
     # 键盘：有剩余才显示领取按钮；专属红包仅专属对象可见按钮（在回调里再二次校验）
-    from ..models import count_claimed
-    claimed = await count_claimed(r["id"])
-    remain = max(0, total_cnt - int(claimed))
-    if remain <= 0:
+    if remain_cnt <= 0:
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("我的钱包", url=f"https://t.me/{bot_username}?start=start")]])
     else:
         kb = InlineKeyboardMarkup([
@@ -287,11 +290,11 @@ async def _render_claim_panel(r: dict, bot_username: str) -> tuple[str, InlineKe
     return ("\n".join(lines), kb)
 
 async def _update_claim_panel(bot, rp_id: int, inline_message_id: Optional[str] = None):
-    from ..models import get_red_packet
-    r = await get_red_packet(rp_id)
-    if not r:
+    snap = await packetstate.get_snapshot(rp_id, get_red_packet_snapshot)
+    if not snap:
         return
-    text, kb = await _render_claim_panel(r, bot.username)
+    r = snap["packet"]
+    text, kb = _render_claim_panel(snap, bot.username)
     try:
         if inline_message_id:
             await bot.edit_message_text(
@@ -315,6 +318,11 @@ async def _update_claim_panel(bot, rp_id: int, inline_message_id: Optional[str]
             return
         raise
 
+def _schedule_claim_panel(bot, rp_id: int, inline_message_id: Optional[str] = None):
+    """领取后刷新面板：按消息去抖、后台执行，不阻塞领取回调"""
+    key = ("inline", inline_message_id) if inline_message_id else ("rp", rp_id)
+    panel_refresher.schedule(key, lambda: _update_claim_panel(bot, rp_id, inline_message_id=inline_message_id))
+
 def _compose_create_text(rp_type: str, count: int, amount: float, cover=None) -> str:
     type_cn = {"random": "随机", "average": "平均", "exclusive": "专属"}.get(rp_type, "随机")
     cover_line = cover if cover else "封面未设置"
@@ -353,8 +361,7 @@ async def rp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _safe_answer("未找到红包", True)
             return
         from ..consts import STATUS_CN
-        shares = await list_red_packet_shares(rp_id)
-        claimed = sum(1 for s in shares if s["claimed_by"]) if shares else 0
+        claimed = int(r.get("claimed_count") or 0)   # 延迟落库的红包未领份额没有行，不能数 shares
         type_cn = {"random": "随机", "average": "平均", "exclusive": "专属"}.get(r["type"], r["type"])
         head = [
             "🧧 红包详情",
@@ -543,7 +550,12 @@ async def rp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ========= 领取 =========
     if data.startswith("rp_claim:"):
         rp_id = int(data.split(":")[1])
-        r = await get_red_packet(rp_id)
+        # 重复点击：内存里直接拒绝，不查库
+        if claims.has_claimed(rp_id, u.id):
+            await _safe_answer("你已经领过这个红包了", True)
+            return
+        # 状态走进程内缓存：已结束的红包直接在内存里答复
+        r = await packetstate.get(rp_id)
         if not r or r["status"] not in ("sent", "paid"):
             await _safe_answer("红包不可领取或不存在。", True)
             return
@@ -557,25 +569,25 @@ async def rp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _safe_answer("你不是我的宝贝,不能领取!", True)
             return
 
-        ret = await claim_share_atomic(rp_id, u.id)
+        try:
+            ret = await claims.claim(rp_id, u.id)
+        except AlreadyClaimed:
+            await _safe_answer("你已经领过这个红包了", True)
+            redpacket_logger.info("🧧 重复领取已拒绝：用户=%s，红包ID=%s", log_user(u), rp_id)
+            return
         if not ret:
             await _safe_answer("已被抢完", True)
-            try:
-                await _update_claim_panel(context.bot, rp_id, inline_message_id=q.inline_message_id)
-            except Exception:
-                pass
+            _schedule_claim_panel(context.bot, rp_id, q.inline_message_id)
             redpacket_logger.info("🧧 领取失败（已抢完）：用户=%s，红包ID=%s", log_user(u), rp_id)
             return
 
         share_id, amt = ret
         await _safe_answer(f"领取成功：+{fmt(amt)} USDT", True)
-        claimed = await count_claimed(rp_id)
-        if claimed >= int(r["count"]):
+        # 领取事务已把最新计数写入状态缓存
+        st = await packetstate.get(rp_id)
+        if st and st["remaining_count"] == 0 and st["status"] in ("sent", "paid"):
             await set_red_packet_status(rp_id, "finished")
-        try:
-            await _update_claim_panel(context.bot, rp_id, inline_message_id=q.inline_message_id)
-        except Exception:
-            pass
+        _schedule_claim_panel(context.bot, rp_id, q.inline_message_id)
         redpacket_logger.info("🧧 领取成功：用户=%s，红包ID=%s，份额#%s，金额=%.6f",
                               log_user(u), rp_id, share_id, float(amt))
         return
@@ -593,40 +605,23 @@ async def rp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "rp_refund_all":
-        rps = await list_user_active_red_packets(u.id)
-        if not rps:
+        # 单事务集合式回收：批量关闭 + 一次入账 + 多行记账
+        res = await refund_active_red_packets(u.id)
+        if not res["ids"]:
             await _safe_reply("当前没有处于使用中的红包。")
             return
-        from decimal import Decimal
-        refund_sum = Decimal("0")
-        refund_count = 0
-        closed_count = 0
-        for r in rps:
-            await set_red_packet_status(r["id"], "finished")
-            closed_count += 1
-            claimed = Decimal(str(await sum_claimed_amount(r["id"])))
-            total = Decimal(str(r["total_amount"]))
-            remain = total - claimed
-            if remain > 0:
-                wallet = await get_wallet(u.id)
-                before = Decimal(str((wallet or {}).get("usdt_trc20_balance", 0)))
-                after = before + remain
-                rp_no = r["rp_no"]
-                order_no = f"red_refund_{rp_no}"
-                await update_wallet_balance(u.id, float(after))
-                await add_ledger(
-                    u.id, "redpacket_refund", float(remain), float(before), float(after),
-                    "red_packets", r["id"], "红包退回（批量回收）", order_no
-                )
-                redpacket_logger.info("🧧 回收退款：用户=%s，红包=%s，退款=%.6f，余额：%.6f → %.6f",
-                                      log_user(u), rp_no, float(remain), float(before), float(after))
-                refund_sum += remain
-                refund_count += 1
-        w = await get_wallet(u.id)
-        cur_bal = fmt((w or {}).get("usdt_trc20_balance", 0.0))
+        for rp_id in res["ids"]:
+            claims.forget(rp_id)
+        if res["balance"] is None:
+            w = await get_wallet(u.id)
+            cur_bal = fmt((w or {}).get("usdt_trc20_balance", 0.0))
+        else:
+            cur_bal = fmt(res["balance"])
+        redpacket_logger.info("🧧 批量回收：用户=%s，关闭=%s，退款=%s 个，合计=%.6f，红包ID=%s",
+                              log_user(u), res["closed"], res["refunded"], float(res["amount"]), res["ids"])
         await _safe_reply(
-            f"✅ 已关闭 {closed_count} 个红包，"
-            f"其中 {refund_count} 个发生退款，合计：{fmt(refund_sum)} USDT。\n"
+            f"✅ 已关闭 {res['closed']} 个红包，"
+            f"其中 {res['refunded']} 个发生退款，合计：{fmt(res['amount'])} USDT。\n"
             f"💼 当前余额：{cur_bal} USDT"
         )
         return
@@ -759,7 +754,7 @@ async def on_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 n = int(text.strip())
                 if n <= 0 or n > 1000:
                     raise ValueError
-                await execute("UPDATE red_packets SET count=%s WHERE id=%s", (n, rp_id))
+                await update_red_packet_fields(rp_id, count=n)
                 curr_count = n
                 redpacket_logger.info("🧧 设置数量：用户=%s，红包ID=%s，新数量=%s", u.id, rp_id, n)
             except Exception:
@@ -770,7 +765,7 @@ async def on_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 v = float(text.strip())
                 if v <= 0:
                     raise ValueError
-                await execute("UPDATE red_packets SET total_amount=%s WHERE id=%s", (v, rp_id))
+                await update_red_packet_fields(rp_id, total_amount=v)
                 curr_amount = v
                 redpacket_logger.info("🧧 设置金额：用户=%s，红包ID=%s，新金额=%.6f", u.id, rp_id, v)
             except Exception:
@@ -790,24 +785,24 @@ async def on_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     except Exception:
                         target_id = None
             if target_id:
-                await execute("UPDATE red_packets SET exclusive_user_id=%s, type='exclusive' WHERE id=%s", (target_id, rp_id))
+                await update_red_packet_fields(rp_id, exclusive_user_id=target_id, type="exclusive")
                 curr_type = "exclusive"
                 redpacket_logger.info("🧧 设置专属：用户=%s，红包ID=%s，专属对象=%s", u.id, rp_id, target_id)
             new_cover = await _build_default_cover("exclusive", r["owner_id"], target_id or r.get("exclusive_user_id"))
-            await execute("UPDATE red_packets SET cover_text=%s WHERE id=%s", (new_cover, rp_id))
+            await update_red_packet_fields(rp_id, cover_text=new_cover)
             cover = new_cover
 
         elif field == "cover":
             if update.message.photo:
                 file_id = update.message.photo[-1].file_id
-                await execute("UPDATE red_packets SET cover_image_file_id=%s WHERE id=%s", (file_id, rp_id))
+                await update_red_packet_fields(rp_id, cover_image_file_id=file_id)
                 cover = "[图片封面]"
                 redpacket_logger.info("🧧 设置封面(图片)：用户=%s，红包ID=%s，file_id=%s", u.id, rp_id, file_id)
             else:
                 s = text.strip()
                 if len(s) > 150:
                     await update.message.reply_text("文字封面最多150字符，请重试。"); return
-                await execute("UPDATE red_packets SET cover_text=%s WHERE id=%s", (s, rp_id))
+                await update_red_packet_fields(rp_id, cover_text=s)
                 cover = s or "未设置"
                 redpacket_logger.info("🧧 设置封面(文字)：用户=%s，红包ID=%s，文字长度=%s", u.id, rp_id, len(s))
 
@@ -913,15 +908,44 @@ async def rppwd_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await gc_delete(context, q.message.chat_id, "rppwd")
                 return
 
-        # 资金校验与扣款、拆份、记账（与原逻辑一致）……
+        # 资金校验与扣款、拆份、记账：同一连接、同一事务内完成，要么全部成功要么全部回滚
         from decimal import Decimal
-        wallet = await get_wallet(u.id)
-        bal = Decimal(str((wallet or {}).get("usdt_trc20_balance", 0)))
-        frozen = Decimal(str((wallet or {}).get("usdt_trc20_frozen", 0) or 0))
-        avail = bal - frozen
-        total = Decimal(str(r["total_amount"]))
+        paid = False
+        async with transaction() as conn:
+            r = await get_red_packet(r["id"], conn=conn, for_update=True)
+            wallet = await get_wallet(u.id, conn=conn, for_update=True)
+            bal = Decimal(str((wallet or {}).get("usdt_trc20_balance", 0)))
+            frozen = Decimal(str((wallet or {}).get("usdt_trc20_frozen", 0) or 0))
+            avail = bal - frozen
+            total = Decimal(str(r["total_amount"]))
+
+            if r["status"] == "created" and avail >= total:
+                new_bal = bal - total
+                await update_wallet_balance(u.id, float(new_bal), conn=conn)
+                await prepare_red_packet_shares(r, conn=conn)
+                await set_red_packet_status(r["id"], "paid", conn=conn)
+                rp_no = r["rp_no"]
+                order_no = f"red_send_{rp_no}"
+                await add_ledger(
+                    u.id, "redpacket_send", -float(total), float(bal), float(new_bal),
+                    "red_packets", r["id"], "发送红包扣款", order_no, conn=conn
+                )
+                paid = True
+        if paid:
+            # 提交后再失效一次：事务期间可能有并发读把 created 状态重新缓存
+            packetstate.invalidate(r["id"])
+
+        if not paid and r["status"] != "created":
+            context.user_data.pop("rppwd_flow", None)
+            try:
+                await q.message.edit_text("会话已过期，请重新创建新红包！")
+            except BadRequest:
+                pass
+            redpacket_logger.info("🧧 支付失败：红包状态=%s，用户=%s，红包ID=%s", r["status"], log_user(u), r["id"])
+            await gc_delete(context, q.message.chat_id, "rppwd")
+            return
 
-        if avail < total:
+        if not paid:
             context.user_data.pop("rppwd_flow", None)
             try:
                 await q.message.edit_text("余额不足（可用余额不足），无法支付！")
@@ -932,21 +956,6 @@ async def rppwd_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await gc_delete(context, q.message.chat_id, "rppwd")
             return
 
-        # 扣款 + 拆份 + 记账
-        new_bal = bal - total
-        await update_wallet_balance(u.id, float(new_bal))
-        shares = split_random(float(total), int(r["count"])) if r["type"] == "random" else split_average(float(total), int(r["count"]))
-        for i, s in enumerate(shares, 1):
-            await save_red_packet_share(r["id"], i, float(s))
-        await set_red_packet_status(r["id"], "paid")
-        rp_info = await get_red_packet(r["id"])
-        rp_no = rp_info["rp_no"]
-        order_no = f"red_send_{rp_no}"
-        await add_ledger(
-            u.id, "redpacket_send", -float(total), float(bal), float(new_bal),
-            "red_packets", r["id"], "发送红包扣款", order_no
-        )
-
         # 清理状态
         context.user_data.pop("rppwd_flow", None)
         context.user_data.pop("rp_draft", None)
@@ -1023,22 +1032,28 @@ async def inlinequery_handle(update: Update, context: ContextTypes.DEFAULT_TYPE)
     r = None
     try:
         if token.isdigit():
-            r = await get_red_packet(int(token))
+            r = await packetstate.get(int(token))
         if r is None:
-            r = await get_red_packet_by_no(token)
+            r = await packetstate.get_by_no(token)
     except Exception as e:
         redpacket_logger.exception("🧧 [inline] 查询红包异常：token=%s err=%s", token, e)
         await iq.answer([], cache_time=0, is_personal=True)
         return
 
     if not r or r.get("status") not in ("paid", "sent"):
-        await iq.answer([], cache_time=0, is_personal=True)
+        # 已结束/已过期不会再变，可让 Telegram 长时间缓存空结果
+        await iq.answer([], cache_time=_INLINE_CACHE_FINAL if packetstate.is_final(r) else 0, is_personal=True)
         redpacket_logger.info("🧧 [inline] 未找到或不可用：token=%s status=%s", token, r.get("status") if r else None)
         return
 
-    txt, kb = await _render_claim_panel(r, context.bot.username)
+    snap = await packetstate.get_snapshot(r["id"], get_red_packet_snapshot)
+    if not snap:
+        await iq.answer([], cache_time=0, is_personal=True)
+        return
+    r = snap["packet"]
+    txt, kb = _render_claim_panel(snap, context.bot.username)
     title = f"红包：{fmt(r['total_amount'])} U / {r['count']}"
-    desc = f"红包金额：{fmt(await sum_claimed_amount(r['id']))}/{fmt(r['total_amount'])} U，已领数量：{await count_claimed(r['id'])}/{r['count']}"
+    desc = f"红包金额：{fmt(r.get('claimed_amount') or 0)}/{fmt(r['total_amount'])} U，已领数量：{int(r.get('claimed_count') or 0)}/{r['count']}"
 
     res = InlineQueryResultArticle(
         id=str(uuid4()),
@@ -1047,7 +1062,7 @@ async def inlinequery_handle(update: Update, context: ContextTypes.DEFAULT_TYPE)
         reply_markup=kb,
         description=desc
     )
-    await iq.answer([res], cache_time=0, is_personal=True)
+    await iq.answer([res], cache_time=INLINE_CACHE_TIME, is_personal=True)
     redpacket_logger.info("🧧 [inline] 生成预览：user=%s rp_id=%s rp_no=%s", log_user(u), r["id"], r.get("rp_no"))
 
 async def on_chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1062,8 +1077,8 @@ async def on_chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_
         token = q.strip()
 
     try:
-        r = await get_red_packet_by_no(token) if token else None
-        if r:
+        r = await packetstate.get_by_no(token) if token else None
+        if r and r["status"] == "paid":
             await set_red_packet_status(r["id"], "sent")
             redpacket_logger.info("🧧 [inline] 发送到聊天：user=%s rp_id=%s rp_no=%s inline_msg=%s",
                                   log_user(update.effective_user), r["id"], r["rp_no"], cir.inline_message_id)
@@ -246,13 +246,13 @@ async def wdpwd_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # 2) 资源准备
             try:
                 need_energy = int(os.getenv("WITHDRAW_ENERGY_REQUIRE", "90000"))
-                res0 = get_account_resource(AGGREGATE_ADDRESS)
+                res0 = await get_account_resource(AGGREGATE_ADDRESS)
                 if res0["energy"] < need_energy:
                     gap = max(need_energy - res0["energy"], int(os.getenv("TRONGAS_MIN_RENT","32000")))
                     await rent_energy(receive_address=AGGREGATE_ADDRESS, pay_nums=gap, rent_time=1, order_notes=f"wd-{u.id}")
                     t_end = time.time() + int(os.getenv("TRONGAS_ACTIVATION_DELAY","30"))
                     while time.time() < t_end:
-                        res1 = get_account_resource(AGGREGATE_ADDRESS)
+                        res1 = await get_account_resource(AGGREGATE_ADDRESS)
                         if res1["energy"] >= need_energy:
                             break
                         await asyncio.sleep(2)
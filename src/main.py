@@ -15,7 +15,8 @@ from .config import (
     WEBHOOK_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL_PATH, WEBHOOK_URL_FULL, WEBHOOK_SECRET, ALLOWED_UPDATES
 )
 
-from .db import init_pool, close_pool
+from .db import init_pool, close_pool, pool_stats, query_stats
+from .migrate import pending_migrations
 from datetime import datetime
 from .handlers import start as h_start
 from .handlers import wallet as h_wallet
@@ -30,6 +31,9 @@ from .handlers import support as h_support
 from .handlers import password as h_password
 from .handlers import common as h_common
 from .logger import app_logger
+from .utils import reqcache
+from .services.panels import refresher as panel_refresher
+from .services import packetstate, trongrid
 
 import asyncio, sys
 
@@ -130,6 +134,22 @@ async def diag(update, context):
         f"pending = {wh.pending_update_count}",
         f"secret.len = {len(WEBHOOK_SECRET or '')}",
     ]
+    for st in pool_stats():
+        txt.append(
+            f"db[{st['pool']}] = in_use {st['in_use']} / free {st['free']} / max {st['maxsize']}, "
+            f"acquired {st['acquired']}, timeouts {st['timeouts']}, "
+            f"wait avg {st['wait_avg_ms']}ms max {st['wait_max_ms']}ms"
+        )
+        txt.append(f"db[{st['pool']}].wait_hist = {st['wait_hist']}")
+    for b in trongrid.limiter.stats():
+        txt.append(
+            f"trongrid[{b['key']}] = qps {b['qps']}, tokens {b['tokens']}, cooldown {b['cooldown']}s, "
+            f"requests {b['requests']}, 429 x{b['429']}, 403 x{b['403']}"
+        )
+    ps = packetstate.stats()
+    txt.append(f"packet_state = entries {ps['entries']}, hits {ps['hits']}, misses {ps['misses']}")
+    for q in query_stats(5):
+        txt.append(f"sql x{q['count']} total {q['total_ms']}ms p50 {q['p50_ms']} p99 {q['p99_ms']} rows {q['rows']} :: {q['sql'][:120]}")
     await update.message.reply_text("\n".join(txt))
 
 if hasattr(sys.stdout, "reconfigure"):
@@ -145,6 +165,13 @@ async def _tap(update: Update, context):
     except Exception:
         pass
 
+async def _reqcache_begin(update: Update, context):
+    # 每个 Update 一份读缓存：同一次处理内重复的 get_wallet / get_red_packet 等只查一次库
+    reqcache.begin()
+
+async def _reqcache_end(update: Update, context):
+    reqcache.end()
+
 async def on_error(update, context):
     app_logger.exception("🔥 Handler error: %s | update=%s", context.error, getattr(update, "to_dict", lambda: update)())
 
@@ -198,6 +225,10 @@ async def on_text_router(update, context):
 from .services.tron import is_valid_address
 async def _startup(app):
     await init_pool()
+    pending = await pending_migrations()
+    if pending:
+        app_logger.warning("⚠️ 有 %s 个数据库迁移未执行（%s），请先运行：python -m src.migrate up",
+                           len(pending), ", ".join(f"{v:04d}_{n}" for v, n, _ in pending))
     # === 启动自检：避免把 ERC20/EVM 地址错配到 TRON ===
     if not is_valid_address(AGGREGATE_ADDRESS):
         app_logger.error("AGGREGATE_ADDRESS=%s 不是有效的 TRON 地址（应以 T 开头，34 位）。请检查 .env（USDT-TRC20）", AGGREGATE_ADDRESS)
@@ -215,6 +246,7 @@ async def _startup(app):
             BotCommand("recharge", "充值"),
             BotCommand("withdraw", "提现"),
             BotCommand("records", "资金明细"),
+            BotCommand("export", "导出资金明细（CSV）"),
             BotCommand("addr", "地址查询"),
             BotCommand("support", "联系客服"),
             BotCommand("password", "设置/修改交易密码"),
@@ -225,6 +257,8 @@ async def _startup(app):
     app_logger.info("🚀 机器人已启动，等待消息...")
 
 async def _shutdown(app):
+    await panel_refresher.close()
+    await trongrid.aclose()
     await close_pool()
     app_logger.info("🛑 机器人已关闭。")
 
@@ -241,6 +275,9 @@ def build_app():
 
     app = ApplicationBuilder().token(BOT_TOKEN).request(request).build()
 
+    # Update 级读缓存：最先开启、最后关闭
+    app.add_handler(TypeHandler(Update, _reqcache_begin), group=-1)
+
     # 诊断命令
     app.add_handler(CommandHandler("ping", ping))
     app.add_handler(CommandHandler("diag", diag))
@@ -251,17 +288,19 @@ def build_app():
     app.add_handler(CommandHandler("recharge", h_recharge.show_recharge))
     app.add_handler(CommandHandler("withdraw", h_withdraw.show_withdraw))
     app.add_handler(CommandHandler("records", h_ledger.show_ledger))
+    app.add_handler(CommandHandler("export", h_ledger.export_ledger))
     app.add_handler(CommandHandler("addr", h_addrquery.addr_query))
     app.add_handler(CommandHandler("support", h_support.show_support))
     app.add_handler(CommandHandler("password", h_password.set_password))
 
-    # CallbackQuery：红包 / 充值 / 提现 / 密码键盘 / 常用地址回调
+    # CallbackQuery：红包 / 充值 / 提现 / 密码键盘 / 常用地址 / 资金明细翻页
     app.add_handler(CallbackQueryHandler(h_rp.rp_callback, pattern=r"^(rp_|rpd_)"))
     app.add_handler(CallbackQueryHandler(h_rp.rppwd_callback, pattern=r"^rppwd:"))
     app.add_handler(CallbackQueryHandler(h_recharge.recharge_callback, pattern=r"^recharge_"))
     app.add_handler(CallbackQueryHandler(h_withdraw.withdraw_callback, pattern=r"^withdraw_"))
     app.add_handler(CallbackQueryHandler(h_password.password_kb_callback, pattern=r"^pwd:"))
     app.add_handler(CallbackQueryHandler(h_addrbook.address_kb_callback, pattern=r"^addrbook"))
+    app.add_handler(CallbackQueryHandler(h_ledger.ledger_callback, pattern=r"^ledger_"))
 
     # Inline Query（红包预览卡片）
     app.add_handler(InlineQueryHandler(h_rp.inlinequery_handle))
@@ -276,6 +315,7 @@ def build_app():
     # 在 main() 里、所有 handler 加完后追加：
     app.add_error_handler(on_error)
     app.add_handler(TypeHandler(Update, _tap), group=999)
+    app.add_handler(TypeHandler(Update, _reqcache_end), group=1000)
 
     # 生命周期钩子
     app_logger.info("Allowed updates = %s", ALLOWED_UPDATES)
@@ -0,0 +1,126 @@
+"""
+数据库结构迁移
+
+    python -m src.migrate up        # 依次执行所有未应用的迁移
+    python -m src.migrate status    # 查看已应用 / 待应用版本
+
+迁移文件放在仓库根目录 migrations/，命名 NNNN_说明.sql，按版本号升序执行；
+已执行的版本记录在 schema_migrations 表。MySQL 的 DDL 会隐式提交，
+所以每个文件逐条执行、全部成功后才记版本；中途失败修正后重跑即可，
+“列/索引/表已存在”类错误按已执行跳过（用于接管 db.sql 导入的存量库）。
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sys
+from typing import Dict, List, Tuple
+from .db import init_pool, close_pool, fetchall, execute
+from .logger import app_logger
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+_RE_FILE = re.compile(r"^(\d{4})_([\w\-]+)\.sql$")
+
+# 1050 表已存在 / 1060 列已存在 / 1061 索引名已存在 / 1091 DROP 的列或索引不存在
+_ALREADY_APPLIED_ERRNOS = {1050, 1060, 1061, 1091}
+
+_CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` int(11) NOT NULL,
+  `name` varchar(128) NOT NULL,
+  `checksum` char(64) NOT NULL,
+  `applied_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+def discover() -> List[Tuple[int, str, str]]:
+    """扫描 migrations/，返回 [(version, name, path)]，版本号重复直接报错"""
+    out: Dict[int, Tuple[int, str, str]] = {}
+    for fn in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = _RE_FILE.match(fn)
+        if not m:
+            continue
+        ver = int(m.group(1))
+        if ver in out:
+            raise RuntimeError(f"迁移版本号重复：{fn} 与 {os.path.basename(out[ver][2])}")
+        out[ver] = (ver, m.group(2), os.path.join(MIGRATIONS_DIR, fn))
+    return [out[v] for v in sorted(out)]
+
+def split_statements(sql: str) -> List[str]:
+    """去掉 -- 注释行，按行尾分号切分语句（迁移文件内不写存储过程/触发器）"""
+    lines = [ln for ln in sql.splitlines() if not ln.lstrip().startswith("--")]
+    parts = re.split(r";\s*$", "\n".join(lines), flags=re.M)
+    return [p.strip() for p in parts if p.strip()]
+
+def _checksum(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+async def applied_versions() -> Dict[int, dict]:
+    await execute(_CREATE_VERSION_TABLE)
+    rows = await fetchall("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version")
+    return {int(r["version"]): r for r in rows}
+
+async def pending_migrations() -> List[Tuple[int, str, str]]:
+    done = await applied_versions()
+    return [m for m in discover() if m[0] not in done]
+
+async def _apply(ver: int, name: str, path: str):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    for stmt in split_statements(text):
+        try:
+            await execute(stmt)
+        except Exception as e:
+            errno = e.args[0] if e.args else None
+            if errno in _ALREADY_APPLIED_ERRNOS:
+                app_logger.warning("⏭️ 迁移 %04d 跳过已存在的对象：%s", ver, e.args[1] if len(e.args) > 1 else e)
+                continue
+            app_logger.error("❌ 迁移 %04d_%s 失败：%s\n%s", ver, name, e, stmt)
+            raise
+    await execute(
+        "INSERT INTO schema_migrations(version, name, checksum) VALUES(%s,%s,%s)",
+        (ver, name, _checksum(text))
+    )
+    app_logger.info("✅ 迁移 %04d_%s 已应用", ver, name)
+
+async def up() -> int:
+    """应用所有待执行迁移，返回本次应用的个数"""
+    todo = await pending_migrations()
+    for ver, name, path in todo:
+        await _apply(ver, name, path)
+    if not todo:
+        app_logger.info("数据库结构已是最新")
+    return len(todo)
+
+async def status():
+    done = await applied_versions()
+    for ver, name, path in discover():
+        r = done.get(ver)
+        if r is None:
+            print(f"  [待应用] {ver:04d}_{name}")
+            continue
+        with open(path, encoding="utf-8") as f:
+            changed = _checksum(f.read()) != r["checksum"]
+        print(f"  [已应用] {ver:04d}_{name}  {r['applied_at']}" + ("  ⚠️ 文件已在应用后被修改" if changed else ""))
+
+async def _run(cmd: str):
+    await init_pool()
+    try:
+        if cmd == "up":
+            await up()
+        else:
+            await status()
+    finally:
+        await close_pool()
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if cmd not in ("up", "status"):
+        print(__doc__)
+        sys.exit(2)
+    asyncio.run(_run(cmd))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
 import random, string
-from .db import fetchone, fetchall, execute, execute_rowcount, get_conn  # 新增 get_conn
-import aiomysql
+from .db import fetchone, fetchall, fetchall_ro, execute, execute_rowcount, transaction, iter_rows
+from .utils import reqcache
+from .config import LAZY_SHARES_MIN_COUNT, RED_PACKET_SPLIT_MODE
+from .services.redalgo import split_for_packet, new_split_seed, SPLIT_MODES, SPLIT_V2_DOUBLE_MEAN
+from .services import packetstate
 from decimal import Decimal
 
 
@@ -22,6 +25,7 @@ async def set_flag(k: str, v: str):
 # ===== 汇总 =====
 
 async def get_total_user_balance(asset: str) -> float:
+    # 对账结果决定是否锁红包/提现，从库落后会漏算刚入账的余额，必须读主库
     # 当前仅一种资产 USDT-TRC20，直接统算 user_wallets.usdt_trc20_balance
     row = await fetchone("SELECT COALESCE(SUM(usdt_trc20_balance),0) AS t FROM user_wallets", ())
     return float(row["t"] if row and row["t"] is not None else 0.0)
@@ -64,6 +68,29 @@ async def list_recharge_waiting() -> List[Dict[str, Any]]:
         ()
     )
 
+async def list_recharge_waiting_by_addresses(addresses: List[str]) -> List[Dict[str, Any]]:
+    """扫描器发现入账的地址对应的等待中订单"""
+    addrs = sorted(set(a for a in addresses if a))
+    if not addrs:
+        return []
+    ph = ",".join(["%s"] * len(addrs))
+    return await fetchall(
+        f"SELECT * FROM recharge_orders WHERE status='waiting' AND expire_at>NOW() AND address IN ({ph}) ORDER BY id ASC",
+        tuple(addrs)
+    )
+
+async def list_recharge_waiting_since(created_after: datetime, after_id: int = 0,
+                                      limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    上一轮之后新建的等待中订单（下单前已到账的充值不会再出现在后续区块里，需单独查一次）。
+    按 id 分页：调用方以上一页最后的 id 作为 after_id 继续取，直到不足一页。
+    """
+    return await fetchall(
+        "SELECT * FROM recharge_orders WHERE status='waiting' AND expire_at>NOW() AND created_at>=%s AND id>%s "
+        "ORDER BY id ASC LIMIT %s",
+        (created_after, after_id, limit)
+    )
+
 async def list_recharge_collecting() -> List[Dict[str, Any]]:
     return await fetchall(
         "SELECT * FROM recharge_orders WHERE status='collecting' ORDER BY id ASC LIMIT 100",
@@ -98,12 +125,17 @@ async def ensure_user(user_id: int, username: Optional[str], first_name: Optiona
         "last_name=VALUES(last_name), display_name=VALUES(display_name)",
         (user_id, username, first_name, last_name, name)
     )
+    reqcache.invalidate("user", user_id)
 
 async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
-    return await fetchone("SELECT * FROM users WHERE id=%s", (user_id,))
+    row = reqcache.get("user", user_id)
+    if reqcache.is_miss(row):
+        row = await fetchone("SELECT * FROM users WHERE id=%s", (user_id,))
+        reqcache.put("user", user_id, row)
+    return row
 
 async def get_tx_password_hash(user_id: int) -> Optional[str]:
-    row = await fetchone("SELECT tx_password_hash FROM users WHERE id=%s", (user_id,))
+    row = await get_user(user_id)
     return row.get("tx_password_hash") if row else None
 
 async def has_tx_password(user_id: int) -> bool:
@@ -115,11 +147,23 @@ async def set_tx_password_hash(user_id: int, pwd_hash: str) -> None:
         "UPDATE users SET tx_password_hash=%s WHERE id=%s",
         (pwd_hash, user_id)
     )
+    reqcache.invalidate("user", user_id)
 
 # ===== 钱包 =====
 
-async def get_wallet(user_id: int) -> Optional[Dict[str, Any]]:
-    return await fetchone("SELECT * FROM user_wallets WHERE user_id=%s", (user_id,))
+async def get_wallet(user_id: int, conn=None, for_update: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    for_update=True 仅在事务内（传入 conn）使用：锁定钱包行，防止并发读改写。
+    事务内读取不走 Update 级缓存，读到的行也不回填（未提交）。
+    """
+    if conn is not None:
+        sql = "SELECT * FROM user_wallets WHERE user_id=%s" + (" FOR UPDATE" if for_update else "")
+        return await fetchone(sql, (user_id,), conn=conn)
+    row = reqcache.get("wallet", user_id)
+    if reqcache.is_miss(row):
+        row = await fetchone("SELECT * FROM user_wallets WHERE user_id=%s", (user_id,))
+        reqcache.put("wallet", user_id, row)
+    return row
 
 async def set_tron_wallet(user_id: int, address: str, privkey_enc: str):
     await execute(
@@ -128,9 +172,21 @@ async def set_tron_wallet(user_id: int, address: str, privkey_enc: str):
         "ON DUPLICATE KEY UPDATE tron_address=VALUES(tron_address), tron_privkey_enc=VALUES(tron_privkey_enc)",
         (user_id, address, privkey_enc)
     )
+    reqcache.invalidate("wallet", user_id)
+
+async def update_wallet_balance(user_id: int, new_bal: float, conn=None):
+    await execute("UPDATE user_wallets SET usdt_trc20_balance=%s WHERE user_id=%s", (new_bal, user_id), conn=conn)
+    reqcache.invalidate("wallet", user_id)
 
-async def update_wallet_balance(user_id: int, new_bal: float):
-    await execute("UPDATE user_wallets SET usdt_trc20_balance=%s WHERE user_id=%s", (new_bal, user_id))
+async def load_wallet_addresses() -> Dict[str, int]:
+    """全部用户充值地址 → user_id（服务端游标逐批读取，供充值扫描器做内存匹配）"""
+    # 走从库：全表扫描不占主库；刚生成、从库还没有的地址由“新订单直接查询”兜底
+    out: Dict[str, int] = {}
+    async for row in iter_rows(
+        "SELECT user_id, tron_address FROM user_wallets WHERE tron_address IS NOT NULL", (), ro=True
+    ):
+        out[row["tron_address"]] = int(row["user_id"])
+    return out
 
 async def get_available_usdt(user_id: int) -> float:
     row = await fetchone("SELECT usdt_trc20_balance AS bal, COALESCE(usdt_trc20_frozen,0) AS frz FROM user_wallets WHERE user_id=%s", (user_id,))
@@ -144,6 +200,7 @@ async def adjust_frozen(user_id: int, delta: float):
         "UPDATE user_wallets SET usdt_trc20_frozen=GREATEST(0, COALESCE(usdt_trc20_frozen,0)+%s) WHERE user_id=%s",
         (delta, user_id)
     )
+    reqcache.invalidate("wallet", user_id)
 
 async def deduct_balance_and_unfreeze(user_id: int, total: float):
     # 成功后：余额 -= total；冻结 -= total
@@ -154,14 +211,15 @@ async def deduct_balance_and_unfreeze(user_id: int, total: float):
         "WHERE user_id=%s",
         (total, total, user_id)
     )
+    reqcache.invalidate("wallet", user_id)
 # ===== 账变 =====
 async def add_ledger(user_id: int, type_: str, amount: float, before: float, after: float,
-                     ref_table: str, ref_id: int, remark: str, order_no: str):
+                     ref_table: str, ref_id: int, remark: str, order_no: str, conn=None):
     sql = ("INSERT INTO ledger(user_id, change_type, amount, balance_before, balance_after, "
            "ref_table, ref_id, remark, order_no, created_at) "
            "VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())")
     try:
-        await execute(sql, (user_id, type_, amount, before, after, ref_table, ref_id, remark, order_no))
+        await execute(sql, (user_id, type_, amount, before, after, ref_table, ref_id, remark, order_no), conn=conn)
     except Exception as e:
         s = str(e).lower()
         if "duplicate" in s or "unique" in s:
@@ -169,11 +227,47 @@ async def add_ledger(user_id: int, type_: str, amount: float, before: float, aft
         raise
 
 async def list_ledger_recent(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    # 支付/领取后紧接着展示，读主库保证看到自己刚产生的账变
+    return await fetchall(
+        "SELECT * FROM ledger WHERE user_id=%s ORDER BY id DESC LIMIT %s",
+        (user_id, limit)
+    )
+
+async def list_ledger_page(user_id: int, limit: int = 10,
+                           before_id: Optional[int] = None, after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    账变 keyset 分页（按 id，走 (user_id, id) 索引，无 OFFSET）：
+      before_id：取 id < before_id 的更早记录（下一页）
+      after_id ：取 id > after_id 的更新记录（上一页）
+      都不传  ：最新一页
+    返回按 id 倒序；调用方传 limit+1 可据多出的一行判断是否还有下一页。
+    """
+    # 读主库：用户常在充值/提现/发红包后立刻查看明细，从库落后会看不到刚发生的账变
+    if after_id is not None:
+        rows = await fetchall(
+            "SELECT * FROM ledger WHERE user_id=%s AND id>%s ORDER BY id ASC LIMIT %s",
+            (user_id, after_id, limit)
+        )
+        return list(reversed(rows))
+    if before_id is not None:
+        return await fetchall(
+            "SELECT * FROM ledger WHERE user_id=%s AND id<%s ORDER BY id DESC LIMIT %s",
+            (user_id, before_id, limit)
+        )
     return await fetchall(
         "SELECT * FROM ledger WHERE user_id=%s ORDER BY id DESC LIMIT %s",
         (user_id, limit)
     )
 
+def iter_ledger(user_id: int):
+    """用户全部账变（按 id 正序）的流式迭代器，用于导出"""
+    # 走从库：全量导出是长时间占用连接的大查询；最近几秒内的账变可能不在文件里，导出可接受
+    return iter_rows(
+        "SELECT id, created_at, change_type, amount, balance_before, balance_after, order_no, remark "
+        "FROM ledger WHERE user_id=%s ORDER BY id ASC",
+        (user_id,), ro=True
+    )
+
 async def ledger_exists_for_ref(change_type: str, ref_table: str, ref_id: int) -> bool:
     row = await fetchone(
         "SELECT COUNT(*) AS c FROM ledger WHERE change_type=%s AND ref_table=%s AND ref_id=%s",
@@ -198,6 +292,7 @@ async def soft_delete_user_address_by_id(user_id: int, addr_id: int) -> int:
     )
 
 async def list_user_addresses(user_id: int) -> List[Dict[str, Any]]:
+    # 读主库：添加/删除地址后会立即重新列出
     return await fetchall(
         "SELECT * FROM user_addresses WHERE user_id=%s AND status='active' ORDER BY id DESC",
         (user_id,)
@@ -244,17 +339,26 @@ async def get_user_address_by_alias(user_id: int, alias: str) -> Optional[Dict[s
 
 # ===== 红包 =====
 async def get_red_packet_mvp(rp_id: int) -> Optional[Dict[str, Any]]:
+    """MVP 由领取事务维护在 red_packets.mvp_user_id / mvp_amount，按主键取一行"""
+    # 读主库：最后一份领完后立即刷新面板，从库落后会漏掉 MVP
     return await fetchone(
-        "SELECT s.amount, s.claimed_by, s.claimed_at, u.display_name, u.username, u.first_name, u.last_name "
-        "FROM red_packet_shares s "
-        "LEFT JOIN users u ON u.id=s.claimed_by "
-        "WHERE s.red_packet_id=%s AND s.claimed_by IS NOT NULL "
-        "ORDER BY s.amount DESC, s.claimed_at ASC LIMIT 1",
+        "SELECT rp.mvp_amount AS amount, rp.mvp_user_id AS claimed_by, "
+        "u.display_name, u.username, u.first_name, u.last_name "
+        "FROM red_packets rp "
+        "LEFT JOIN users u ON u.id=rp.mvp_user_id "
+        "WHERE rp.id=%s AND rp.mvp_user_id IS NOT NULL",
         (rp_id,)
     )
 
 async def get_red_packet_by_no(rp_no: str) -> Optional[Dict[str, Any]]:
-    return await fetchone("SELECT * FROM red_packets WHERE rp_no=%s", (rp_no,))
+    rp_id = reqcache.get("rp_no", rp_no)
+    if not reqcache.is_miss(rp_id):
+        return await get_red_packet(rp_id)
+    row = await fetchone("SELECT * FROM red_packets WHERE rp_no=%s", (rp_no,))
+    if row:
+        reqcache.put("rp_no", rp_no, row["id"])
+        reqcache.put("rp", row["id"], row)
+    return row
 
 def make_rp_no(dt: Optional[datetime] = None) -> str:
     """red_YYYYMMDDHHMM + 4位随机小写字母"""
@@ -264,11 +368,20 @@ def make_rp_no(dt: Optional[datetime] = None) -> str:
     return "red_" + dt.strftime("%Y%m%d%H%M") + "".join(choice(string.ascii_lowercase) for _ in range(4))
 
 async def list_red_packets(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    # 读主库：发完红包后查看列表要能看到刚创建的红包
     return await fetchall(
         "SELECT * FROM red_packets WHERE owner_id=%s ORDER BY id DESC LIMIT %s",
         (user_id, limit)
     )
 
+async def list_red_packets_summary(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    """“我的红包”列表：最近 limit 个红包连同已领数量/金额，一条查询（走 owner_id,id 索引）"""
+    # 读主库：发完红包后查看列表要能看到刚创建的红包
+    return await fetchall(
+        "SELECT id, rp_no, status, total_amount, count, claimed_count, claimed_amount, created_at "
+        "FROM red_packets WHERE owner_id=%s ORDER BY id DESC LIMIT %s",
+        (user_id, limit)
+    )
 
 async def create_red_packet(owner_id: int, rp_type: str, currency: str, total_amount: float, count: int,
                             cover_text: Optional[str], cover_image_file_id: Optional[str],
@@ -283,17 +396,48 @@ async def create_red_packet(owner_id: int, rp_type: str, currency: str, total_am
                                  cover_text, cover_image_file_id, exclusive_user_id, expire_minutes))
     return new_id
 
-async def get_red_packet(rp_id: int) -> Optional[Dict[str, Any]]:
-    return await fetchone("SELECT * FROM red_packets WHERE id=%s", (rp_id,))
-
-async def set_red_packet_status(rp_id: int, status: str):
-    await execute("UPDATE red_packets SET status=%s WHERE id=%s", (status, rp_id))
+async def get_red_packet(rp_id: int, conn=None, for_update: bool = False) -> Optional[Dict[str, Any]]:
+    """事务内（传入 conn）直读主库，不走 Update 级缓存"""
+    if conn is not None:
+        sql = "SELECT * FROM red_packets WHERE id=%s" + (" FOR UPDATE" if for_update else "")
+        return await fetchone(sql, (rp_id,), conn=conn)
+    row = reqcache.get("rp", rp_id)
+    if reqcache.is_miss(row):
+        row = await fetchone("SELECT * FROM red_packets WHERE id=%s", (rp_id,))
+        reqcache.put("rp", rp_id, row)
+    return row
+
+async def set_red_packet_status(rp_id: int, status: str, conn=None):
+    await execute("UPDATE red_packets SET status=%s WHERE id=%s", (status, rp_id), conn=conn)
+    reqcache.invalidate("rp", rp_id)
+    # 事务内的修改尚未提交：只失效，由调用方在提交后再失效一次（见支付流程）
+    if conn is None:
+        packetstate.note_status(rp_id, status)
+    else:
+        packetstate.invalidate(rp_id)
 
 async def set_red_packet_message(rp_id: int, chat_id: int, message_id: int):
     await execute("UPDATE red_packets SET chat_id=%s, message_id=%s WHERE id=%s", (chat_id, message_id, rp_id))
+    reqcache.invalidate("rp", rp_id)
+
+# 草稿阶段允许用户修改的列
+_RP_EDITABLE_FIELDS = ("count", "total_amount", "type", "exclusive_user_id", "cover_text", "cover_image_file_id")
+
+async def update_red_packet_fields(rp_id: int, **fields):
+    """更新红包设置项（仅限白名单列），并使 Update 级缓存与红包状态缓存失效"""
+    bad = [k for k in fields if k not in _RP_EDITABLE_FIELDS]
+    if bad:
+        raise ValueError(f"不可修改的红包字段：{bad}")
+    if not fields:
+        return
+    cols = ", ".join(f"{k}=%s" for k in fields)
+    await execute(f"UPDATE red_packets SET {cols} WHERE id=%s", (*fields.values(), rp_id))
+    reqcache.invalidate("rp", rp_id)
+    packetstate.invalidate(rp_id)
 
 async def list_red_packet_top_claims(rp_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    return await fetchall(
+    # 走从库：领取记录由其他用户写入，晚几秒出现在列表里可接受
+    return await fetchall_ro(
         "SELECT s.seq, s.amount, s.claimed_by, s.claimed_at, u.username, u.first_name, u.last_name, u.display_name "
         "FROM red_packet_shares s LEFT JOIN users u ON u.id=s.claimed_by "
         "WHERE s.red_packet_id=%s AND s.claimed_by IS NOT NULL "
@@ -301,8 +445,50 @@ async def list_red_packet_top_claims(rp_id: int, limit: int = 10) -> List[Dict[s
         (rp_id, limit)
     )
 
+_USER_COLS = ("display_name", "username", "first_name", "last_name")
+
+async def get_red_packet_snapshot(rp_id: int, top: int = 10) -> Optional[Dict[str, Any]]:
+    """
+    领取面板所需的全部数据，两条查询：
+      1) 红包行 + 创建人 + MVP 用户（主键 JOIN）
+      2) 前 top 条领取记录 JOIN 用户（LIMIT 下推到 SQL）
+    返回 {"packet": 红包行, "owner": 用户名字段, "mvp": {...}|None, "claims": [...]}；
+    面板在领取后渲染，需读到最新计数，因此走主库。
+    """
+    row = await fetchone(
+        "SELECT rp.*, "
+        "o.display_name AS o_display_name, o.username AS o_username, "
+        "o.first_name AS o_first_name, o.last_name AS o_last_name, "
+        "m.display_name AS m_display_name, m.username AS m_username, "
+        "m.first_name AS m_first_name, m.last_name AS m_last_name "
+        "FROM red_packets rp "
+        "LEFT JOIN users o ON o.id=rp.owner_id "
+        "LEFT JOIN users m ON m.id=rp.mvp_user_id "
+        "WHERE rp.id=%s",
+        (rp_id,)
+    )
+    if not row:
+        return None
+    owner = {k: row.pop("o_" + k) for k in _USER_COLS}
+    mvp = {k: row.pop("m_" + k) for k in _USER_COLS}
+    if row.get("mvp_user_id"):
+        mvp.update(claimed_by=row["mvp_user_id"], amount=row["mvp_amount"])
+    else:
+        mvp = None
+    claims = []
+    if int(row.get("claimed_count") or 0) > 0:
+        claims = await fetchall(
+            "SELECT s.seq, s.amount, s.claimed_by, s.claimed_at, u.username, u.first_name, u.last_name, u.display_name "
+            "FROM red_packet_shares s LEFT JOIN users u ON u.id=s.claimed_by "
+            "WHERE s.red_packet_id=%s AND s.claimed_by IS NOT NULL "
+            "ORDER BY s.claimed_at ASC, s.id ASC LIMIT %s",
+            (rp_id, top)
+        )
+    return {"packet": row, "owner": owner, "mvp": mvp, "claims": claims}
+
 async def list_red_packet_claims(rp_id: int) -> List[Dict[str, Any]]:
-    return await fetchall(
+    # 走从库：领取记录由其他用户写入，详情页晚几秒出现可接受（已领数量取自主库的红包行）
+    return await fetchall_ro(
         "SELECT s.seq, s.amount, s.claimed_by, s.claimed_at, u.username, u.first_name, u.last_name, u.display_name "
         "FROM red_packet_shares s LEFT JOIN users u ON u.id=s.claimed_by "
         "WHERE s.red_packet_id=%s AND s.claimed_by IS NOT NULL "
@@ -310,11 +496,55 @@ async def list_red_packet_claims(rp_id: int) -> List[Dict[str, Any]]:
         (rp_id,)
     )
 
-async def save_red_packet_share(rp_id: int, seq: int, amount: float):
+async def save_red_packet_share(rp_id: int, seq: int, amount: float, conn=None):
     await execute(
         "INSERT INTO red_packet_shares(red_packet_id, seq, amount) VALUES(%s,%s,%s) "
         "ON DUPLICATE KEY UPDATE amount=VALUES(amount)",
-        (rp_id, seq, amount)
+        (rp_id, seq, amount),
+        conn=conn
+    )
+
+SHARE_INSERT_CHUNK = 500
+
+async def save_red_packet_shares(rp_id: int, amounts: List[Any], conn=None, chunk: int = SHARE_INSERT_CHUNK):
+    """
+    批量写入份额：seq 从 1 开始，按 chunk 拆成多条 INSERT ... VALUES (...),(...)。
+    amounts 为 split_random / split_average 的结果。
+    """
+    rows = [(rp_id, i, float(a)) for i, a in enumerate(amounts, 1)]
+    for k in range(0, len(rows), chunk):
+        part = rows[k:k + chunk]
+        sql = (
+            "INSERT INTO red_packet_shares(red_packet_id, seq, amount) VALUES "
+            + ",".join(["(%s,%s,%s)"] * len(part))
+            + " ON DUPLICATE KEY UPDATE amount=VALUES(amount)"
+        )
+        args = tuple(v for row in part for v in row)
+        await execute(sql, args, conn=conn)
+
+async def prepare_red_packet_shares(rp: Dict[str, Any], conn=None) -> bool:
+    """
+    支付时准备份额（需在支付事务内调用）：
+      份数 ≥ LAZY_SHARES_MIN_COUNT：只写入 split_seed / split_version，份额在领取时计算并落库，返回 True
+      否则：一次性拆分并批量写入全部份额，返回 False
+    """
+    count = int(rp["count"])
+    version = SPLIT_MODES.get(RED_PACKET_SPLIT_MODE, SPLIT_V2_DOUBLE_MEAN)
+    if LAZY_SHARES_MIN_COUNT and count >= LAZY_SHARES_MIN_COUNT:
+        await execute(
+            "UPDATE red_packets SET split_seed=%s, split_version=%s WHERE id=%s",
+            (new_split_seed(), version, rp["id"]), conn=conn
+        )
+        reqcache.invalidate("rp", rp["id"])
+        return True
+    amounts = split_for_packet(rp["type"], rp["total_amount"], count, version=version)
+    await save_red_packet_shares(rp["id"], amounts, conn=conn)
+    return False
+
+def lazy_share_amounts(rp: Dict[str, Any]) -> List[Decimal]:
+    """延迟落库红包的完整拆分（下标 0 对应 seq=1）；split_version 为空的历史红包按旧算法重算"""
+    return split_for_packet(
+        rp["type"], rp["total_amount"], int(rp["count"]), int(rp["split_seed"]), rp.get("split_version")
     )
 
 async def list_red_packet_shares(rp_id: int) -> List[Dict[str, Any]]:
@@ -341,10 +571,7 @@ async def claim_share(rp_id: int, user_id: int) -> Optional[Dict[str, Any]]:
     return got
 
 async def count_claimed(rp_id: int) -> int:
-    row = await fetchone(
-        "SELECT COUNT(*) AS c FROM red_packet_shares WHERE red_packet_id=%s AND claimed_by IS NOT NULL",
-        (rp_id,)
-    )
+    row = await fetchone("SELECT claimed_count AS c FROM red_packets WHERE id=%s", (rp_id,))
     return int(row["c"] if row and row.get("c") is not None else 0)
 
 
@@ -353,6 +580,7 @@ async def list_recent_claims_with_creator(user_id: int, limit: int = 10) -> List
     我最近领取的红包记录（从 shares 表推导），并带上创建人信息。
     列：claimed_at, amount, owner.display_name / username / first/last
     """
+    # 读主库：用户刚领完红包就会来看自己的领取记录
     return await fetchall(
         "SELECT s.claimed_at, s.amount, rp.owner_id, "
         "u.display_name, u.username, u.first_name, u.last_name "
@@ -407,12 +635,141 @@ async def list_user_active_red_packets(owner_id: int) -> List[Dict[str, Any]]:
     )
 
 async def sum_claimed_amount(rp_id: int) -> float:
-    row = await fetchone(
-        "SELECT COALESCE(SUM(amount),0) AS s FROM red_packet_shares WHERE red_packet_id=%s AND claimed_by IS NOT NULL",
-        (rp_id,)
-    )
+    row = await fetchone("SELECT claimed_amount AS s FROM red_packets WHERE id=%s", (rp_id,))
     return float(row["s"] if row else 0.0)
 
+# 回收时锁定红包行所需的列
+_REFUND_COLS = "id, rp_no, owner_id, type, total_amount, claimed_amount"
+
+async def _refund_packets_in_tx(conn, packets: List[Dict[str, Any]], remark: str) -> Dict[int, Dict[str, Any]]:
+    """
+    集合式回收（须在事务内、红包行已按 id 升序 FOR UPDATE 锁定后调用）：
+      1) 一条 UPDATE 把这些红包置为 finished；
+      2) 剩余 = total_amount - claimed_amount（领取事务与此互斥地维护该列），按创建人汇总；
+      3) 一条 SELECT ... FOR UPDATE 锁定涉及的钱包，每个创建人一条 UPDATE 入账；
+      4) 全部退款账变一条多行 INSERT（订单号 red_refund_<rp_no>）。
+    账变里已有同订单号的红包视为已退过款，只关闭不再入账（重复执行幂等）。
+    返回 {owner_id: {"closed", "refunded", "amount", "before", "after"}}；未退款的创建人 before/after 为 None。
+    """
+    if not packets:
+        return {}
+    ids = [int(r["id"]) for r in packets]
+    await execute(
+        f"UPDATE red_packets SET status='finished' WHERE id IN ({','.join(['%s'] * len(ids))})",
+        tuple(ids), conn=conn
+    )
+
+    by_owner: Dict[int, List[Tuple[Dict[str, Any], Decimal, str]]] = {}
+    for r in packets:
+        remain = Decimal(str(r["total_amount"])) - Decimal(str(r.get("claimed_amount") or 0))
+        order_no = f"red_refund_{r.get('rp_no') or 'rp%s' % r['id']}"
+        by_owner.setdefault(int(r["owner_id"]), []).append((r, remain, order_no))
+
+    orders = [o for items in by_owner.values() for _, remain, o in items if remain > 0]
+    done = set()
+    if orders:
+        owners = list(by_owner)
+        rows = await fetchall(
+            f"SELECT user_id, order_no FROM ledger WHERE user_id IN ({','.join(['%s'] * len(owners))}) "
+            f"AND order_no IN ({','.join(['%s'] * len(orders))})",
+            (*owners, *orders), conn=conn
+        )
+        done = {(int(x["user_id"]), x["order_no"]) for x in rows}
+
+    todo = {
+        owner: [(r, remain, o) for r, remain, o in items if remain > 0 and (owner, o) not in done]
+        for owner, items in by_owner.items()
+    }
+    payees = sorted(owner for owner, items in todo.items() if items)
+    wallets = {}
+    if payees:
+        rows = await fetchall(
+            f"SELECT user_id, usdt_trc20_balance FROM user_wallets "
+            f"WHERE user_id IN ({','.join(['%s'] * len(payees))}) ORDER BY user_id ASC FOR UPDATE",
+            tuple(payees), conn=conn
+        )
+        wallets = {int(x["user_id"]): Decimal(str(x["usdt_trc20_balance"] or 0)) for x in rows}
+
+    result: Dict[int, Dict[str, Any]] = {}
+    ledger_rows = []
+    for owner in sorted(by_owner):
+        items = todo[owner]
+        res = result[owner] = {"closed": len(by_owner[owner]), "refunded": len(items),
+                               "amount": Decimal("0"), "before": None, "after": None}
+        if not items:
+            continue
+        before = bal = wallets.get(owner, Decimal("0"))
+        for r, remain, order_no in items:
+            ledger_rows.append((owner, "redpacket_refund", float(remain), float(bal), float(bal + remain),
+                                "red_packets", r["id"], remark, order_no))
+            bal += remain
+        res.update(amount=bal - before, before=before, after=bal)
+        if owner in wallets:
+            await update_wallet_balance(owner, float(bal), conn=conn)
+        else:
+            await execute(
+                "INSERT INTO user_wallets(user_id, usdt_trc20_balance, created_at) VALUES(%s,%s,NOW()) "
+                "ON DUPLICATE KEY UPDATE usdt_trc20_balance=VALUES(usdt_trc20_balance)",
+                (owner, float(bal)), conn=conn
+            )
+
+    if ledger_rows:
+        await execute(
+            "INSERT INTO ledger(user_id, change_type, amount, balance_before, balance_after, "
+            "ref_table, ref_id, remark, order_no, created_at) VALUES "
+            + ",".join(["(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())"] * len(ledger_rows)),
+            tuple(v for row in ledger_rows for v in row), conn=conn
+        )
+    for rp_id in ids:
+        reqcache.invalidate("rp", rp_id)
+        packetstate.invalidate(rp_id)
+    for owner in payees:
+        reqcache.invalidate("wallet", owner)
+    return result
+
+def _note_refunded(packets: List[Dict[str, Any]]):
+    # 提交后再失效一次：事务期间并发读可能把旧状态重新缓存，下次读取将以终态常驻
+    for r in packets:
+        packetstate.invalidate(int(r["id"]))
+
+async def refund_expired_red_packets(limit: int = 200) -> Tuple[List[Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+    """
+    回收一批过期红包（状态 paid/sent 且 expires_at <= NOW()），单事务：
+    锁定最早的 limit 个 → 批量置 finished → 按创建人汇总入账 → 多行记账。
+    返回 (本批红包行, 按创建人的结果)；本批不足 limit 个说明已清空积压。
+    """
+    async with transaction() as conn:
+        rps = await fetchall(
+            f"SELECT {_REFUND_COLS} FROM red_packets "
+            "WHERE status IN ('paid','sent') AND expires_at IS NOT NULL AND expires_at <= NOW() "
+            "ORDER BY id ASC LIMIT %s FOR UPDATE",
+            (limit,), conn=conn
+        )
+        res = await _refund_packets_in_tx(conn, rps, "红包超过24小时未领取自动退款")
+    _note_refunded(rps)
+    return rps, res
+
+async def refund_active_red_packets(owner_id: int, limit: int = 100) -> Dict[str, Any]:
+    """
+    回收某用户所有使用中（paid/sent）的红包，单事务完成：锁红包行 → 批量关闭 → 一次入账 → 多行记账。
+    返回 {"ids": [...], "closed", "refunded", "amount", "balance"}；没有退款时 balance 为 None。
+    """
+    async with transaction() as conn:
+        rps = await fetchall(
+            f"SELECT {_REFUND_COLS} FROM red_packets "
+            "WHERE owner_id=%s AND status IN ('paid','sent') ORDER BY id ASC LIMIT %s FOR UPDATE",
+            (owner_id, limit), conn=conn
+        )
+        res = (await _refund_packets_in_tx(conn, rps, "红包退回（批量回收）")).get(owner_id) or {}
+    _note_refunded(rps)
+    return {
+        "ids": [int(r["id"]) for r in rps],
+        "closed": res.get("closed", 0),
+        "refunded": res.get("refunded", 0),
+        "amount": res.get("amount", Decimal("0")),
+        "balance": res.get("after"),
+    }
+
 
 async def list_expired_red_packets(limit: int = 200) -> List[Dict[str, Any]]:
     """
@@ -426,74 +783,142 @@ async def list_expired_red_packets(limit: int = 200) -> List[Dict[str, Any]]:
     )
 
 
-async def claim_share_atomic(rp_id: int, claimer_id: int) -> Optional[tuple]:
+class _PacketClosed(Exception):
+    """领取事务内发现红包已不在使用中（已回收/已结束），用于回滚已占用的份额"""
+
+class AlreadyClaimed(Exception):
+    """该用户已领取过此红包（red_packet_shares 上 (red_packet_id, claimed_by) 唯一）"""
+
+def _raise_if_dup_claimer(e: Exception):
+    msg = str(e).lower()
+    if "duplicate" in msg and "uq_packet_claimer" in msg:
+        raise AlreadyClaimed() from e
+
+async def _insert_claimed_share(conn, rp_id: int, claimer_id: int, seq: int, amt: Decimal) -> Optional[int]:
+    """延迟落库：领取时插入份额行；该 seq 已被别人插入返回 None"""
+    try:
+        return await execute(
+            "INSERT INTO red_packet_shares(red_packet_id, seq, amount, claimed_by, claimed_at) "
+            "VALUES(%s,%s,%s,%s,NOW())",
+            (rp_id, seq, amt, claimer_id), conn=conn
+        )
+    except Exception as e:
+        _raise_if_dup_claimer(e)
+        if "duplicate" in str(e).lower():
+            return None
+        raise
+
+async def _take_share(conn, rp_id: int, claimer_id: int, share) -> Optional[Tuple[int, int, Decimal]]:
     """
-    原子领取：抢到一份 → 标记份额 → 入账到钱包 → 记账
-    返回 (share_id, amount)；若无可领返回 None
+    在事务内占用一份，返回 (share_id, seq, amount)；没抢到返回 None；重复领取抛 AlreadyClaimed。
+    share 为调度器指定的 (share_id, seq, amount)；share_id 为 None 表示延迟落库的份额。
     """
-    async with (await get_conn()) as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            try:
-                await conn.begin()
-                # 1) 锁定一个未领取份额
-                await cur.execute(
-                    "SELECT id, seq, amount FROM red_packet_shares "
-                    "WHERE red_packet_id=%s AND claimed_by IS NULL "
-                    "ORDER BY id ASC LIMIT 1 FOR UPDATE",
-                    (rp_id,)
-                )
-                srow = await cur.fetchone()
-                if not srow:
-                    await conn.rollback()
-                    return None
-                share_id = int(srow["id"])
-                seq = int(srow["seq"])
-                amt = Decimal(str(srow["amount"]))
-
-                # 2) 占用该份额
-                await cur.execute(
-                    "UPDATE red_packet_shares SET claimed_by=%s, claimed_at=NOW() "
-                    "WHERE id=%s AND claimed_by IS NULL",
-                    (claimer_id, share_id)
-                )
-                if cur.rowcount != 1:
-                    await conn.rollback()
-                    return None
-
-                # 3) 查询红包编号（用于账变订单号）
-                await cur.execute("SELECT rp_no FROM red_packets WHERE id=%s", (rp_id,))
-                rprow = await cur.fetchone()
-                rp_no = rprow["rp_no"] if rprow else f"rp{rp_id}"
-
-                # 4) 入账钱包（加钱）—— 若无钱包记录则插入一行
-                await cur.execute("SELECT usdt_trc20_balance FROM user_wallets WHERE user_id=%s FOR UPDATE", (claimer_id,))
-                w = await cur.fetchone()
-                before = Decimal(str((w or {}).get("usdt_trc20_balance") or 0))
-                after = before + amt
-                if w is None:
-                    await cur.execute(
-                        "INSERT INTO user_wallets(user_id, usdt_trc20_balance, created_at) "
-                        "VALUES(%s,%s,NOW()) "
-                        "ON DUPLICATE KEY UPDATE usdt_trc20_balance=VALUES(usdt_trc20_balance)",
-                        (claimer_id, float(after))
-                    )
-                else:
-                    await cur.execute("UPDATE user_wallets SET usdt_trc20_balance=%s WHERE user_id=%s",
-                                      (float(after), claimer_id))
-
-                # 5) 记账（(user_id, order_no) 唯一）
-                order_no = f"red_claim_{rp_no}_{seq:03d}"
-                remark = f"领取红包 {rp_no} #{seq}"
-                await cur.execute(
-                    "INSERT INTO ledger(user_id, change_type, amount, balance_before, balance_after, "
-                    "ref_table, ref_id, remark, order_no, created_at) "
-                    "VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())",
-                    (claimer_id, "redpacket_claim", float(amt), float(before), float(after),
-                     "red_packets", rp_id, remark, order_no)
+    if share is not None:
+        share_id, seq, amt = share[0], int(share[1]), Decimal(str(share[2]))
+        if share_id is None:
+            new_id = await _insert_claimed_share(conn, rp_id, claimer_id, seq, amt)
+            return (new_id, seq, amt) if new_id else None
+        # claimed_by IS NULL 保证跨进程也不会重复发放；uq_packet_claimer 保证同一用户只能占一份
+        try:
+            n = await execute_rowcount(
+                "UPDATE red_packet_shares SET claimed_by=%s, claimed_at=NOW() "
+                "WHERE id=%s AND red_packet_id=%s AND claimed_by IS NULL",
+                (claimer_id, share_id, rp_id), conn=conn
+            )
+        except Exception as e:
+            _raise_if_dup_claimer(e)
+            raise
+        return (int(share_id), seq, amt) if n == 1 else None
+
+    # 未经调度器：预写份额的红包锁第一个未领份额；延迟落库的按 seq 顺序尝试插入
+    rp = await fetchone("SELECT type, total_amount, count, split_seed, split_version FROM red_packets WHERE id=%s", (rp_id,), conn=conn)
+    if not rp:
+        return None
+    if rp["split_seed"] is None:
+        srow = await fetchone(
+            "SELECT id, seq, amount FROM red_packet_shares "
+            "WHERE red_packet_id=%s AND claimed_by IS NULL "
+            "ORDER BY id ASC LIMIT 1 FOR UPDATE",
+            (rp_id,), conn=conn
+        )
+        if not srow:
+            return None
+        return await _take_share(conn, rp_id, claimer_id, (srow["id"], srow["seq"], srow["amount"]))
+    taken = {int(x["seq"]) for x in await fetchall(
+        "SELECT seq FROM red_packet_shares WHERE red_packet_id=%s", (rp_id,), conn=conn)}
+    for seq, amt in enumerate(lazy_share_amounts(rp), 1):
+        if seq in taken:
+            continue
+        new_id = await _insert_claimed_share(conn, rp_id, claimer_id, seq, amt)
+        if new_id:
+            return (new_id, seq, amt)
+    return None
+
+async def claim_share_atomic(rp_id: int, claimer_id: int, share: Optional[Tuple[int, int, Any]] = None) -> Optional[tuple]:
+    """
+    原子领取：占用份额 → 累加红包计数/MVP → 入账到钱包 → 记账
+    share=(share_id, seq, amount) 由领取调度器（services/claims.py）指定，只做定向 UPDATE
+    （延迟落库的红包 share_id 为 None，改为 INSERT 该 seq 的份额行）；
+    不传则退回旧逻辑：SELECT ... FOR UPDATE 锁第一个未领份额。
+    加锁顺序：份额 → 红包 → 钱包。
+    返回 (share_id, amount)；份额已被占用 / 红包不可领返回 None；重复领取抛 AlreadyClaimed
+    """
+    try:
+        async with transaction() as conn:
+            # 1) 占用一份
+            share = await _take_share(conn, rp_id, claimer_id, share)
+            if share is None:
+                return None
+            share_id, seq, amt = share
+
+            # 2) 累加已领数量/金额；金额严格大于当前 MVP 才替换（同额先领者保持 MVP）
+            #    MySQL 按书写顺序赋值：mvp_user_id 必须写在 mvp_amount 之前，比较的是旧值
+            #    status 条件兼做可领校验：红包已回收则回滚第 1 步
+            n = await execute_rowcount(
+                "UPDATE red_packets SET claimed_count=claimed_count+1, claimed_amount=claimed_amount+%s, "
+                "mvp_user_id=IF(mvp_amount IS NULL OR %s>mvp_amount, %s, mvp_user_id), "
+                "mvp_amount=IF(mvp_amount IS NULL OR %s>mvp_amount, %s, mvp_amount) "
+                "WHERE id=%s AND status IN ('paid','sent')",
+                (amt, amt, claimer_id, amt, amt, rp_id), conn=conn
+            )
+            if n != 1:
+                raise _PacketClosed()
+
+            # 3) 红包编号（用于账变订单号）+ 累加后的计数（提交后写入状态缓存）
+            rprow = await fetchone(
+                "SELECT rp_no, claimed_count, claimed_amount FROM red_packets WHERE id=%s", (rp_id,), conn=conn
+            )
+            rp_no = (rprow or {}).get("rp_no") or f"rp{rp_id}"
+
+            # 4) 入账钱包（加钱）—— 若无钱包记录则插入一行
+            w = await fetchone("SELECT usdt_trc20_balance FROM user_wallets WHERE user_id=%s FOR UPDATE",
+                               (claimer_id,), conn=conn)
+            before = Decimal(str((w or {}).get("usdt_trc20_balance") or 0))
+            after = before + amt
+            if w is None:
+                await execute(
+                    "INSERT INTO user_wallets(user_id, usdt_trc20_balance, created_at) "
+                    "VALUES(%s,%s,NOW()) "
+                    "ON DUPLICATE KEY UPDATE usdt_trc20_balance=VALUES(usdt_trc20_balance)",
+                    (claimer_id, float(after)), conn=conn
                 )
-
-                await conn.commit()
-                return (share_id, float(amt))
-            except Exception:
-                await conn.rollback()
-                raise
+            else:
+                await update_wallet_balance(claimer_id, float(after), conn=conn)
+
+            # 5) 记账（(user_id, order_no) 唯一）
+            order_no = f"red_claim_{rp_no}_{seq:03d}"
+            remark = f"领取红包 {rp_no} #{seq}"
+            await execute(
+                "INSERT INTO ledger(user_id, change_type, amount, balance_before, balance_after, "
+                "ref_table, ref_id, remark, order_no, created_at) "
+                "VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())",
+                (claimer_id, "redpacket_claim", float(amt), float(before), float(after),
+                 "red_packets", rp_id, remark, order_no), conn=conn
+            )
+            reqcache.invalidate("rp", rp_id)
+            reqcache.invalidate("wallet", claimer_id)
+    except _PacketClosed:
+        return None
+    if rprow:
+        packetstate.note_claim(rp_id, int(rprow["claimed_count"]), rprow["claimed_amount"])
+    return (share_id, float(amt))
@@ -0,0 +1,126 @@
+# src/services/claims.py
+"""
+红包领取调度器（进程内）。
+
+热门红包在大群里会同时收到上百个 rp_claim 回调；如果每个都在事务里
+SELECT ... ORDER BY id LIMIT 1 FOR UPDATE，会全部排队在同一行锁上。
+这里按 rp_id 在内存里维护剩余份额队列：每个领取者直接分到一个确定的份额，
+事务里只做定向 UPDATE + 入账；队列空了后来者立即返回“已被抢完”，不再访问数据库。
+同时记录每个红包的已领用户，重复点击直接在内存里拒绝（AlreadyClaimed）。
+
+数据库仍是唯一真相：定向 UPDATE 带 claimed_by IS NULL 条件，唯一索引
+(red_packet_id, claimed_by) 保证一人一份；多进程部署或队列与库不一致时
+只会让本次尝试落空（继续取下一份）或由数据库报重复领取。
+"""
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Set, Tuple
+from ..db import fetchall, fetchone
+from ..models import claim_share_atomic, AlreadyClaimed, lazy_share_amounts
+from ..logger import redpacket_logger
+
+# 同时驻留内存的红包队列上限（LRU 淘汰，被淘汰的红包下次领取时从库重新加载）
+_MAX_PACKETS = 2000
+
+class _PacketQueue:
+    __slots__ = ("remaining", "claimers", "lock", "loaded")
+
+    def __init__(self):
+        self.remaining: Deque[Tuple[Optional[int], int, object]] = deque()   # (share_id, seq, amount)，延迟落库时 share_id=None
+        self.claimers: Set[int] = set()                             # 已领取 + 领取中的用户
+        self.lock = asyncio.Lock()
+        self.loaded = False
+
+_queues: "OrderedDict[int, _PacketQueue]" = OrderedDict()
+
+def _queue(rp_id: int) -> _PacketQueue:
+    q = _queues.get(rp_id)
+    if q is None:
+        q = _queues[rp_id] = _PacketQueue()
+        while len(_queues) > _MAX_PACKETS:
+            _queues.popitem(last=False)
+    else:
+        _queues.move_to_end(rp_id)
+    return q
+
+async def _load(rp_id: int, q: _PacketQueue):
+    # 同一红包只让第一个领取者查库，其余等它加载完
+    async with q.lock:
+        if q.loaded:
+            return
+        rp = await fetchone(
+            "SELECT type, status, total_amount, count, split_seed, split_version FROM red_packets WHERE id=%s", (rp_id,)
+        )
+        if not rp or rp["status"] not in ("paid", "sent"):
+            # 不存在或尚未支付（份额/种子还没生成）：不标记已加载，下次领取重新查库
+            return
+        rows = await fetchall(
+            "SELECT id, seq, amount, claimed_by FROM red_packet_shares "
+            "WHERE red_packet_id=%s ORDER BY id ASC",
+            (rp_id,)
+        )
+        taken = set()
+        for r in rows:
+            if r["claimed_by"] is None:
+                q.remaining.append((int(r["id"]), int(r["seq"]), r["amount"]))
+            else:
+                q.claimers.add(int(r["claimed_by"]))
+                taken.add(int(r["seq"]))
+        if rp["split_seed"] is not None:
+            # 份额延迟落库：按种子重算整份拆分，未领的 seq 入队（share_id=None，领取时 INSERT）
+            for seq, amt in enumerate(lazy_share_amounts(rp), 1):
+                if seq not in taken:
+                    q.remaining.append((None, seq, amt))
+        q.loaded = True
+
+async def claim(rp_id: int, claimer_id: int) -> Optional[tuple]:
+    """
+    领取一份：返回 (share_id, amount)；已抢完 / 红包不可领返回 None；
+    该用户已领过（或正在领取中）抛 AlreadyClaimed。
+    """
+    q = _queue(rp_id)
+    if not q.loaded:
+        await _load(rp_id, q)
+    if claimer_id in q.claimers:
+        raise AlreadyClaimed()
+    # 先占位：同一用户连点的后续请求在这里就被拒绝，不再开事务
+    q.claimers.add(claimer_id)
+    ok = False
+    try:
+        ret = await _claim_from_queue(rp_id, claimer_id, q)
+        ok = ret is not None
+        return ret
+    except AlreadyClaimed:
+        ok = True   # 数据库确认已领（其它进程领的），保留在集合里
+        raise
+    finally:
+        if not ok:
+            q.claimers.discard(claimer_id)
+
+async def _claim_from_queue(rp_id: int, claimer_id: int, q: _PacketQueue) -> Optional[tuple]:
+    while q.remaining:
+        share = q.remaining.popleft()
+        try:
+            ret = await claim_share_atomic(rp_id, claimer_id, share)
+        except Exception:
+            # 事务失败（重复领取/连接/死锁等）：份额未被占用，放回队首给下一个人
+            q.remaining.appendleft(share)
+            raise
+        if ret:
+            return ret
+        # 份额已被其它进程占用，或红包已回收：后者时清空队列，后续直接返回
+        st = await fetchone("SELECT status FROM red_packets WHERE id=%s", (rp_id,))
+        if not st or st["status"] not in ("paid", "sent"):
+            q.remaining.clear()
+            return None
+        redpacket_logger.info("🧧 领取调度：份额 #%s 已被占用，改取下一份（红包ID=%s）", share[1], rp_id)
+    return None
+
+def has_claimed(rp_id: int, claimer_id: int) -> bool:
+    """纯内存判断（队列未加载时返回 False，由 claim() 兜底）"""
+    q = _queues.get(rp_id)
+    return bool(q is not None and q.loaded and claimer_id in q.claimers)
+
+def forget(rp_id: int):
+    """红包回收/结束后丢弃其内存队列"""
+    _queues.pop(rp_id, None)
@@ -0,0 +1,123 @@
+# src/services/deposit_scanner.py
+"""
+充值扫描器：按区块区间读取 USDT 合约的 Transfer 事件，发现打到用户充值地址的入账。
+
+原做法是每轮对所有等待中订单逐个查 balanceOf，成本随订单数增长；这里改为：
+  - 检查点（sys_flags.deposit_scan_block）记录已扫描到的区块号，每轮从下一块扫到
+    链头 - DEPOSIT_SCAN_CONFIRMATIONS（已固化），单轮最多 DEPOSIT_SCAN_MAX_BLOCKS 块；
+  - 每块一次 gettransactioninfobyblocknum（有界并发 + 按 Key 限速），只解析 USDT 合约的 Transfer log；
+  - 收款地址与 user_wallets 全部 tron_address 组成的内存哈希表比对，命中即视为一笔入账。
+成本随区块数和实际入账数增长，与等待中订单数量无关。
+检查点由调用方在处理完入账后再推进（commit），中途失败下一轮会重扫同一区间，处理本身是幂等的。
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from tronpy.keys import to_hex_address, to_base58check_address
+from ..config import (
+    USDT_CONTRACT, USDT_DECIMALS, TRON_FETCH_CONCURRENCY,
+    DEPOSIT_SCAN_CONFIRMATIONS, DEPOSIT_SCAN_MAX_BLOCKS,
+)
+from ..logger import collect_logger
+from ..models import get_flag, set_flag, load_wallet_addresses
+from . import trongrid
+
+FLAG_BLOCK = "deposit_scan_block"
+FLAG_SCAN_AT = "deposit_scan_at"     # 上一轮开始时的数据库时间，用于找出此后新建的订单
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+# 事件 log 里的合约地址是去掉 41 前缀的 20 字节 hex
+_USDT_LOG_ADDR = to_hex_address(USDT_CONTRACT)[2:].lower() if USDT_CONTRACT else ""
+
+@dataclass
+class ScanResult:
+    deposits: List[Dict[str, Any]] = field(default_factory=list)
+    first_run: bool = False              # 没有检查点：本轮只建立检查点，调用方应全量查一次
+    from_block: Optional[int] = None
+    to_block: Optional[int] = None       # 本轮连续成功扫描到的最高块（None 表示没有可推进的区块）
+
+    @property
+    def addresses(self) -> List[str]:
+        return sorted({d["to"] for d in self.deposits})
+
+def _topic_address(topic: str) -> str:
+    # 32 字节 topic 的低 20 字节是地址
+    return to_base58check_address("41" + topic[-40:])
+
+def parse_transfers(infos: List[Dict[str, Any]], block: int, watch: Dict[str, int]) -> List[Dict[str, Any]]:
+    """从区块交易结果中挑出打到 watch 地址的 USDT Transfer"""
+    out = []
+    for info in infos:
+        logs = info.get("log")
+        if not logs:
+            continue
+        receipt = (info.get("receipt") or {}).get("result")
+        if receipt and receipt != "SUCCESS":
+            continue
+        for lg in logs:
+            if (lg.get("address") or "").lower() != _USDT_LOG_ADDR:
+                continue
+            topics = lg.get("topics") or []
+            if len(topics) < 3 or topics[0].lower() != TRANSFER_TOPIC:
+                continue
+            to = _topic_address(topics[2])
+            uid = watch.get(to)
+            if uid is None:
+                continue
+            out.append({
+                "txid": info.get("id"),
+                "block": block,
+                "from": _topic_address(topics[1]),
+                "to": to,
+                "user_id": uid,
+                "amount": int(lg.get("data") or "0", 16) / (10 ** USDT_DECIMALS),
+            })
+    return out
+
+async def _fetch_blocks(start: int, end: int, concurrency: int) -> List[Any]:
+    sem = asyncio.Semaphore(max(concurrency, 1))
+
+    async def one(n: int):
+        async with sem:
+            return await trongrid.get_tx_info_by_block(n)
+
+    return await asyncio.gather(*(one(n) for n in range(start, end + 1)), return_exceptions=True)
+
+async def scan(max_blocks: int = DEPOSIT_SCAN_MAX_BLOCKS,
+               concurrency: int = TRON_FETCH_CONCURRENCY) -> ScanResult:
+    """扫描检查点之后的已固化区块；不推进检查点（见 commit）"""
+    head = await trongrid.get_now_block_number()
+    safe = head - max(DEPOSIT_SCAN_CONFIRMATIONS, 0)
+    cp = await get_flag(FLAG_BLOCK)
+    if not cp:
+        # 首次启用：从当前固化高度开始，之前的入账由调用方全量查询兜底
+        collect_logger.info(f"🧭 充值扫描器初始化检查点：{safe}")
+        return ScanResult(first_run=True, to_block=safe)
+
+    start = int(cp) + 1
+    end = min(safe, start + max(max_blocks, 1) - 1)
+    if end < start:
+        return ScanResult(from_block=start)
+
+    watch = await load_wallet_addresses()
+    results = await _fetch_blocks(start, end, concurrency)
+    res = ScanResult(from_block=start)
+    # 只在连续成功的前缀上推进，失败块及其之后的区块下一轮重扫
+    for n, infos in zip(range(start, end + 1), results):
+        if isinstance(infos, Exception):
+            collect_logger.warning(f"⚠️ 区块 {n} 拉取失败，本轮扫描到 {n - 1} 为止：{infos}")
+            break
+        res.deposits.extend(parse_transfers(infos, n, watch))
+        res.to_block = n
+    collect_logger.info(
+        f"🧭 充值扫描：区块 {start}..{res.to_block if res.to_block is not None else start - 1}"
+        f"（链头 {head}），监听地址 {len(watch)} 个，命中入账 {len(res.deposits)} 笔"
+    )
+    return res
+
+async def commit(res: ScanResult):
+    """入账处理完成后推进检查点"""
+    if res.to_block is not None:
+        await set_flag(FLAG_BLOCK, str(res.to_block))
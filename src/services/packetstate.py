@@ -0,0 +1,200 @@
+# src/services/packetstate.py
+"""
+红包状态缓存（进程内，TTL + LRU）。
+
+领取回调、inline 预览、面板刷新都只需要红包的少量状态（状态/类型/专属对象/已领数量与金额），
+却在每次点击、每个按键时查库。这里按 id（及 rp_no → id）缓存这些字段：
+  - 使用中的红包缓存 PACKET_STATE_TTL 秒：其它进程（如回收任务）的修改最多延迟这么久可见；
+  - 已结束/已过期是终态，只受 LRU 淘汰，之后的点击与 inline 查询直接在内存里答复。
+本进程的写入方（领取、支付、回收、改设置）会同步更新或失效对应条目。
+同时顺带缓存面板快照（get_red_packet_snapshot 的结果），状态未变时 inline 预览复用同一份。
+"""
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional
+from ..config import PACKET_STATE_TTL
+from ..db import fetchone
+
+FINAL_STATUSES = ("finished", "expired")
+_MAX_ENTRIES = 5000
+
+_STATE_SQL = (
+    "SELECT id, rp_no, owner_id, type, status, exclusive_user_id, count, total_amount, "
+    "claimed_count, claimed_amount FROM red_packets WHERE "
+)
+
+class _Entry:
+    __slots__ = ("state", "expires", "snap")
+
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+        self.snap = None
+        self.touch()
+
+    def touch(self):
+        # 终态不过期（只会被 LRU 淘汰）
+        self.expires = None if self.state["status"] in FINAL_STATUSES else time.monotonic() + PACKET_STATE_TTL
+
+    def fresh(self) -> bool:
+        return self.expires is None or time.monotonic() < self.expires
+
+_entries: "OrderedDict[int, _Entry]" = OrderedDict()
+_by_no: Dict[str, int] = {}
+_stats = {"hits": 0, "misses": 0}
+
+# 每个红包的写入代数：note_claim / note_status / invalidate 时记为全局递增的最新值。
+# 加载（SELECT / 快照 loader）前记下 _gen_last，加载后该红包的代数超过它，
+# 说明期间有写入，读到的可能是旧行，不回填缓存。
+# 独立于 _entries（invalidate 会删条目但代数要保留）；淘汰时把被淘汰的值并入 _gen_floor，
+# 没有记录的红包代数取 _gen_floor，因此淘汰只会让判断偏向“不回填”，不会漏判。
+_gens: "OrderedDict[int, int]" = OrderedDict()
+_gen_last = 0
+_gen_floor = 0
+
+def _gen(rp_id: int) -> int:
+    return _gens.get(rp_id, _gen_floor)
+
+def _changed_since(rp_id: int, mark: int) -> bool:
+    return _gen(rp_id) > mark
+
+def _bump(rp_id: int):
+    global _gen_last, _gen_floor
+    _gen_last += 1
+    _gens[rp_id] = _gen_last
+    _gens.move_to_end(rp_id)
+    while len(_gens) > 2 * _MAX_ENTRIES:
+        _, g = _gens.popitem(last=False)
+        _gen_floor = max(_gen_floor, g)
+
+def _view(st: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(st)
+    count, claimed = int(st["count"] or 0), int(st["claimed_count"] or 0)
+    out["remaining_count"] = max(count - claimed, 0)
+    out["remaining_amount"] = Decimal(str(st["total_amount"] or 0)) - Decimal(str(st["claimed_amount"] or 0))
+    return out
+
+def _merge(old: Dict[str, Any], row: Dict[str, Any]) -> Dict[str, Any]:
+    # 已领数量/金额只增不减，终态不会回退：乱序到达的旧数据不能覆盖新数据
+    st = dict(row)
+    if int(old.get("claimed_count") or 0) > int(st.get("claimed_count") or 0):
+        st["claimed_count"] = old["claimed_count"]
+    if Decimal(str(old.get("claimed_amount") or 0)) > Decimal(str(st.get("claimed_amount") or 0)):
+        st["claimed_amount"] = old["claimed_amount"]
+    if old.get("status") in FINAL_STATUSES and st.get("status") not in FINAL_STATUSES:
+        st["status"] = old["status"]
+    return st
+
+def _store(row: Dict[str, Any]) -> _Entry:
+    rp_id = int(row["id"])
+    e = _entries.get(rp_id)
+    if e is None:
+        e = _entries[rp_id] = _Entry(dict(row))
+        while len(_entries) > _MAX_ENTRIES:
+            old_id, old = _entries.popitem(last=False)
+            _by_no.pop(old.state.get("rp_no"), None)
+    else:
+        e.state, e.snap = _merge(e.state, row), None
+        e.touch()
+        _entries.move_to_end(rp_id)
+    if row.get("rp_no"):
+        _by_no[row["rp_no"]] = rp_id
+    return e
+
+def _lookup(rp_id: int) -> Optional[_Entry]:
+    e = _entries.get(rp_id)
+    if e is None or not e.fresh():
+        return None
+    _entries.move_to_end(rp_id)
+    return e
+
+async def _load(where: str, key) -> Optional[Dict[str, Any]]:
+    """查库；查询期间该红包有写入（代数变化）时只把结果返回给本次调用，不回填缓存"""
+    _stats["misses"] += 1
+    mark = _gen_last
+    row = await fetchone(_STATE_SQL + where, (key,))
+    if not row:
+        return None
+    if _changed_since(int(row["id"]), mark):
+        return row
+    return _store(row).state
+
+async def get(rp_id: int) -> Optional[Dict[str, Any]]:
+    """红包状态（副本，附带 remaining_count / remaining_amount）；不存在返回 None（不缓存）"""
+    e = _lookup(rp_id)
+    if e is not None:
+        _stats["hits"] += 1
+        st = e.state
+    else:
+        st = await _load("id=%s", rp_id)
+    return _view(st) if st else None
+
+async def get_by_no(rp_no: str) -> Optional[Dict[str, Any]]:
+    rp_id = _by_no.get(rp_no)
+    e = _lookup(rp_id) if rp_id is not None else None
+    if e is not None:
+        _stats["hits"] += 1
+        st = e.state
+    else:
+        st = await _load("rp_no=%s", rp_no)
+    return _view(st) if st else None
+
+def is_final(st: Optional[Dict[str, Any]]) -> bool:
+    return bool(st) and st["status"] in FINAL_STATUSES
+
+async def get_snapshot(rp_id: int, loader: Callable[[int], Awaitable[Optional[Dict[str, Any]]]]):
+    """
+    面板快照：缓存条目新鲜且自上次快照后没有领取/状态变化时复用，否则调用 loader 重新生成。
+    返回的字典为共享只读对象，调用方不要修改。
+    """
+    e = _lookup(rp_id)
+    if e is not None and e.snap is not None:
+        _stats["hits"] += 1
+        return e.snap
+    mark = _gen_last
+    snap = await loader(rp_id)
+    if snap and not _changed_since(rp_id, mark):
+        p = snap["packet"]
+        e = _store({k: p.get(k) for k in (
+            "id", "rp_no", "owner_id", "type", "status", "exclusive_user_id",
+            "count", "total_amount", "claimed_count", "claimed_amount",
+        )})
+        e.snap = snap
+    return snap
+
+# ===== 写入方同步 =====
+
+def note_claim(rp_id: int, claimed_count: int, claimed_amount):
+    """
+    领取事务提交后写入最新的已领数量/金额（取自同一事务内的红包行）。
+    同一红包的多个领取并发提交时回调可能乱序到达，只取较大值。
+    """
+    _bump(rp_id)
+    e = _entries.get(rp_id)
+    if e is None:
+        return
+    if int(claimed_count) > int(e.state["claimed_count"] or 0):
+        e.state["claimed_count"] = claimed_count
+    if Decimal(str(claimed_amount or 0)) > Decimal(str(e.state["claimed_amount"] or 0)):
+        e.state["claimed_amount"] = claimed_amount
+    e.snap = None
+
+def note_status(rp_id: int, status: str):
+    _bump(rp_id)
+    e = _entries.get(rp_id)
+    if e is None:
+        return
+    if e.state["status"] in FINAL_STATUSES and status not in FINAL_STATUSES:
+        return
+    e.state["status"] = status
+    e.snap = None
+    e.touch()
+
+def invalidate(rp_id: int):
+    _bump(rp_id)
+    e = _entries.pop(rp_id, None)
+    if e is not None:
+        _by_no.pop(e.state.get("rp_no"), None)
+
+def stats() -> Dict[str, int]:
+    return {"entries": len(_entries), **_stats}
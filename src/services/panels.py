@@ -0,0 +1,75 @@
+# src/services/panels.py
+"""
+领取面板刷新合并器。
+
+每次领取成功都 edit_message_text 会很快触发 Telegram 对同一消息/会话的编辑频率限制，
+并把编辑耗时算进领取回调。这里按消息（inline_message_id 或 chat_id+message_id）去抖：
+同一消息在 interval 秒内至多编辑一次，期间的多次请求只保留最新一次，
+编辑在后台任务里执行，不占用领取请求路径。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable
+from telegram.error import RetryAfter
+from ..config import PANEL_EDIT_INTERVAL
+from ..logger import redpacket_logger
+from ..utils import reqcache
+
+Job = Callable[[], Awaitable[None]]
+
+class PanelRefresher:
+    def __init__(self, interval: float):
+        self.interval = max(interval, 0.0)
+        self._pending: Dict[Hashable, Job] = {}
+        self._last: Dict[Hashable, float] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def schedule(self, key: Hashable, job: Job):
+        """登记一次刷新；同 key 已有待执行的刷新则用新的替换（只保留最新状态）"""
+        self._pending[key] = job
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Hashable):
+        # 后台任务继承了触发它的 Update 的上下文，脱离其读缓存，保证渲染读到最新数据
+        reqcache.detach()
+        try:
+            while key in self._pending:
+                wait = self._last.get(key, 0.0) + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                job = self._pending.pop(key, None)
+                if job is None:
+                    break
+                try:
+                    await job()
+                except RetryAfter as e:
+                    # 被限流：等待 Telegram 要求的时间后重试（期间到来的新状态会覆盖本次）
+                    delay = float(getattr(e, "retry_after", 1) or 1)
+                    redpacket_logger.warning("🧧 面板编辑被限流 %ss：%s", delay, key)
+                    self._pending.setdefault(key, job)
+                    self._last[key] = time.monotonic() + delay - self.interval
+                    continue
+                except Exception as e:
+                    redpacket_logger.warning("🧧 面板刷新失败：%s err=%s", key, e)
+                self._last[key] = time.monotonic()
+        finally:
+            self._tasks.pop(key, None)
+            # 间隔早已过去的记录没必要保留
+            now = time.monotonic()
+            for k in [k for k, t in self._last.items() if now - t > self.interval and k not in self._tasks]:
+                self._last.pop(k, None)
+
+    async def drain(self):
+        """等待当前所有待执行的刷新完成（压测 / 测试用）"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+
+refresher = PanelRefresher(PANEL_EDIT_INTERVAL)
@@ -1,22 +1,132 @@
 from decimal import Decimal, getcontext
-from typing import List
+from typing import List, Optional
 import random
 
+try:  # 可选：有 numpy 时线段切割的排序/差分走向量化，结果与纯 Python 完全一致
+    import numpy as _np
+except ImportError:
+    _np = None
+
 getcontext().prec = 28
 Q = Decimal("0.01")  # 两位小数
 
+# 拆分算法版本（写入 red_packets.split_version，延迟落库的红包按版本重算，老种子结果不变）
+SPLIT_V1_DECIMAL = 1       # 旧 Decimal 逐份循环（split_version 为 NULL 的历史红包）
+SPLIT_V2_DOUBLE_MEAN = 2   # 整数分：二倍均值
+SPLIT_V3_SEGMENT = 3       # 整数分：线段切割
+SPLIT_MODES = {"double_mean": SPLIT_V2_DOUBLE_MEAN, "segment": SPLIT_V3_SEGMENT}
+
 def _d(x) -> Decimal:
     if isinstance(x, Decimal):
         return x
     return Decimal(str(x))
 
-def split_random(total_amount: float, count: int) -> List[Decimal]:
+def _to_cents(total_amount) -> int:
+    return int(_d(total_amount).quantize(Q).scaleb(2))
+
+def _from_cents(cents: List[int]) -> List[Decimal]:
+    return [Decimal(c).scaleb(-2) for c in cents]
+
+# ===== 整数分拆分引擎 =====
+
+def split_cents_double_mean(total: int, count: int, rnd, min_c: int, max_c: int) -> List[int]:
+    """
+    二倍均值：每份在 [lo, min(hi, 2 * 剩余均值)] 内均匀取值。
+    lo/hi 保证剩下的人每人仍能拿到 [min_c, max_c]，因此总和、上下限由构造保证，无需事后修正。
     """
-    随机红包（两位小数）：
+    out = []
+    append = out.append
+    rand = rnd.random
+    remain = total
+    for left in range(count, 1, -1):
+        # 热循环：用比较代替 min()/max() 调用，10 万份时约快一倍
+        rest = left - 1
+        lo = remain - rest * max_c
+        if lo < min_c:
+            lo = min_c
+        hi = remain - rest * min_c
+        if hi > max_c:
+            hi = max_c
+        top = 2 * remain // left
+        if top > hi:
+            top = hi
+        if top < lo:
+            top = lo
+        amt = lo + int(rand() * (top - lo + 1))
+        if amt > top:
+            amt = top
+        append(amt)
+        remain -= amt
+    append(remain)
+    return out
+
+def split_cents_segment(total: int, count: int, rnd, min_c: int, max_c: int) -> List[int]:
+    """
+    线段切割：先每人保底 min_c，把剩余的分数在 [0, extra] 上随机切 count-1 刀，相邻刀口之差即每份增量。
+    超过 max_c 的部分收回，再从随机位置起补给尚有余量的份额（逐轮均摊），总和与上下限由构造保证。
+    """
+    extra = total - count * min_c
+    cuts = [int(rnd.random() * (extra + 1)) for _ in range(count - 1)]
+    if _np is not None:
+        pts = _np.sort(_np.array(cuts, dtype=_np.int64))
+        parts = _np.diff(pts, prepend=0, append=extra) + min_c
+        over = int(_np.maximum(parts - max_c, 0).sum())
+        out = _np.minimum(parts, max_c).tolist()
+    else:
+        cuts.sort()
+        out, prev = [], 0
+        for c in cuts + [extra]:
+            out.append(c - prev + min_c)
+            prev = c
+        over = 0
+        for i, v in enumerate(out):
+            if v > max_c:
+                over += v - max_c
+                out[i] = max_c
+    while over > 0:
+        room = [i for i, v in enumerate(out) if v < max_c]
+        # 从随机位置起环形补发（比整表 shuffle 便宜得多）
+        k = int(rnd.random() * len(room))
+        each = -(-over // len(room))
+        for i in room[k:] + room[:k]:
+            add = min(each, max_c - out[i], over)
+            out[i] += add
+            over -= add
+            if over == 0:
+                break
+    return out
+
+_CENT_ENGINES = {
+    SPLIT_V2_DOUBLE_MEAN: split_cents_double_mean,
+    SPLIT_V3_SEGMENT: split_cents_segment,
+}
+
+def split_random(total_amount: float, count: int, rng: Optional[random.Random] = None,
+                 version: int = SPLIT_V2_DOUBLE_MEAN) -> List[Decimal]:
+    """
+    随机红包（两位小数，按整数分计算）：
     - 总和严格等于 total_amount（四舍五入到 0.01）
-    - 单份最大不超过 2 * 均值
+    - 单份最大不超过 2 * 均值（向下取整到分）
     - 单份最小 0.01（若 total < 0.01*count 会退化为平均）
+    - 传入 rng（如 random.Random(seed)）时结果可复现
+    version 选择引擎：SPLIT_V2_DOUBLE_MEAN / SPLIT_V3_SEGMENT；SPLIT_V1_DECIMAL 走旧实现。
+    """
+    if version == SPLIT_V1_DECIMAL:
+        return split_random_v1(total_amount, count, rng)
+    assert count >= 1
+    rnd = rng or random
+    total = _to_cents(total_amount)
+    if total < count:
+        return split_average(float(_d(total_amount).quantize(Q)), count)
+    max_c = max(1, 2 * total // count)
+    return _from_cents(_CENT_ENGINES[version](total, count, rnd, 1, max_c))
+
+def split_random_v1(total_amount: float, count: int, rng: Optional[random.Random] = None) -> List[Decimal]:
     """
+    旧版随机拆分（Decimal 逐份循环 + 末尾限幅）。
+    仅用于重算 split_version 为空的历史延迟落库红包，保证其金额与支付时一致；新红包不再使用。
+    """
+    rnd = rng or random
     assert count >= 1
     total = _d(total_amount).quantize(Q)
     mean = (total / _d(count)).quantize(Q)
@@ -40,7 +150,7 @@ def split_random(total_amount: float, count: int) -> List[Decimal]:
             min_allowed = min_per
             if max_allowed < min_allowed:
                 max_allowed = min_allowed
-            r = Decimal(str(random.random()))
+            r = Decimal(str(rnd.random()))
             amt = (min_allowed + r * (max_allowed - min_allowed)).quantize(Q)
             if amt < min_per:
                 amt = min_per
@@ -68,3 +178,19 @@ def split_average(total_amount: float, count: int) -> List[Decimal]:
     diff = total - sum(shares)
     shares[-1] = (shares[-1] + diff).quantize(Q)
     return shares
+
+def split_for_packet(rp_type: str, total_amount, count: int, seed: Optional[int] = None,
+                     version: Optional[int] = None) -> List[Decimal]:
+    """
+    按红包类型拆分。给定 seed 时结果确定：份额延迟落库的红包在领取时据此重算金额，
+    因此 total_amount 须与支付时传入的值一致（均取自 red_packets.total_amount）。
+    version 为 red_packets.split_version；None 表示历史数据（旧 Decimal 实现）。
+    """
+    total = float(_d(total_amount))
+    if rp_type == "random":
+        rng = random.Random(seed) if seed is not None else None
+        return split_random(total, count, rng=rng, version=version or SPLIT_V1_DECIMAL)
+    return split_average(total, count)
+
+def new_split_seed() -> int:
+    return random.SystemRandom().getrandbits(62)
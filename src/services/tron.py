@@ -1,16 +1,19 @@
-import asyncio, time, random, re
+import asyncio, time, random, re, threading
 from decimal import Decimal
 from dataclasses import dataclass
 from typing import List, Optional, Union, Dict
+import httpx
 import requests
 from tronpy import Tron
+from tronpy.contract import Contract
 from tronpy.keys import PrivateKey
 from tronpy.providers import HTTPProvider
 from ..config import (
     USDT_CONTRACT, TRON_FULLNODE_URL, USDT_DECIMALS,
-    TRONGRID_API_KEY, TRONGRID_QPS
+    TRONGRID_API_KEY, TRON_FETCH_CONCURRENCY
 )
 from ..logger import collect_logger
+from . import trongrid
 from tronpy.exceptions import TransactionNotFound
 from datetime import datetime
 
@@ -24,15 +27,62 @@ def _parse_keys(raw: str) -> Optional[Union[str, List[str]]]:
         return None
     return ks if len(ks) > 1 else ks[0]
 
-def _get_client() -> Tron:
-    """创建 Tron 客户端；带 TronGrid API Key（支持多个 Key 轮换）"""
-    api_keys = _parse_keys(TRONGRID_API_KEY)
-    provider = HTTPProvider(
-        endpoint_uri=TRON_FULLNODE_URL or "https://api.trongrid.io",
-        api_key=api_keys,
-        timeout=20.0,
-    )
-    return Tron(provider)
+# TRC20 标准 ABI（本地内置）：balanceOf / transfer 不再每次向节点拉取合约信息
+TRC20_ABI = [
+    {"type": "function", "name": "balanceOf", "stateMutability": "view",
+     "inputs": [{"name": "who", "type": "address"}], "outputs": [{"name": "", "type": "uint256"}]},
+    {"type": "function", "name": "transfer", "stateMutability": "nonpayable",
+     "inputs": [{"name": "to", "type": "address"}, {"name": "value", "type": "uint256"}],
+     "outputs": [{"name": "", "type": "bool"}]},
+    {"type": "function", "name": "decimals", "stateMutability": "view",
+     "inputs": [], "outputs": [{"name": "", "type": "uint8"}]},
+    {"type": "function", "name": "symbol", "stateMutability": "view",
+     "inputs": [], "outputs": [{"name": "", "type": "string"}]},
+    {"type": "event", "name": "Transfer", "anonymous": False,
+     "inputs": [{"indexed": True, "name": "from", "type": "address"},
+                {"indexed": True, "name": "to", "type": "address"},
+                {"indexed": False, "name": "value", "type": "uint256"}]},
+]
+
+class TronClientManager:
+    """
+    进程级 Tron 客户端：每个 API Key 一个 HTTPProvider（各自的 requests 会话，连接 keep-alive 复用），
+    由限速器选定 Key 后取对应客户端。HTTPProvider 收到多个 Key 时会在共享会话上逐次改写请求头，
+    线程池里并发调用会互相覆盖，因此按 Key 拆开而不是把 Key 列表交给同一个 Provider。
+    每个客户端缓存一个按本地 ABI 构造的 USDT 合约对象。
+    """
+    def __init__(self, endpoint: str, keys: Optional[Union[str, List[str]]], timeout: float = 20.0):
+        self.endpoint = endpoint
+        self.keys = [keys] if isinstance(keys, str) else list(keys or [None])
+        self.timeout = timeout
+        self._clients: Dict[Optional[str], Tron] = {}
+        self._usdt: Dict[int, Contract] = {}
+        self._lock = threading.Lock()
+
+    def client(self, key: Optional[str] = None) -> Tron:
+        if key not in self.keys:
+            key = self.keys[0]
+        with self._lock:
+            c = self._clients.get(key)
+            if c is None:
+                provider = HTTPProvider(endpoint_uri=self.endpoint, api_key=key, timeout=self.timeout)
+                c = self._clients[key] = Tron(provider)
+        return c
+
+    def usdt(self, c: Tron) -> Contract:
+        ct = self._usdt.get(id(c))
+        if ct is None:
+            ct = self._usdt[id(c)] = Contract(addr=USDT_CONTRACT, abi=TRC20_ABI, client=c)
+        return ct
+
+_clients = TronClientManager(TRON_FULLNODE_URL or "https://api.trongrid.io", _parse_keys(TRONGRID_API_KEY))
+
+def _get_client(key: Optional[str] = None) -> Tron:
+    """取 key 对应的进程级 Tron 客户端（key 由 trongrid.limiter 选出）"""
+    return _clients.client(key)
+
+def _get_usdt(c: Tron) -> Contract:
+    return _clients.usdt(c)
 
 @dataclass
 class TronAddress:
@@ -44,36 +94,19 @@ def short_addr(addr: str) -> str:
         return addr or ""
     return addr[:6] + "..." + addr[-6:]
 
-# ========== 基础工具：全局异步限速 ==========
-class AsyncRateLimiter:
-    """简单的最小间隔限速器，按 QPS 计算调用间隔"""
-    def __init__(self, qps: float):
-        self.interval = 1.0 / max(qps, 0.1)
-        self._last = 0.0
-        self._lock = asyncio.Lock()
-
-    async def wait(self):
-        async with self._lock:
-            now = time.monotonic()
-            wait_for = self.interval - (now - self._last)
-            if wait_for > 0:
-                await asyncio.sleep(wait_for)
-            self._last = time.monotonic()
-
-_limiter = AsyncRateLimiter(TRONGRID_QPS)
-
 async def _retry_with_backoff(coro_func, *args, **kwargs):
     """
-    指数退避重试：处理 401/403/429 或 requests.HTTPError
-    回退：1s / 2s / 4s / 8s（叠加轻微抖动）
+    重试：处理 401/403/429 或 requests.HTTPError / httpx.HTTPStatusError
+    429/403 已由 trongrid.limiter 让该 Key 冷却，立即重试即可落到其它 Key（只剩它时由限速器等待）；
+    其它错误指数退避：1s / 2s / 4s / 8s（叠加轻微抖动）
     """
     for attempt in range(4):
         try:
             return await coro_func(*args, **kwargs)
         except Exception as e:
             code = getattr(getattr(e, "response", None), "status_code", None)
-            if code in (401, 403, 429) or isinstance(e, requests.HTTPError):
-                delay = (2 ** attempt) + random.uniform(0, 0.5)
+            if code in (401, 403, 429) or isinstance(e, (requests.HTTPError, httpx.HTTPStatusError)):
+                delay = 0.0 if code in (403, 429) else (2 ** attempt) + random.uniform(0, 0.5)
                 collect_logger.warning(
                     f"[TronGrid] 受限/未授权，重试 {attempt+1}/4，{delay:.2f}s 后重试；err={e}"
                 )
@@ -81,6 +114,34 @@ async def _retry_with_backoff(coro_func, *args, **kwargs):
                 continue
             raise
 
+async def _grid(fn, *args, **kwargs):
+    """TronGrid 异步调用（限速在 trongrid 内按 Key 进行）+ 退避重试"""
+    return await _retry_with_backoff(fn, *args, **kwargs)
+
+async def _in_executor(fn, cost: float = 1.0):
+    """
+    tronpy 同步调用放到线程池：先由限速器选 Key（一次调用含多个 HTTP 请求，按 cost 扣令牌），
+    把该 Key 的客户端交给 fn，结束后回报响应码。
+    """
+    key = await trongrid.limiter.acquire(cost)
+    loop = asyncio.get_running_loop()
+    try:
+        ret = await loop.run_in_executor(None, fn, _get_client(key))
+    except Exception as e:
+        trongrid.limiter.report(key, getattr(getattr(e, "response", None), "status_code", None))
+        raise
+    trongrid.limiter.report(key, 200)
+    return ret
+
+def _ms_to_str(ms) -> Optional[str]:
+    # 时间：毫秒 → 本地时间字符串
+    if not ms:
+        return None
+    try:
+        return datetime.fromtimestamp(int(ms)/1000).strftime("%Y-%m-%d %H:%M:%S")
+    except Exception:
+        return None
+
 async def get_account_meta(address: str) -> Dict:
     """
     通过 TronGrid v1 查询账户元信息。
@@ -93,59 +154,38 @@ async def get_account_meta(address: str) -> Dict:
         "frozen_trx": float   # 质押(冻结)TRX总额
       }
     """
-    def _fetch():
-        headers = {}
-        if TRONGRID_API_KEY:
-            k = TRONGRID_API_KEY.split(",")[0].strip()
-            if k:
-                headers["TRON-PRO-API-KEY"] = k
-        url = f"https://api.trongrid.io/v1/accounts/{address}"
-        r = requests.get(url, headers=headers, timeout=15)
-        r.raise_for_status()
-        js = r.json() or {}
-        data = (js.get("data") or [{}])[0] if isinstance(js.get("data"), list) and js["data"] else (js.get("data") or {})
-        # 时间：毫秒 → 本地时间字符串
-        def ts(ms):
-            if not ms:
-                return None
-            try:
-                return datetime.fromtimestamp(int(ms)/1000).strftime("%Y-%m-%d %H:%M:%S")
-            except Exception:
-                return None
-        created = ts(data.get("create_time") or data.get("createTime"))
-        lastact = ts(data.get("latest_opration_time") or data.get("latestOprationTime") or data.get("latest_operation_time"))
-        # 类型
-        typ = str(data.get("type") or "").lower()
-        is_contract = (typ == "contract")
-        type_text = "合约账户" if is_contract else ("普通账户" if typ else "未知")
-        # 冻结(质押)TRX
-        frozen_v2 = data.get("frozenV2") or []
-        if isinstance(frozen_v2, dict):
-            frozen_v2 = [frozen_v2]
-        summed = 0
-        for it in frozen_v2:
-            try:
-                summed += int(it.get("amount", 0))
-            except Exception:
-                pass
-        return {
-            "created_at": created,
-            "last_active": lastact,
-            "is_contract": is_contract,
-            "type_text": type_text,
-            "frozen_trx": float(summed) / 1_000_000.0
-        }
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _fetch)
+    data = await _grid(trongrid.get_v1_account, address)
+    created = _ms_to_str(data.get("create_time") or data.get("createTime"))
+    lastact = _ms_to_str(data.get("latest_opration_time") or data.get("latestOprationTime") or data.get("latest_operation_time"))
+    # 类型
+    typ = str(data.get("type") or "").lower()
+    is_contract = (typ == "contract")
+    type_text = "合约账户" if is_contract else ("普通账户" if typ else "未知")
+    # 冻结(质押)TRX
+    frozen_v2 = data.get("frozenV2") or []
+    if isinstance(frozen_v2, dict):
+        frozen_v2 = [frozen_v2]
+    summed = 0
+    for it in frozen_v2:
+        try:
+            summed += int(it.get("amount", 0))
+        except Exception:
+            pass
+    return {
+        "created_at": created,
+        "last_active": lastact,
+        "is_contract": is_contract,
+        "type_text": type_text,
+        "frozen_trx": float(summed) / 1_000_000.0
+    }
 
 # ========== 账户/资源 ==========
-def get_trx_balance(address: str) -> float:
-    c = _get_client()
-    acc = c.get_account(address)  # dict；balance 为 Sun
+async def get_trx_balance(address: str) -> float:
+    acc = await _grid(trongrid.get_account, address)  # dict；balance 为 Sun（未激活为 {}）
     bal_sun = int(acc.get("balance", 0))
     return bal_sun / 1_000_000.0
 
-def get_account_resource(address: str) -> dict:
+async def get_account_resource(address: str) -> dict:
     """
     返回：
       {
@@ -160,9 +200,10 @@ def get_account_resource(address: str) -> dict:
         'bandwidth_stake_used': int,
       }
     """
-    c = _get_client()
-    info = c.get_account_resource(address)
+    return _parse_resource(await _grid(trongrid.get_account_resource, address))
 
+def _parse_resource(info: dict) -> dict:
+    # wallet/getaccountresource 原始字段 → get_account_resource 的返回结构
     free_total  = int(info.get('freeNetLimit', 0))
     free_used   = int(info.get('freeNetUsed', 0))
     stake_total = int(info.get('NetLimit', 0))
@@ -184,31 +225,54 @@ def get_account_resource(address: str) -> dict:
         'bandwidth_stake_used':  stake_used,
     }
 
+async def fetch_account_states(addresses, usdt: bool = True, trx: bool = True, resource: bool = True,
+                               concurrency: int = TRON_FETCH_CONCURRENCY) -> Dict[str, Dict]:
+    """
+    批量查询多个地址的状态：同时最多 concurrency 个地址，每个地址的几项查询并发进行，
+    全部经 trongrid.limiter 按 Key 限速。
+    返回 {address: {"usdt": float, "trx": float, "resource": dict}}（只含请求的项）；
+    单个地址查询失败时为 {"error": str}，不影响其它地址。
+    """
+    sem = asyncio.Semaphore(max(concurrency, 1))
+    parts = [(name, fn) for name, fn, on in (
+        ("usdt", get_usdt_balance, usdt), ("trx", get_trx_balance, trx), ("resource", get_account_resource, resource),
+    ) if on]
+
+    async def _one(addr: str):
+        async with sem:
+            try:
+                vals = await asyncio.gather(*(fn(addr) for _, fn in parts))
+                return addr, {name: v for (name, _), v in zip(parts, vals)}
+            except Exception as e:
+                collect_logger.warning(f"[TronGrid] 批量查询地址失败：{addr} err={e}")
+                return addr, {"error": str(e)}
+
+    return dict(await asyncio.gather(*(_one(a) for a in dict.fromkeys(addresses))))
+
 # ========== TRX 转账 ==========
-def wait_tx_committed(txid: str, timeout: int = 45, interval: float = 1.5) -> dict:
-    c = _get_client()
-    deadline = time.time() + timeout
-    last_err = None
-    while time.time() < deadline:
+async def wait_tx_committed(txid: str, timeout: int = 45, interval: float = 1.5) -> dict:
+    """
+    异步轮询交易回执（gettransactioninfobyid）。查询本身的网络错误/限流只记日志继续轮询，
+    不向上抛出——调用方的重试会重新广播交易。超时仍未查到则抛 TransactionNotFound。
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
         try:
-            info = c.get_transaction_info(txid)
-            if info and (info.get("result") == "SUCCESS" or info.get("blockNumber") is not None):
+            info = await trongrid.get_transaction_info(txid)
+            if info and (info.get("result") == "FAILED" or info.get("blockNumber") is not None):
                 return info
-            if info and info.get("result") == "FAILED":
-                return info
-        except TransactionNotFound as e:
-            last_err = e
-        time.sleep(interval)
-    if last_err:
-        raise last_err
-    return {}
-
-def send_trx(priv_hex: str, from_addr: str, to_addr: str, amount_trx: float) -> str:
-    c = _get_client()
-    amt_sun = int(Decimal(str(amount_trx)) * Decimal(1_000_000))
-    tx = c.trx.transfer(from_addr, to_addr, amt_sun).build().sign(PrivateKey(bytes.fromhex(priv_hex))).broadcast()
-    txid = tx.txid
-    info = wait_tx_committed(txid, timeout=45)
+        except Exception as e:
+            collect_logger.warning(f"[TronGrid] 查询交易回执失败，继续等待：txid={txid} err={e}")
+        await asyncio.sleep(interval)
+    raise TransactionNotFound(f"timeout and can not find the transaction: {txid}")
+
+async def send_trx(priv_hex: str, from_addr: str, to_addr: str, amount_trx: float) -> str:
+    def _broadcast(c: Tron):
+        amt_sun = int(Decimal(str(amount_trx)) * Decimal(1_000_000))
+        return c.trx.transfer(from_addr, to_addr, amt_sun).build().sign(PrivateKey(bytes.fromhex(priv_hex))).broadcast().txid
+
+    txid = await _in_executor(_broadcast, cost=2)
+    info = await wait_tx_committed(txid, timeout=45)
     if info and info.get("result") != "FAILED" and info.get("blockNumber") is not None:
         return txid
     raise RuntimeError(f"TRX topup not confirmed: {info or 'no-info'} txid={txid}")
@@ -222,53 +286,37 @@ def generate_address() -> TronAddress:
     )
 
 async def get_usdt_balance(address: str) -> float:
-    async def _call():
-        await _limiter.wait()
-
-        def _task():
-            c = _get_client()
-            usdt = c.get_contract(USDT_CONTRACT)
-            raw = usdt.functions.balanceOf(address)
-            return float(Decimal(raw) / (Decimal(10) ** USDT_DECIMALS))
-
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _task)
-
-    return await _retry_with_backoff(_call)
+    raw = await _grid(trongrid.trc20_balance_of, USDT_CONTRACT, address)
+    return float(Decimal(raw) / (Decimal(10) ** USDT_DECIMALS))
 
 async def usdt_transfer_all(priv_hex: str, from_addr: str, to_addr: str, amount: float) -> str:
     """
     将 amount USDT 从 from_addr 转到 to_addr，等待确认，返回 txid。
     回执非 SUCCESS（如 OUT_OF_ENERGY / REVERT），抛异常让上层重试。
+    构建/签名/广播在线程池里执行（tronpy 同步接口）；回执异步轮询，不占用线程。
     """
-    async def _call():
-        await _limiter.wait()
-
-        def _task():
-            c = _get_client()
-            usdt = c.get_contract(USDT_CONTRACT)
-            amt = int(Decimal(str(amount)) * (Decimal(10) ** USDT_DECIMALS))
-            tx = (
-                usdt.functions.transfer(to_addr, amt)
-                .with_owner(from_addr)
-                .fee_limit(30_000_000)
-                .build()
-                .sign(PrivateKey(bytes.fromhex(priv_hex)))
-                .broadcast()
-            )
-            receipt = tx.wait()
-            result = (receipt.get('receipt') or {}).get('result') or receipt.get('contractRet') or ''
-            result = str(result).upper()
-            if result != 'SUCCESS':
-                raise RuntimeError(f"transfer receipt not SUCCESS: {result}  txid={tx.txid}")
-
-            collect_logger.info(f"✅ USDT 转账确认成功：txid={tx.txid} result={result}")
-            return tx.txid
-
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _task)
-
-    return await _retry_with_backoff(_call)
+    def _broadcast(c: Tron):
+        usdt = _get_usdt(c)
+        amt = int(Decimal(str(amount)) * (Decimal(10) ** USDT_DECIMALS))
+        tx = (
+            usdt.functions.transfer(to_addr, amt)
+            .with_owner(from_addr)
+            .fee_limit(30_000_000)
+            .build()
+            .sign(PrivateKey(bytes.fromhex(priv_hex)))
+            .broadcast()
+        )
+        return tx.txid
+
+    txid = await _retry_with_backoff(_in_executor, _broadcast, cost=2)
+    receipt = await wait_tx_committed(txid, timeout=60)
+    result = (receipt.get('receipt') or {}).get('result') or receipt.get('contractRet') or ''
+    result = str(result).upper()
+    if result != 'SUCCESS':
+        raise RuntimeError(f"transfer receipt not SUCCESS: {result}  txid={txid}")
+
+    collect_logger.info(f"✅ USDT 转账确认成功：txid={txid} result={result}")
+    return txid
 
 # ========== 地址校验 ==========
 _BASE58_RE = re.compile(r"^T[1-9A-HJ-NP-Za-km-z]{33}$")
@@ -287,7 +335,7 @@ def is_valid_address(address: str) -> bool:
     return True
 
 # ========== TronGrid 最近转账 ==========
-def probe_account_type(address: str) -> Dict:
+async def probe_account_type(address: str) -> Dict:
     """
     TronScan 公开接口标签探测。
     返回 {name, tags, is_exchange, is_official}
@@ -295,9 +343,7 @@ def probe_account_type(address: str) -> Dict:
     name, tags = "", []
     try:
         url = "https://apilist.tronscanapi.com/api/account"
-        r = requests.get(url, params={"address": address}, timeout=15)
-        r.raise_for_status()
-        js = r.json() or {}
+        js = await trongrid.get_json(url, params={"address": address}, trongrid=False) or {}
         name = (js.get("name") or js.get("accountName") or "").strip()
         tags = js.get("tags") or js.get("tag") or []
         if isinstance(tags, str):
@@ -321,40 +367,26 @@ async def get_recent_transfers(address: str, limit: int = 10) -> List[Dict]:
     读取地址最近 TRC20 转账（基于 TronGrid v1）。
     返回字段：hash/from/to/amount/asset/ts(秒)
     """
-    def _fetch():
-        headers = {}
-        if TRONGRID_API_KEY:
-            k = TRONGRID_API_KEY.split(",")[0].strip()
-            if k:
-                headers["TRON-PRO-API-KEY"] = k
-        url = f"https://api.trongrid.io/v1/accounts/{address}/transactions/trc20"
-        r = requests.get(url, params={"limit": limit}, headers=headers, timeout=15)
-        r.raise_for_status()
-        js = r.json()
-        out = []
-        for it in js.get("data", []):
-            v = it.get("token_info", {}) or {}
-            decimals = int(v.get("decimals", 6))
-            sym = v.get("symbol", "USDT")
-            _from = it.get("from") or it.get("value", {}).get("from", "")
-            _to = it.get("to") or it.get("value", {}).get("to", "")
-            raw_val = it.get("value") if isinstance(it.get("value"), str) else it.get("value", {}).get("value", 0)
-            try:
-                amount = float(raw_val) / (10 ** decimals)
-            except Exception:
-                amount = 0.0
-            ts_ms = it.get("block_timestamp") or 0
-            ts = int(ts_ms // 1000) if ts_ms else 0
-            out.append({
-                "hash": it.get("transaction_id", ""),
-                "from": _from,
-                "to": _to,
-                "amount": amount,
-                "asset": sym,
-                "ts": ts,
-            })
-        return out
-
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, _fetch)
-
+    out = []
+    for it in await _grid(trongrid.get_v1_trc20_transfers, address, limit):
+        v = it.get("token_info", {}) or {}
+        decimals = int(v.get("decimals", 6))
+        sym = v.get("symbol", "USDT")
+        _from = it.get("from") or it.get("value", {}).get("from", "")
+        _to = it.get("to") or it.get("value", {}).get("to", "")
+        raw_val = it.get("value") if isinstance(it.get("value"), str) else it.get("value", {}).get("value", 0)
+        try:
+            amount = float(raw_val) / (10 ** decimals)
+        except Exception:
+            amount = 0.0
+        ts_ms = it.get("block_timestamp") or 0
+        ts = int(ts_ms // 1000) if ts_ms else 0
+        out.append({
+            "hash": it.get("transaction_id", ""),
+            "from": _from,
+            "to": _to,
+            "amount": amount,
+            "asset": sym,
+            "ts": ts,
+        })
+    return out
@@ -0,0 +1,132 @@
+# src/services/trongrid.py
+"""
+TronGrid 异步 HTTP 客户端（httpx.AsyncClient，进程内共享连接池）。
+
+只读查询直接走 HTTP API，不经 tronpy 的同步 requests 会话和线程池，
+一次慢响应只会挂起发起它的协程，不会拖住事件循环上的其它更新。
+  - wallet/*：TRON_FULLNODE_URL（可指向自建节点）
+  - v1/*：TronGrid 扩展接口（自建节点通常没有，固定走 api.trongrid.io）
+每个 TronGrid 请求先从 limiter（每个 API Key 一个令牌桶）取 Key，响应码回报给 limiter：
+429/403 的 Key 冷却降速，请求自动落到余量最大的其它 Key 上。
+非 2xx 抛 httpx.HTTPStatusError（带 response.status_code，供上层退避重试）。
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+import httpx
+from tronpy.keys import to_hex_address, to_base58check_address
+from ..config import TRON_FULLNODE_URL, TRONGRID_API_KEY, TRONGRID_QPS, TRONGRID_BURST
+from ..utils.ratelimit import KeyRateLimiter
+
+V1_BASE = "https://api.trongrid.io"
+_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+
+# 只读调用的调用方地址（与 tronpy 的默认值一致：41 + 20 字节 0），避免未激活地址作为 owner 被节点拒绝
+_ZERO_OWNER = to_base58check_address("41" + "00" * 20)
+
+_keys = [k.strip() for k in (TRONGRID_API_KEY or "").split(",") if k.strip()]
+limiter = KeyRateLimiter(_keys, TRONGRID_QPS, TRONGRID_BURST)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop = None
+
+def _http() -> httpx.AsyncClient:
+    # 连接绑定事件循环：循环变了（如脚本里多次 asyncio.run）就重建
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, headers={"Accept": "application/json"})
+        _client_loop = loop
+    return _client
+
+def key_headers(key: Optional[str]) -> Dict[str, str]:
+    # 按请求传头，不改共享会话状态
+    return {"TRON-PRO-API-KEY": key} if key else {}
+
+async def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    """经限速器取 Key 发送，并把响应码回报给限速器"""
+    key = await limiter.acquire()
+    r = await _http().request(method, url, headers=key_headers(key), **kwargs)
+    limiter.report(key, r.status_code)
+    return r
+
+async def aclose():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+async def get_json(url: str, params: Optional[Dict[str, Any]] = None, trongrid: bool = True) -> Any:
+    """GET 任意 JSON 接口（trongrid=False 时不带 API Key，用于 TronScan 等第三方接口）"""
+    if trongrid:
+        r = await _send("GET", url, params=params)
+    else:
+        r = await _http().get(url, params=params)
+    r.raise_for_status()
+    return r.json()
+
+async def _wallet(method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    base = (TRON_FULLNODE_URL or V1_BASE).rstrip("/")
+    r = await _send("POST", f"{base}/wallet/{method}", json=payload)
+    r.raise_for_status()
+    return r.json() or {}
+
+# ===== wallet/* =====
+
+async def get_account(address: str) -> Dict[str, Any]:
+    """未激活地址返回 {}"""
+    return await _wallet("getaccount", {"address": address, "visible": True})
+
+async def get_account_resource(address: str) -> Dict[str, Any]:
+    return await _wallet("getaccountresource", {"address": address, "visible": True})
+
+async def trigger_constant(owner: str, contract: str, selector: str, parameter: str) -> Dict[str, Any]:
+    ret = await _wallet("triggerconstantcontract", {
+        "owner_address": owner, "contract_address": contract,
+        "function_selector": selector, "parameter": parameter, "visible": True,
+    })
+    result = ret.get("result") or {}
+    if not result.get("result"):
+        raise RuntimeError(f"triggerconstantcontract 失败：{result.get('message') or result}")
+    return ret
+
+async def trc20_balance_of(contract: str, address: str) -> int:
+    """TRC20 balanceOf(address)，返回最小单位整数"""
+    param = to_hex_address(address)[2:].rjust(64, "0")   # 去掉 41 前缀，左补零到 32 字节
+    ret = await trigger_constant(_ZERO_OWNER, contract, "balanceOf(address)", param)
+    out = (ret.get("constant_result") or ["0"])[0] or "0"
+    return int(out, 16)
+
+async def get_transaction_info(txid: str) -> Dict[str, Any]:
+    """未上链（或尚未被节点索引）返回 {}"""
+    return await _wallet("gettransactioninfobyid", {"value": txid})
+
+async def get_now_block_number() -> int:
+    ret = await _wallet("getnowblock", {})
+    return int(((ret.get("block_header") or {}).get("raw_data") or {})["number"])
+
+async def get_tx_info_by_block(num: int) -> List[Dict[str, Any]]:
+    """区块内全部交易的执行结果（含事件 log）；空块返回 []"""
+    base = (TRON_FULLNODE_URL or V1_BASE).rstrip("/")
+    r = await _send("POST", f"{base}/wallet/gettransactioninfobyblocknum", json={"num": num})
+    r.raise_for_status()
+    ret = r.json()
+    if isinstance(ret, dict):
+        # 空块返回 {}；节点出错时返回 {"Error": ...}
+        if ret.get("Error"):
+            raise RuntimeError(f"gettransactioninfobyblocknum({num}) 失败：{ret['Error']}")
+        return []
+    return ret or []
+
+# ===== v1/* =====
+
+async def get_v1_account(address: str) -> Dict[str, Any]:
+    js = await get_json(f"{V1_BASE}/v1/accounts/{address}")
+    data = (js or {}).get("data")
+    if isinstance(data, list):
+        return data[0] if data else {}
+    return data or {}
+
+async def get_v1_trc20_transfers(address: str, limit: int = 10) -> List[Dict[str, Any]]:
+    js = await get_json(f"{V1_BASE}/v1/accounts/{address}/transactions/trc20", params={"limit": limit})
+    return (js or {}).get("data") or []
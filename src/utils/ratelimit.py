@@ -0,0 +1,110 @@
+# src/utils/ratelimit.py
+"""
+多 Key 令牌桶限速（asyncio，单事件循环内使用）。
+
+每个 API Key 一个令牌桶，速率 qps、容量 burst：
+  - acquire() 选出“最早可用”的 Key（同时可用时取剩余令牌最多的，即余量最大的），扣令牌后返回 Key；
+  - report(key, status) 反馈响应码：429/403 时该 Key 进入冷却（连续受罚指数加长）、速率减半，
+    冷却期间的请求自动转给其它 Key；成功响应让速率逐步回升到配置值（AIMD）。
+多个 Key 的配额因此可以叠加使用，而不是被一个全局最小间隔串行化。
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
+
+class _Bucket:
+    __slots__ = ("key", "rate", "tokens", "updated", "cooldown_until", "strikes",
+                 "requests", "n429", "n403")
+
+    def __init__(self, key: Optional[str], rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.requests = 0
+        self.n429 = 0
+        self.n403 = 0
+
+class KeyRateLimiter:
+    def __init__(self, keys: Sequence[Optional[str]], qps: float, burst: Optional[float] = None,
+                 min_qps: float = 0.5, cooldown_429: float = 2.0, cooldown_403: float = 30.0,
+                 max_cooldown: float = 600.0):
+        self.max_rate = max(qps, 0.1)
+        self.burst = max(burst if burst is not None else self.max_rate, 1.0)
+        self.min_rate = min(min_qps, self.max_rate)
+        self.cooldown_429 = cooldown_429
+        self.cooldown_403 = cooldown_403
+        self.max_cooldown = max_cooldown
+        self._buckets: List[_Bucket] = [_Bucket(k, self.max_rate, self.burst) for k in (list(keys) or [None])]
+        self._by_key: Dict[Optional[str], _Bucket] = {b.key: b for b in self._buckets}
+
+    def _refill(self, b: _Bucket, now: float):
+        # 冷却期间不补充令牌，冷却结束后从 0 开始按（已减半的）速率恢复
+        if now <= b.cooldown_until:
+            return
+        start = max(b.updated, b.cooldown_until)
+        b.tokens = min(self.burst, b.tokens + (now - start) * b.rate)
+        b.updated = now
+
+    def _wait_time(self, b: _Bucket, now: float, cost: float) -> float:
+        wait = max(0.0, b.cooldown_until - now)
+        return wait + max(0.0, (cost - b.tokens) / b.rate)
+
+    async def acquire(self, cost: float = 1.0) -> Optional[str]:
+        """取一个可用 Key（未配置 Key 时返回 None），必要时等待"""
+        cost = min(cost, self.burst)
+        while True:
+            now = time.monotonic()
+            best, best_wait = None, None
+            for b in self._buckets:
+                self._refill(b, now)
+                w = self._wait_time(b, now, cost)
+                if best is None or w < best_wait or (w == best_wait and b.tokens > best.tokens):
+                    best, best_wait = b, w
+            if best_wait <= 0:
+                best.tokens -= cost
+                best.requests += 1
+                return best.key
+            await asyncio.sleep(min(best_wait, 1.0))
+
+    def report(self, key: Optional[str], status: Optional[int]):
+        """反馈响应码；status 为 None（网络错误等）时不调整"""
+        b = self._by_key.get(key)
+        if b is None or status is None:
+            return
+        if status in (429, 403):
+            b.strikes += 1
+            if status == 429:
+                b.n429 += 1
+                base = self.cooldown_429
+            else:
+                b.n403 += 1
+                base = self.cooldown_403
+            now = time.monotonic()
+            b.cooldown_until = now + min(self.max_cooldown, base * (2 ** (b.strikes - 1)))
+            b.rate = max(self.min_rate, b.rate / 2)
+            b.tokens = 0.0
+            b.updated = now
+        elif status < 400:
+            b.strikes = 0
+            if b.rate < self.max_rate:
+                b.rate = min(self.max_rate, b.rate + self.max_rate * 0.02)
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        out = []
+        for b in self._buckets:
+            self._refill(b, now)
+            k = b.key or "-"
+            out.append({
+                "key": (k[:4] + "…" + k[-4:]) if len(k) > 12 else k,
+                "qps": round(b.rate, 2),
+                "tokens": round(b.tokens, 1),
+                "cooldown": round(max(0.0, b.cooldown_until - now), 1),
+                "requests": b.requests,
+                "429": b.n429,
+                "403": b.n403,
+            })
+        return out
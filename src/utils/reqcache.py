@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+单次 Update 内的读缓存（identity map）。
+
+main.py 在 group=-1 注册 TypeHandler 调 begin()，在最后一个 group 调 end()；
+同一 Update 内 get_wallet / get_user / get_red_packet 等重复按主键读取只打一次库。
+models 的写函数负责 invalidate 对应行；不在 Update 内（采集器、后台任务）时缓存不生效。
+缓存值在取出时复制一份，调用方修改返回的 dict 不会污染缓存。
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+_MISS = object()
+
+class _Scope:
+    __slots__ = ("active", "rows")
+
+    def __init__(self):
+        self.active = True
+        self.rows: Dict[Tuple[str, Hashable], Any] = {}
+
+_scope: ContextVar[Optional[_Scope]] = ContextVar("reqcache_scope", default=None)
+
+def begin():
+    """开始一个新的 Update 作用域（丢弃上一个）"""
+    old = _scope.get()
+    if old is not None:
+        old.active = False
+    _scope.set(_Scope())
+
+def end():
+    """结束当前作用域；由该 Update 派生的后台任务持有同一对象，关闭后它们也不再命中"""
+    s = _scope.get()
+    if s is not None:
+        s.active = False
+        s.rows.clear()
+    _scope.set(None)
+
+def detach():
+    """当前上下文脱离作用域（不影响原 Update），用于由 Update 派生出的后台任务"""
+    _scope.set(None)
+
+def _current() -> Optional[_Scope]:
+    s = _scope.get()
+    return s if (s is not None and s.active) else None
+
+def get(ns: str, key: Hashable) -> Any:
+    """命中返回副本；未命中或不在作用域内返回 MISS"""
+    s = _current()
+    if s is None:
+        return _MISS
+    v = s.rows.get((ns, key), _MISS)
+    if v is _MISS:
+        return _MISS
+    return dict(v) if isinstance(v, dict) else v
+
+def put(ns: str, key: Hashable, value: Any):
+    s = _current()
+    if s is not None:
+        s.rows[(ns, key)] = dict(value) if isinstance(value, dict) else value
+
+def invalidate(ns: str, key: Hashable = None):
+    """写后失效：key=None 清空整个命名空间"""
+    s = _current()
+    if s is None:
+        return
+    if key is None:
+        for k in [k for k in s.rows if k[0] == ns]:
+            s.rows.pop(k, None)
+    else:
+        s.rows.pop((ns, key), None)
+
+def is_miss(v: Any) -> bool:
+    return v is _MISS